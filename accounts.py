@@ -0,0 +1,133 @@
+# ========================================================
+# = accounts.py - Garmin/Dawarich account configuration
+# ========================================================
+from flask import current_app
+import os
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_ACCOUNT = 'default'
+ACCOUNT_FIELDS = (
+    'garmin_email', 'garmin_password',
+    'dawarich_host', 'dawarich_email', 'dawarich_password',
+    'exclude',
+)
+
+# --------------------------------------------------------
+# - Loading
+#---------------------------------------------------------
+def load_accounts(config, logger):
+    """
+    Builds the account table from ACCOUNTS_FILE, a JSON list of objects with a
+    unique 'name' and any of ACCOUNT_FIELDS. Fields an account leaves out fall
+    back to the single-account environment variables (e.g. a shared DAWARICH_HOST).
+    Without an accounts file, one 'default' account is built from the environment.
+    Returns a dict of account name -> account dict, in file order.
+    """
+    defaults = {
+        'garmin_email': config.get('GARMIN_EMAIL'),
+        'garmin_password': config.get('GARMIN_PASSWORD'),
+        'dawarich_host': config.get('DAWARICH_HOST'),
+        'dawarich_email': config.get('DAWARICH_EMAIL'),
+        'dawarich_password': config.get('DAWARICH_PASSWORD'),
+        'exclude': config.get('EXCLUDE', []),
+    }
+
+    accounts_file = config.get('ACCOUNTS_FILE')
+    if not accounts_file or not os.path.exists(accounts_file):
+        return {DEFAULT_ACCOUNT: dict(defaults, name=DEFAULT_ACCOUNT)}
+
+    try:
+        with open(accounts_file) as f:
+            entries = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read accounts file {accounts_file}: {e}. Using the default account only.")
+        return {DEFAULT_ACCOUNT: dict(defaults, name=DEFAULT_ACCOUNT)}
+
+    accounts = {}
+    for entry in entries:
+        name = str(entry.get('name', '')).strip()
+        if not re.fullmatch(r'[A-Za-z0-9_.-]+', name) or name in accounts:
+            logger.error(f"Ignoring account with a missing, invalid or duplicate name: {name!r}")
+            continue
+        account = dict(defaults, name=name)
+        account.update({key: entry[key] for key in ACCOUNT_FIELDS if entry.get(key) is not None})
+        accounts[name] = account
+
+    if not accounts:
+        logger.error(f"No valid accounts in {accounts_file}. Using the default account only.")
+        return {DEFAULT_ACCOUNT: dict(defaults, name=DEFAULT_ACCOUNT)}
+
+    logger.info(f"Loaded {len(accounts)} account(s) from {accounts_file}: {', '.join(accounts)}.")
+    return accounts
+
+
+# --------------------------------------------------------
+# - Lookup
+#---------------------------------------------------------
+def get_account(name=None):
+    """Returns the named account, or the first configured account when name is empty."""
+    accounts = current_app.config['ACCOUNTS']
+    if not name:
+        return next(iter(accounts.values()))
+    if name not in accounts:
+        raise LookupError(f"Unknown account: {name}")
+    return accounts[name]
+
+
+def account_tokenstore(account):
+    """
+    Returns (token directory, base64 token file) for an account's Garmin session.
+    The default account keeps the original single-account locations.
+    """
+    if account['name'] == DEFAULT_ACCOUNT:
+        return '/garmin/.garminconnect', '/garmin/.garminconnect_base64'
+    base = os.path.join('/garmin/accounts', account['name'])
+    os.makedirs(base, exist_ok=True)
+    return os.path.join(base, '.garminconnect'), os.path.join(base, '.garminconnect_base64')
+
+
+# --------------------------------------------------------
+# - Per-Account Workers
+#---------------------------------------------------------
+_slots_lock = threading.Lock()
+
+
+def account_slot(app, account):
+    """
+    Returns the semaphore that bounds how many sync jobs run at once for one
+    account (ACCOUNT_CONCURRENCY), so the scheduler, manual checks and custom
+    checks never hit the same Garmin/Dawarich account in parallel by default.
+    """
+    with _slots_lock:
+        slots = app.config.setdefault('_ACCOUNT_SLOTS', {})
+        if account['name'] not in slots:
+            slots[account['name']] = threading.BoundedSemaphore(app.config.get('ACCOUNT_CONCURRENCY', 1))
+        return slots[account['name']]
+
+
+def run_for_accounts(app, func, *args):
+    """
+    Runs func(account, *args) for every account in parallel, at most
+    SYNC_MAX_WORKERS at a time. Each call gets its own app context (and
+    therefore its own database session) and holds the account's slot.
+    Returns a dict of account name -> result, or the exception it raised.
+    """
+    def run_one(account):
+        with app.app_context(), account_slot(app, account):
+            try:
+                return func(account, *args)
+            except Exception as e:
+                app.logger.error(f"[{account['name']}] {func.__name__} failed: {e}", exc_info=True)
+                return e
+
+    accounts = list(app.config['ACCOUNTS'].values())
+    if len(accounts) == 1:
+        return {accounts[0]['name']: run_one(accounts[0])}
+
+    max_workers = max(1, min(app.config.get('SYNC_MAX_WORKERS', 2), len(accounts)))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='account-sync') as pool:
+        results = pool.map(run_one, accounts)
+        return {account['name']: result for account, result in zip(accounts, results)}
@@ -0,0 +1,207 @@
+# ========================================================
+# = activities.py - Local cache of Garmin activity summaries
+# ========================================================
+from flask import current_app
+import re
+import datetime
+from models import db, Activity, ListedDay, DownloadRecord
+
+# A listed day is only trusted once it has been over this long, because
+# devices can sync activities to Garmin Connect days after they were recorded.
+LISTING_SETTLE_DAYS = 7
+# Why an activity is not downloaded. 'no_gps' is only re-checked on request,
+# 'excluded' is re-evaluated against the exclusions on every run.
+SKIP_NO_GPS = 'no_gps'
+SKIP_EXCLUDED = 'excluded'
+ACTIVITY_FILENAME_RE = re.compile(r'^\d{4}-\d{2}-\d{2}_(\d+)\.')
+
+# --------------------------------------------------------
+# - Summaries
+#---------------------------------------------------------
+def summary_to_row(act, account_name):
+    """Converts one Garmin activity summary into a row for the activities table."""
+    start = act.get('startTimeLocal')
+    return {
+        'activity_id': int(act['activityId']),
+        'account': account_name,
+        'name': act.get('activityName') or '',
+        'activity_type': (act.get('activityType') or {}).get('typeKey'),
+        'start_time': datetime.datetime.strptime(start, "%Y-%m-%d %H:%M:%S") if start else None,
+        'distance': act.get('distance'),
+        'duration': act.get('duration'),
+        'has_gps': bool(act.get('hasPolyline') or act.get('startLatitude') is not None),
+    }
+
+
+def _insert(table):
+    """Returns the INSERT construct of the current dialect, which supports ON CONFLICT."""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def upsert_activities(rows):
+    """Inserts or updates activity rows in a single statement. Does not commit."""
+    if not rows:
+        return
+    stmt = _insert(Activity.__table__).values(rows)
+    updated = {col: stmt.excluded[col] for col in rows[0] if col != 'activity_id'}
+    updated['listed_at'] = datetime.datetime.utcnow()
+    db.session.execute(stmt.on_conflict_do_update(index_elements=['activity_id'], set_=updated))
+
+
+def mark_days_listed(account_name, first_day, last_day):
+    """
+    Records that the listing of [first_day, last_day] for an account is in the
+    activities table. Only days that are over by now are recorded. Does not commit.
+    """
+    today = datetime.date.today()
+    now = datetime.datetime.now()
+    rows = []
+    day = first_day
+    while day <= last_day and day < today:
+        rows.append({'account': account_name, 'day': day, 'listed_at': now})
+        day += datetime.timedelta(days=1)
+    if not rows:
+        return
+    stmt = _insert(ListedDay.__table__).values(rows)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['account', 'day'], set_={'listed_at': stmt.excluded.listed_at}
+    ))
+
+
+def cached_activity_rows(account_name, first_day, last_day):
+    """
+    Returns the stored activity rows of an account for [first_day, last_day],
+    or None when any day in the range has not been listed since it settled
+    and Garmin must be asked instead.
+    """
+    settled_before = datetime.datetime.now() - datetime.timedelta(days=LISTING_SETTLE_DAYS)
+    if last_day >= settled_before.date():
+        return None
+
+    wanted = (last_day - first_day).days + 1
+    settled = ListedDay.query.filter(
+        ListedDay.account == account_name,
+        ListedDay.day >= first_day,
+        ListedDay.day <= last_day,
+    ).all()
+    # A listing only settles the day if it was taken LISTING_SETTLE_DAYS after the day ended
+    settled = [d for d in settled if d.listed_at >= datetime.datetime.combine(d.day, datetime.time()) + datetime.timedelta(days=LISTING_SETTLE_DAYS + 1)]
+    if len(settled) < wanted:
+        return None
+
+    activities = Activity.query.filter(
+        Activity.account == account_name,
+        Activity.start_time >= datetime.datetime.combine(first_day, datetime.time.min),
+        Activity.start_time <= datetime.datetime.combine(last_day, datetime.time.max),
+    ).order_by(Activity.start_time.asc()).all()
+    return [{
+        'activity_id': a.activity_id,
+        'account': a.account,
+        'name': a.name or '',
+        'activity_type': a.activity_type,
+        'start_time': a.start_time,
+        'distance': a.distance,
+        'duration': a.duration,
+        'has_gps': a.has_gps,
+    } for a in activities]
+
+
+def list_activity_rows(gc, account_name, startdate, enddate, use_cache=False):
+    """
+    Returns the activity rows of an account in a date range. With use_cache
+    the local table answers for settled days; otherwise Garmin is listed and
+    the result stored. gc is a callable returning the Garmin client, so it is
+    only logged in when Garmin has to be asked.
+    """
+    first_day, last_day = startdate.date(), enddate.date()
+    if use_cache:
+        rows = cached_activity_rows(account_name, first_day, last_day)
+        if rows is not None:
+            current_app.logger.info(f"[{account_name}] Using stored activity listing for {first_day} - {last_day}.")
+            return rows
+
+    summaries = gc().get_activities_by_date(first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d"))
+    rows = [summary_to_row(act, account_name) for act in summaries]
+    upsert_activities(rows)
+    mark_days_listed(account_name, first_day, last_day)
+    db.session.commit()
+    return rows
+
+
+def activities_by_id(activity_ids):
+    """Returns {activity_id: Activity} for the given ids in one query."""
+    ids = {i for i in activity_ids if i is not None}
+    if not ids:
+        return {}
+    return {a.activity_id: a for a in Activity.query.filter(Activity.activity_id.in_(ids))}
+
+
+# --------------------------------------------------------
+# - Skipped Activities
+#---------------------------------------------------------
+def skip_reasons(activity_ids):
+    """Returns {activity_id: skip_reason} for the given ids that are marked as skipped."""
+    ids = set(activity_ids)
+    if not ids:
+        return {}
+    return dict(db.session.query(Activity.activity_id, Activity.skip_reason).filter(
+        Activity.activity_id.in_(ids),
+        Activity.skip_reason != None,
+    ))
+
+
+def set_skip_reason(activity_id, reason):
+    """Marks an activity as skipped for a reason, or clears it with None. Does not commit."""
+    db.session.query(Activity).filter(Activity.activity_id == activity_id).update(
+        {Activity.skip_reason: reason}, synchronize_session=False
+    )
+
+
+def skip_reason_counts():
+    """Returns {skip_reason: number of activities} over all accounts."""
+    return dict(db.session.query(Activity.skip_reason, db.func.count(Activity.activity_id)).filter(
+        Activity.skip_reason != None
+    ).group_by(Activity.skip_reason))
+
+
+def clear_skip_reasons(reason=None, account_name=None):
+    """
+    Clears skip reasons, so the next run over those days downloads and checks
+    the activities again. Returns the number of activities cleared.
+    """
+    query = db.session.query(Activity).filter(Activity.skip_reason != None)
+    if reason:
+        query = query.filter(Activity.skip_reason == reason)
+    if account_name:
+        query = query.filter(Activity.account == account_name)
+    cleared = query.update({Activity.skip_reason: None}, synchronize_session=False)
+    db.session.commit()
+    return cleared
+
+
+# --------------------------------------------------------
+# - Migration
+#---------------------------------------------------------
+def backfill_activity_ids():
+    """
+    Fills DownloadRecord.activity_id from '{date}_{activityId}.gpx' filenames.
+    Returns the number of records updated.
+    """
+    from sqlalchemy import update
+
+    rows = db.session.query(DownloadRecord.id, DownloadRecord.filename).filter(
+        DownloadRecord.activity_id == None
+    ).all()
+    updates = []
+    for record_id, filename in rows:
+        match = ACTIVITY_FILENAME_RE.match(filename or '')
+        if match:
+            updates.append({'id': record_id, 'activity_id': int(match.group(1))})
+    if updates:
+        db.session.execute(update(DownloadRecord), updates)
+        db.session.commit()
+    return len(updates)
@@ -0,0 +1,194 @@
+# ========================================================
+# = api.py - Read-only JSON API over download records
+# ========================================================
+from flask import Blueprint, request, jsonify, current_app
+import datetime
+from models import DownloadRecord, SyncRun, db
+from utils import get_records_page
+from poller import public_poll_state
+
+api_bp = Blueprint('api', __name__, url_prefix='/api')
+
+MAX_PAGE_SIZE = 200
+
+# --------------------------------------------------------
+# - Helpers
+#---------------------------------------------------------
+def record_to_dict(record):
+    return {
+        'id': record.id,
+        'filename': record.filename,
+        'activity_id': record.activity_id,
+        'download_time': record.download_time.isoformat() if record.download_time else None,
+        'updated_at': record.updated_at.isoformat() if record.updated_at else None,
+        'dawarich': bool(record.dawarich),
+        'file_exists': bool(record.file_exists),
+        'file_size': record.file_size,
+        'bundle_id': record.bundle_id,
+    }
+
+
+def sync_run_to_dict(run):
+    duration = (run.finished_at - run.started_at).total_seconds() if run.finished_at else None
+    return {
+        'id': run.id,
+        'kind': run.kind,
+        'started_at': run.started_at.isoformat() if run.started_at else None,
+        'finished_at': run.finished_at.isoformat() if run.finished_at else None,
+        'duration_seconds': duration,
+        'upload_order': run.upload_order,
+        'downloaded': run.downloaded,
+        'uploaded': run.uploaded,
+        'failed': run.failed,
+        'uploads_per_minute': round(run.uploaded / (duration / 60), 2) if duration else None,
+        'remaining': run.remaining,
+        'stop_reason': run.stop_reason,
+    }
+
+
+def collection_etag():
+    """
+    Weak ETag for the whole record collection, built from one aggregate query.
+    Any insert changes the max id, any update changes the max updated_at and
+    any delete changes the count, so the tag changes whenever a response would.
+    """
+    max_id, max_updated, total = db.session.query(
+        db.func.max(DownloadRecord.id),
+        db.func.max(DownloadRecord.updated_at),
+        db.func.count(DownloadRecord.id),
+    ).one()
+    updated = max_updated.strftime('%Y%m%d%H%M%S%f') if max_updated else '0'
+    return f"{max_id or 0}-{updated}-{total}"
+
+
+def conditional_json(etag, build_payload):
+    """
+    Answers with 304 when the client already holds the current ETag,
+    otherwise builds the payload and tags the response.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(build_payload())
+    response.set_etag(etag, weak=True)
+    # Let clients cache, but make them revalidate every time
+    response.cache_control.no_cache = True
+    return response
+
+
+def parse_date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    return datetime.datetime.strptime(value, '%Y-%m-%d')
+
+
+# --------------------------------------------------------
+# - Routes
+#---------------------------------------------------------
+@api_bp.route('/records')
+def list_records():
+    """
+    Lists records newest first with keyset pagination.
+    Query parameters: before (id cursor), limit, dawarich (true|false),
+    since and until (YYYY-MM-DD, on download time, until is inclusive).
+    """
+    before = request.args.get('before', type=int)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_PAGE_SIZE)
+    try:
+        since = parse_date_arg('since')
+        until = parse_date_arg('until')
+    except ValueError:
+        return jsonify(status="error", message="Dates must use the YYYY-MM-DD format."), 400
+
+    query = DownloadRecord.query
+    uploaded = request.args.get('dawarich')
+    if uploaded is not None:
+        if uploaded.lower() == 'true':
+            query = query.filter(DownloadRecord.dawarich == True)
+        else:
+            query = query.filter((DownloadRecord.dawarich == False) | (DownloadRecord.dawarich == None))
+    if since:
+        query = query.filter(DownloadRecord.download_time >= since)
+    if until:
+        query = query.filter(DownloadRecord.download_time < until + datetime.timedelta(days=1))
+
+    def build_payload():
+        page = get_records_page(query=query, before=before, per_page=limit)
+        return {
+            'records': [record_to_dict(rec) for rec in page['items']],
+            'next_cursor': page['next_cursor'] if page['has_next'] else None,
+        }
+
+    return conditional_json(collection_etag(), build_payload)
+
+
+@api_bp.route('/records/<int:record_id>')
+def get_record(record_id):
+    record = db.session.get(DownloadRecord, record_id)
+    if record is None:
+        return jsonify(status="error", message="Record not found."), 404
+    updated = record.updated_at.strftime('%Y%m%d%H%M%S%f') if record.updated_at else '0'
+    return conditional_json(f"{record.id}-{updated}", lambda: record_to_dict(record))
+
+
+@api_bp.route('/stats')
+def stats():
+    def build_payload():
+        total, uploaded, files_present, last_download = db.session.query(
+            db.func.count(DownloadRecord.id),
+            db.func.count(db.case((DownloadRecord.dawarich == True, 1))),
+            db.func.count(db.case((DownloadRecord.file_exists == True, 1))),
+            db.func.max(DownloadRecord.download_time),
+        ).one()
+        return {
+            'total': total,
+            'uploaded': uploaded,
+            'pending': total - uploaded,
+            'files_present': files_present,
+            'last_download': last_download.isoformat() if last_download else None,
+        }
+
+    return conditional_json(collection_etag(), build_payload)
+
+
+@api_bp.route('/filters')
+def filters():
+    """Configured activity filter rules and how often each matched, per account."""
+    rules = [rule.get('name') for rule in current_app.config.get('ACTIVITY_FILTERS', []) if isinstance(rule, dict)]
+    active = [name for name, _ in current_app.config.get('ACTIVITY_FILTER_RULES', [])]
+    return jsonify(
+        rules=current_app.config.get('ACTIVITY_FILTERS', []),
+        active=active,
+        invalid=[name for name in rules if name not in active],
+        stats=current_app.config.get('_FILTER_STATS', {}),
+    )
+
+
+@api_bp.route('/reconcile')
+def reconcile_report():
+    """Report of the last comparison of the records with the files on disk."""
+    report = current_app.config.get('_RECONCILE_REPORT')
+    if report is None:
+        return jsonify(status="error", message="No file check has run since startup."), 404
+    return jsonify(report)
+
+
+@api_bp.route('/poll')
+def poll_status():
+    """State of the new-activity polling per account: last poll, changes seen, backoff."""
+    if current_app.config.get('POLL_INTERVAL_MINUTES', 0) <= 0:
+        return jsonify(status="error", message="Polling is disabled (POLL_INTERVAL_MINUTES)."), 404
+    return jsonify(interval_minutes=current_app.config['POLL_INTERVAL_MINUTES'], accounts=public_poll_state(current_app))
+
+
+@api_bp.route('/runs')
+def sync_runs():
+    """Summaries of the latest scheduled and command line runs, newest first."""
+    limit = min(max(request.args.get('limit', 30, type=int), 1), 365)
+    runs = SyncRun.query.order_by(SyncRun.id.desc()).limit(limit).all()
+    return jsonify(runs=[sync_run_to_dict(run) for run in runs])
+
+
+def register_routes(app):
+    app.register_blueprint(api_bp)
@@ -3,13 +3,26 @@
 # ========================================================
 import os
 import ast
+import threading
 from flask import Flask, jsonify, request
-from models import db, UserSettings
+from models import (
+    db, add_missing_columns, configure_sqlite,
+    schema_fingerprint, stored_schema_fingerprint, store_schema_fingerprint,
+)
 from werkzeug.exceptions import BadRequest
 import index
-import datetime # Added for date calculations
-from apscheduler.schedulers.background import BackgroundScheduler # Added for scheduling
-from utils import download_activities, scheduled_download_job, check_dawarich_connection
+import api
+from exports import build_sinks, ExportWorker
+from accounts import load_accounts
+from activities import backfill_activity_ids
+from filters import compile_rules
+from storage import migrate_layout, needs_layout_migration
+from reconcile import run_reconcile
+from poller import poll_for_changes
+from recovery import start_rebuild
+from profiling import parse_targets, init_profiling
+from settings_cache import get_settings
+from utils import scheduled_download_job, check_dawarich_connection, backfill_file_exists
 
 # --------------------------------------------------------
 # - Application Version
@@ -20,7 +33,12 @@ APP_TITLE = "Garmin to Dawarich Location Sync"
 # --------------------------------------------------------
 # - Application Factory Function
 #---------------------------------------------------------
-def create_app():
+def create_app(start_services=True):
+    """
+    Creates the application. With start_services=False the scheduler and
+    background workers are not started; gunicorn starts them after forking,
+    in one worker only (see gunicorn.conf.py).
+    """
     # == Flask App Initialization ============================================
     app = Flask(__name__)
 
@@ -34,8 +52,40 @@ def create_app():
     app.config['DAWARICH_EMAIL'] = os.environ.get('DAWARICH_EMAIL')
     app.config['DAWARICH_PASSWORD'] = os.environ.get('DAWARICH_PASSWORD')
     app.config['DAWARICH_HOST'] = os.environ.get('DAWARICH_HOST')
-    app.config['_DAWARICH_CONNECTION_STATUS'] = {'status': None, 'timestamp': None, 'message': '', 'version': None}
+    app.config['_DAWARICH_CONNECTION_STATUS'] = {} # per account: {'status', 'timestamp', 'message', 'version'}
+    app.config['_GARMIN_MFA_STATE'] = {} # per account: pending interactive MFA login
     app.config['CUSTOM_CHECK_TASK'] = {'thread': None, 'stop_event': None, 'status_message': 'Not running.'}
+    app.config['BACKGROUND_TASKS'] = {} # Quick Check and uploads started from the UI: name -> {'thread', 'status_message', 'started_at'}
+    # Only the process holding this lock runs the scheduler and background workers
+    app.config['SERVICE_LOCK_FILE'] = os.environ.get('SERVICE_LOCK_FILE', '/garmin/.background-services.lock')
+    app.config['UPLOAD_DELAY_SECONDS'] = int(os.environ.get('UPLOAD_DELAY_SECONDS', '5')) # pause between uploads in a pipeline
+    app.config['UPLOAD_QUEUE_SIZE'] = int(os.environ.get('UPLOAD_QUEUE_SIZE', '16')) # downloaded files waiting for upload
+    # Budget of the nightly run, so a large backlog is spread over several nights; 0 = unlimited
+    app.config['SCHEDULE_MAX_SECONDS'] = int(os.environ.get('SCHEDULE_MAX_SECONDS', '7200'))
+    app.config['SCHEDULE_MAX_ITEMS'] = int(os.environ.get('SCHEDULE_MAX_ITEMS', '0')) # uploads per scheduled run
+    # Lightweight check for new activities every few minutes; 0 keeps only the nightly run
+    app.config['POLL_INTERVAL_MINUTES'] = float(os.environ.get('POLL_INTERVAL_MINUTES', '0'))
+    app.config['POLL_JITTER_SECONDS'] = int(os.environ.get('POLL_JITTER_SECONDS', '60')) # random extra delay per poll
+    # cProfile of requests and background jobs, e.g. PROFILING="scheduled,uploads"; empty = off
+    app.config['PROFILE_TARGETS'] = parse_targets(os.environ.get('PROFILING', ''), app.logger)
+    app.config['PROFILE_ENDPOINTS'] = [e.strip() for e in os.environ.get('PROFILE_ENDPOINTS', '').split(',') if e.strip()]
+    app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', '/garmin/profiles')
+    app.config['PROFILE_KEEP'] = int(os.environ.get('PROFILE_KEEP', '50')) # newest profiles kept on disk
+    app.config['PROFILE_MIN_SECONDS'] = float(os.environ.get('PROFILE_MIN_SECONDS', '0.1')) # faster work is not saved
+    app.config['UPLOAD_ORDER'] = os.environ.get('UPLOAD_ORDER', 'oldest').strip().lower() # oldest | newest | smallest
+    if app.config['UPLOAD_ORDER'] not in ('oldest', 'newest', 'smallest'):
+        app.logger.warning(f"Unknown UPLOAD_ORDER '{app.config['UPLOAD_ORDER']}', using 'oldest'.")
+        app.config['UPLOAD_ORDER'] = 'oldest'
+    # Upload all pending activities of a day as one multi-track GPX import instead of one import each
+    app.config['CONSOLIDATE_DAILY'] = os.environ.get('CONSOLIDATE_DAILY', 'false').lower() == 'true'
+    app.config['CONSOLIDATE_MAX_ACTIVITIES'] = int(os.environ.get('CONSOLIDATE_MAX_ACTIVITIES', '10')) # per import, at most 20
+    # Downloaded GPX files are stored below this directory in YYYY/MM/ subdirectories
+    app.config['ACTIVITIES_DIR'] = os.environ.get('ACTIVITIES_DIR', '/garmin/activities')
+    app.config['STORAGE_MIGRATION_BATCH'] = int(os.environ.get('STORAGE_MIGRATION_BATCH', '200')) # files moved per batch
+    app.config['REBUILD_ON_EMPTY_DB'] = os.environ.get('REBUILD_ON_EMPTY_DB', 'true').lower() == 'true'
+    app.config['RECONCILE_INTERVAL_HOURS'] = float(os.environ.get('RECONCILE_INTERVAL_HOURS', '24')) # 0 disables the file check
+    # 'gpx' downloads Garmin's GPX export; 'original' downloads the much smaller FIT file and converts it locally
+    app.config['GARMIN_DOWNLOAD_FORMAT'] = os.environ.get('GARMIN_DOWNLOAD_FORMAT', 'gpx').strip().lower()
     app.config['SAFE_VERSIONS'] = ['0.28.1', '0.29.1', '0.30.0', '0.30.1', '0.30.2', '1.3.1']
 
     raw = os.environ.get('EXCLUDE', '[]')
@@ -44,11 +94,37 @@ def create_app():
     except (ValueError, SyntaxError):
         app.config['EXCLUDE'] = []
 
+    # Rules that skip activities by their listing summary before any download,
+    # e.g. "[{'name': 'indoor', 'has_gps': False}, {'name': 'short', 'duration_below': 300}]"
+    raw = os.environ.get('ACTIVITY_FILTERS', '[]')
+    try:
+        app.config['ACTIVITY_FILTERS'] = ast.literal_eval(raw)
+    except (ValueError, SyntaxError):
+        app.config['ACTIVITY_FILTERS'] = []
+    app.config['ACTIVITY_FILTER_RULES'] = compile_rules(app.config['ACTIVITY_FILTERS'], app.logger)
+
+    # -- Accounts Configuration -------------------
+    # Several Garmin/Dawarich accounts can be synced by one instance. Without
+    # an accounts file the variables above form the single 'default' account.
+    app.config['ACCOUNTS_FILE'] = os.environ.get('ACCOUNTS_FILE', '/garmin/accounts.json')
+    app.config['SYNC_MAX_WORKERS'] = int(os.environ.get('SYNC_MAX_WORKERS', '2')) # accounts synced in parallel
+    app.config['ACCOUNT_CONCURRENCY'] = int(os.environ.get('ACCOUNT_CONCURRENCY', '1')) # concurrent jobs per account
+    app.config['ACCOUNTS'] = load_accounts(app.config, app.logger)
+
     # -- GeoPulse Configuration -------------------
     app.config['GEOPULSE_ENABLE'] = os.environ.get('GEOPULSE_ENABLE', 'false').lower() == 'true'
     app.config['GEOPULSE_USER'] = os.environ.get('GEOPULSE_USER', '')
     app.config['GEOPULSE_PATH'] = os.environ.get('GEOPULSE_PATH', '')
-    
+
+    # -- Export Sinks Configuration -------------------
+    # Additional export destinations, e.g. "[{'type': 'directory', 'name': 'nas', 'path': '/nas/gpx'}]"
+    raw = os.environ.get('EXPORT_SINKS', '[]')
+    try:
+        app.config['EXPORT_SINKS'] = ast.literal_eval(raw)
+    except (ValueError, SyntaxError):
+        app.config['EXPORT_SINKS'] = []
+    app.config['EXPORT_SINKS_ACTIVE'] = build_sinks(app.config, app.logger)
+
     # -- Database Configuration -------------------
     DB_USER = os.environ.get('POSTGRES_USER') # PostgreSQL username
     DB_PASSWORD = os.environ.get('POSTGRES_PASSWORD') # PostgreSQL password
@@ -69,44 +145,55 @@ def create_app():
         app.logger.info(f"PostgreSQL environment variables not fully set. Using LiteFS (SQLite) at {litefs_db_path}.")
 
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False # Disable SQLAlchemy event system
-    
+
+    # -- Connection Pool Configuration -------------------
+    # Request threads, the scheduler, upload pipelines and custom checks all share one pool
+    engine_options = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', '10')),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', '30')), # seconds to wait for a free connection
+    }
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+        # Replace connections dropped by a database restart or an idle timeout before use
+        engine_options['pool_pre_ping'] = True
+        engine_options['pool_recycle'] = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
+    # -- SQLite Configuration -------------------
+    # Applied to every new connection, see configure_sqlite()
+    app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL').strip().upper()
+    if app.config['SQLITE_JOURNAL_MODE'] not in ('WAL', 'DELETE', 'TRUNCATE', 'PERSIST'):
+        app.logger.warning(f"Unknown SQLITE_JOURNAL_MODE '{app.config['SQLITE_JOURNAL_MODE']}', using 'WAL'.")
+        app.config['SQLITE_JOURNAL_MODE'] = 'WAL'
+    app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').strip().upper()
+    if app.config['SQLITE_SYNCHRONOUS'] not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+        app.logger.warning(f"Unknown SQLITE_SYNCHRONOUS '{app.config['SQLITE_SYNCHRONOUS']}', using 'NORMAL'.")
+        app.config['SQLITE_SYNCHRONOUS'] = 'NORMAL'
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '15000')) # wait for a lock instead of failing
+
     # == Database Initialization ============================================
     db.init_app(app)  # Initialize SQLAlchemy with the Flask app
 
-    # == Initialize Scheduler ===============================================
-    # Note: In a production environment with multiple workers (e.g., Gunicorn),
-    # ensure the scheduler is initialized and run by only one worker/process
-    # to avoid duplicate job executions.
-    # For Flask's dev server with reloader, this check helps prevent duplicates.
-    if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
-        scheduler = BackgroundScheduler(daemon=True)
-        # Schedule the job to run daily at 3:00 AM
-        scheduler.add_job(
-            func=scheduled_download_job, # Now uses the imported function
-            args=[app], # Pass the app instance to the job
-            trigger='cron',
-            hour=3,
-            minute=0
-        )
-        scheduler.start()
-        app.logger.info("Scheduler started. Daily download job scheduled for 3:00 AM.")
-
-    # == Ensure all tables exist and perform schema checks inside context ==
+    # == Ensure the database schema is current ==============================
     with app.app_context():
-        db.create_all()
+        if db.engine.dialect.name == 'sqlite':
+            configure_sqlite(db.engine, app.config['SQLITE_JOURNAL_MODE'],
+                             app.config['SQLITE_SYNCHRONOUS'], app.config['SQLITE_BUSY_TIMEOUT_MS'])
+        prepare_database(app)
 
-        # Check if UserSettings has any entries. If not, create a default one.
-        if UserSettings.query.count() == 0:
-            default_settings = UserSettings()
-            db.session.add(default_settings)
-            db.session.commit()
-            app.logger.info("Created default user settings.")
+    # == Initialize Background Services =====================================
+    # Under gunicorn (start_services=False) they are started by one worker after forking.
+    # For Flask's dev server with reloader, this check helps prevent duplicates.
+    if start_services and (not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        # Started in the background so importing APScheduler does not delay serving
+        threading.Thread(target=start_background_services, args=(app,), name='startup', daemon=True).start()
 
     @app.before_request
     def before_request_func():
-        # Don't run the check for static files to avoid unnecessary checks
-        if request.endpoint and 'static' not in request.endpoint:
-            check_dawarich_connection()
+        # Don't run the check for static files or the JSON API to avoid unnecessary checks
+        if request.endpoint and 'static' not in request.endpoint and not request.endpoint.startswith('api.'):
+            for account in app.config['ACCOUNTS'].values():
+                check_dawarich_connection(account=account)
 
     # == Inject App Version into Templates ============================================
     @app.context_processor
@@ -118,6 +205,10 @@ def create_app():
     # Each blueprint corresponds to a feature or section of the application
     # Registers routes for index page
     index.register_routes(app)
+    # Registers the read-only JSON API
+    api.register_routes(app)
+    # Request profiling hooks, only when PROFILING includes 'requests'
+    init_profiling(app)
 
     # Suppress raw‐bytes logs for protocol‐mismatch 400s (e.g. HTTPS→HTTP)
     @app.errorhandler(BadRequest)
@@ -126,6 +217,131 @@ def create_app():
         return jsonify(status="error", message="Bad request"), 400
     return app
 
+# --------------------------------------------------------
+# - Database Preparation
+#---------------------------------------------------------
+def prepare_database(app):
+    """
+    Creates missing tables and columns and the default settings row.
+    On SQLite the schema fingerprint is stored in the database, so when the
+    schema is already current a cold start costs a single PRAGMA read.
+    """
+    fingerprint = schema_fingerprint()
+    if stored_schema_fingerprint() == fingerprint:
+        return
+
+    db.create_all()
+
+    # Add columns introduced after the tables were first created
+    added_columns = add_missing_columns()
+    for table_name, column_name in added_columns:
+        app.logger.info(f"Added missing column {table_name}.{column_name}.")
+    if ('download_records', 'file_exists') in added_columns:
+        missing = backfill_file_exists(app.config['ACTIVITIES_DIR'])
+        app.logger.info(f"Backfilled file state for download records ({missing} missing on disk).")
+    if ('download_records', 'activity_id') in added_columns:
+        updated = backfill_activity_ids()
+        app.logger.info(f"Backfilled activity ids for {updated} download records.")
+
+    # Load the settings once, which also creates the default row if there is none
+    get_settings()
+
+    store_schema_fingerprint(fingerprint)
+
+
+# --------------------------------------------------------
+# - Background Services
+#---------------------------------------------------------
+def start_background_services(app):
+    """
+    Starts the scheduler, the export worker when export sinks are configured,
+    and the storage layout migration while files remain in the flat layout.
+    """
+    import datetime
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    # After a lost or reset database, recreate the records from Dawarich and the
+    # files on disk before any sync could download and upload everything again.
+    # The rebuild holds the account slots, so scheduled syncs wait for it.
+    if app.config['REBUILD_ON_EMPTY_DB']:
+        start_rebuild(app)
+
+    scheduler = BackgroundScheduler(daemon=True)
+    # Schedule the job to run daily at 3:00 AM
+    scheduler.add_job(
+        func=scheduled_download_job,
+        args=[app], # Pass the app instance to the job
+        trigger='cron',
+        hour=3,
+        minute=0
+    )
+    # Compare the records with the files on disk, first shortly after startup
+    interval = app.config['RECONCILE_INTERVAL_HOURS']
+    if interval > 0:
+        scheduler.add_job(
+            func=run_reconcile,
+            args=[app],
+            trigger='interval',
+            hours=interval,
+            next_run_time=datetime.datetime.now() + datetime.timedelta(minutes=10),
+        )
+    # Frequent cheap checks for new activities; a full sync only runs when one shows up
+    poll_minutes = app.config['POLL_INTERVAL_MINUTES']
+    if poll_minutes > 0:
+        scheduler.add_job(
+            func=poll_for_changes,
+            args=[app],
+            trigger='interval',
+            minutes=poll_minutes,
+            jitter=min(app.config['POLL_JITTER_SECONDS'], int(poll_minutes * 30)), # at most half an interval
+            max_instances=1,
+            coalesce=True,
+        )
+        app.logger.info(f"Polling Garmin for new activities every {poll_minutes:g} minutes.")
+    scheduler.start()
+    app.config['SCHEDULER'] = scheduler
+    app.logger.info("Scheduler started. Daily download job scheduled for 3:00 AM.")
+
+    # Exports run in their own thread, off the download path
+    if app.config['EXPORT_SINKS_ACTIVE']:
+        export_worker = ExportWorker(app)
+        app.config['EXPORT_WORKER'] = export_worker
+        export_worker.start()
+        app.logger.info(f"Export worker started for sinks: {', '.join(app.config['EXPORT_SINKS_ACTIVE'])}.")
+
+    # Files downloaded before the YYYY/MM layout are moved in the background, in batches
+    with app.app_context():
+        if needs_layout_migration():
+            app.logger.info("Storage migration: moving existing files to the YYYY/MM layout in the background.")
+            threading.Thread(target=migrate_layout, args=(app,), name='storage-migration', daemon=True).start()
+
+
+def start_background_services_once(app):
+    """
+    Starts the background services unless another process already runs them.
+    An exclusive flock on SERVICE_LOCK_FILE elects the process; the lock is
+    held for the life of the process, so when that worker exits or is
+    recycled, the next worker to fork takes over.
+    Returns True when this process started the services.
+    """
+    import fcntl
+
+    lock_path = app.config['SERVICE_LOCK_FILE']
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    lock_file = open(lock_path, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        app.logger.info(f"Background services run in another process (pid {os.getpid()} serves requests only).")
+        return False
+
+    app.config['_SERVICE_LOCK'] = lock_file # keeps the lock for the life of the process
+    app.logger.info(f"Starting background services in process {os.getpid()}.")
+    threading.Thread(target=start_background_services, args=(app,), name='startup', daemon=True).start()
+    return True
+
+
 # --------------------------------------------------------
 # - Main Execution Block
 #---------------------------------------------------------
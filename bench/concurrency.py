@@ -0,0 +1,203 @@
+# ========================================================
+# = bench/concurrency.py - Background writers and web readers on one SQLite database
+# ========================================================
+# Runs, for a fixed time and on a scratch database, writer threads doing
+# what downloads and uploads do (insert a record and commit, mark a record
+# uploaded and commit, record a sync run) while reader threads request UI
+# and API pages through the test client. Reports throughput, latencies and
+# "database is locked" errors, for the configured connection settings and
+# for the previous defaults (rollback journal, synchronous=FULL, pysqlite's
+# 5s busy timeout, SQLAlchemy's default pool) to compare against.
+#
+# Usage (from the repository root):
+#   python bench/concurrency.py [--settings tuned|baseline|both] [--seconds 20]
+#                               [--writers 4] [--readers 8] [--records 2000]
+#                               [--p95-budget 0.5]
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETTINGS = {
+    'tuned': {},
+    'baseline': {
+        'SQLITE_JOURNAL_MODE': 'DELETE',
+        'SQLITE_SYNCHRONOUS': 'FULL',
+        'SQLITE_BUSY_TIMEOUT_MS': '5000',
+        'DB_POOL_SIZE': '5',
+    },
+}
+
+CHILD_SCRIPT = """
+import datetime, json, random, sys, threading, time
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeout
+from app import create_app
+from models import db, DownloadRecord, SyncRun
+
+seconds, writers, readers, records = float(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4])
+PATHS = ('/', '/api/stats', '/api/records?limit=50', '/api/runs')
+
+app = create_app(start_services=False)
+with app.app_context():
+    start = datetime.date(2020, 1, 1)
+    db.session.bulk_save_objects([
+        DownloadRecord(filename=f"{start + datetime.timedelta(days=i // 3)}_{1000 + i}.gpx",
+                       dawarich=i % 5 != 0, file_exists=False)
+        for i in range(records)
+    ])
+    db.session.commit()
+    journal_mode = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+
+lock = threading.Lock()
+results = {'writes': [], 'reads': [], 'locked': 0, 'write_errors': [], 'read_errors': []}
+deadline = time.monotonic() + seconds
+
+
+def timed(kind, func):
+    started = time.perf_counter()
+    try:
+        func()
+    except (OperationalError, PoolTimeout) as e:
+        db.session.rollback()
+        with lock:
+            results['locked'] += 'locked' in str(e)
+            results['write_errors'].append(str(e).splitlines()[0])
+        return
+    with lock:
+        results[kind].append(time.perf_counter() - started)
+
+
+def writer(index):
+    rng = random.Random(index)
+    with app.app_context():
+        n = 0
+        while time.monotonic() < deadline:
+            n += 1
+            def download():
+                db.session.add(DownloadRecord(filename=f"2030-01-01_{index}{n:07d}.gpx", file_exists=False))
+                db.session.flush()
+                db.session.commit()
+            def upload():
+                record = db.session.get(DownloadRecord, rng.randint(1, records))
+                record.dawarich = not record.dawarich
+                db.session.commit()
+            def sync_run():
+                run = SyncRun(kind='scheduled')
+                db.session.add(run)
+                db.session.commit()
+                run.finished_at, run.downloaded = datetime.datetime.utcnow(), n
+                db.session.commit()
+            timed('writes', download)
+            timed('writes', upload)
+            if n % 10 == 0:
+                timed('writes', sync_run)
+        db.session.remove()
+
+
+def reader(index):
+    client = app.test_client()
+    n = index
+    while time.monotonic() < deadline:
+        path = PATHS[n % len(PATHS)]
+        n += 1
+        started = time.perf_counter()
+        response = client.get(path)
+        elapsed = time.perf_counter() - started
+        with lock:
+            if response.status_code == 200:
+                results['reads'].append(elapsed)
+            else:
+                results['read_errors'].append(f"{path}: {response.status_code}")
+
+
+threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+started = time.perf_counter()
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+elapsed = time.perf_counter() - started
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return round(values[max(0, int(len(values) * fraction) - 1)], 4) if values else None
+
+print(json.dumps({
+    'journal_mode': journal_mode,
+    'writes': len(results['writes']),
+    'writes_per_second': round(len(results['writes']) / elapsed, 1),
+    'write_p95': percentile(results['writes'], 0.95),
+    'write_max': percentile(results['writes'], 1.0),
+    'write_errors': len(results['write_errors']),
+    'locked_errors': results['locked'],
+    'reads': len(results['reads']),
+    'reads_per_second': round(len(results['reads']) / elapsed, 1),
+    'read_p50': percentile(results['reads'], 0.5),
+    'read_p95': percentile(results['reads'], 0.95),
+    'read_max': percentile(results['reads'], 1.0),
+    'read_errors': len(results['read_errors']),
+    'first_errors': (results['write_errors'] + results['read_errors'])[:5],
+}))
+"""
+
+
+def run_settings(name, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.update(
+            LITEFS_DB_PATH=os.path.join(tmp, 'concurrency.db'),
+            ACTIVITIES_DIR=os.path.join(tmp, 'activities'),
+            ACCOUNTS_FILE=os.path.join(tmp, 'accounts.json'),
+            REBUILD_ON_EMPTY_DB='false',
+            FLASK_DEBUG='0',
+        )
+        # Keep the Dawarich pre-flight check off the network and the database on SQLite
+        for key in ('DAWARICH_HOST', 'DAWARICH_EMAIL', 'DAWARICH_PASSWORD', 'POSTGRES_USER',
+                    'SQLITE_JOURNAL_MODE', 'SQLITE_SYNCHRONOUS', 'SQLITE_BUSY_TIMEOUT_MS', 'DB_POOL_SIZE'):
+            env.pop(key, None)
+        env.update(SETTINGS[name])
+        result = subprocess.run(
+            [sys.executable, '-c', CHILD_SCRIPT, str(args.seconds), str(args.writers), str(args.readers), str(args.records)],
+            cwd=REPO_ROOT, env=env, capture_output=True, text=True,
+        )
+    if result.returncode != 0:
+        raise RuntimeError(f"{name} run failed:\n{result.stderr[-2000:]}")
+    return dict(json.loads(result.stdout.strip().splitlines()[-1]), settings=name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Background writers and web readers on one SQLite database.')
+    parser.add_argument('--settings', choices=('tuned', 'baseline', 'both'), default='both')
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--records', type=int, default=2000)
+    parser.add_argument('--p95-budget', type=float, default=0.5, help='seconds, for reads with the tuned settings')
+    args = parser.parse_args()
+
+    names = ('tuned', 'baseline') if args.settings == 'both' else (args.settings,)
+    summaries = [run_settings(name, args) for name in names]
+    print(json.dumps(summaries, indent=2))
+
+    failures = []
+    for summary in summaries:
+        if summary['settings'] != 'tuned':
+            continue
+        if summary['write_errors'] or summary['read_errors']:
+            failures.append(f"{summary['write_errors']} writes and {summary['read_errors']} reads failed "
+                            f"({summary['locked_errors']} 'database is locked')")
+        if summary['read_p95'] is None or summary['read_p95'] > args.p95_budget:
+            failures.append(f"read p95 latency {summary['read_p95']}s exceeds the budget of {args.p95_budget}s")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+# ========================================================
+# = bench/fit_equivalence.py - FIT to GPX conversion check against Garmin GPX
+# ========================================================
+# Converts ORIGINAL (zipped FIT) downloads with fit_to_gpx and compares the
+# result point by point with the GPX Garmin Connect produces for the same
+# activity. Also reports the bytes each format moves over the wire and the
+# conversion time.
+#
+# Fixture pairs are <name>.zip (Garmin Connect "Export Original") and
+# <name>.gpx ("Export to GPX") of the same activity. Without arguments the
+# anonymized pairs committed in bench/fixtures/fit are checked; add one with
+# bench/fixtures/anonymize_fit_pair.py. The hand-encoded decoder edge cases
+# in tests/fixtures are not Garmin output and are checked by the tests.
+#
+# Usage (from the repository root):
+#   python bench/fit_equivalence.py [FIXTURE_DIR] [--lat-lon-tolerance 1e-6] [--ele-tolerance 0.2]
+import argparse
+import glob
+import io
+import json
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_FIXTURE_DIR = os.path.join(REPO_ROOT, 'bench', 'fixtures', 'fit')
+sys.path.insert(0, REPO_ROOT)
+
+from lxml import etree  # noqa: E402
+from fit_to_gpx import original_to_gpx  # noqa: E402
+
+GPX_NS = '{http://www.topografix.com/GPX/1/1}'
+TPX_NS = '{http://www.garmin.com/xmlschemas/TrackPointExtension/v1}'
+
+
+def read_points(gpx_bytes):
+    """Returns {time: point dict} for the track points of a GPX document."""
+    points = {}
+    for _, trkpt in etree.iterparse(io.BytesIO(gpx_bytes), tag=f'{GPX_NS}trkpt'):
+        point = {'lat': float(trkpt.get('lat')), 'lon': float(trkpt.get('lon'))}
+        ele = trkpt.findtext(f'{GPX_NS}ele')
+        if ele is not None:
+            point['ele'] = float(ele)
+        for tag in ('atemp', 'hr', 'cad'):
+            value = trkpt.findtext(f'.//{TPX_NS}{tag}')
+            if value is not None:
+                point[tag] = float(value)
+        points[trkpt.findtext(f'{GPX_NS}time')] = point
+        trkpt.clear()
+    return points
+
+
+def compare(expected, actual, lat_lon_tolerance, ele_tolerance):
+    """Returns a list of differences between two {time: point} maps."""
+    problems = []
+    if expected.keys() != actual.keys():
+        missing = len(expected.keys() - actual.keys())
+        extra = len(actual.keys() - expected.keys())
+        problems.append(f"timestamps differ: {missing} missing, {extra} extra")
+    for time_key in sorted(expected.keys() & actual.keys()):
+        want, got = expected[time_key], actual[time_key]
+        for key in ('lat', 'lon'):
+            if abs(want[key] - got[key]) > lat_lon_tolerance:
+                problems.append(f"{time_key}: {key} {got[key]} != {want[key]}")
+        if 'ele' in want and abs(want['ele'] - got.get('ele', float('inf'))) > ele_tolerance:
+            problems.append(f"{time_key}: ele {got.get('ele')} != {want['ele']}")
+        for key in ('atemp', 'hr', 'cad'):
+            if want.get(key) != got.get(key):
+                problems.append(f"{time_key}: {key} {got.get(key)} != {want.get(key)}")
+    return problems
+
+
+def fixture_pairs(fixture_dir):
+    return [
+        (zip_path, zip_path[:-4] + '.gpx')
+        for zip_path in sorted(glob.glob(os.path.join(fixture_dir, '*.zip')))
+        if os.path.exists(zip_path[:-4] + '.gpx')
+    ]
+
+
+def check_pair(zip_path, gpx_path, lat_lon_tolerance=1e-6, ele_tolerance=0.2):
+    """Converts one ORIGINAL download and compares it with its GPX. Returns (summary dict, differences)."""
+    with open(zip_path, 'rb') as f:
+        original = f.read()
+    with open(gpx_path, 'rb') as f:
+        garmin_gpx = f.read()
+
+    out = io.BytesIO()
+    started = time.perf_counter()
+    written = original_to_gpx(original, out)
+    elapsed = time.perf_counter() - started
+
+    problems = compare(read_points(garmin_gpx), read_points(out.getvalue()), lat_lon_tolerance, ele_tolerance)
+    return {
+        'fixture': os.path.basename(zip_path)[:-4],
+        'points': written,
+        'original_bytes': len(original),
+        'garmin_gpx_bytes': len(garmin_gpx),
+        'converted_gpx_bytes': len(out.getvalue()),
+        'convert_seconds': round(elapsed, 4),
+        'differences': len(problems),
+    }, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare FIT to GPX conversion with Garmin GPX exports.')
+    parser.add_argument('fixture_dir', nargs='?', default=DEFAULT_FIXTURE_DIR)
+    parser.add_argument('--lat-lon-tolerance', type=float, default=1e-6, help='degrees')
+    parser.add_argument('--ele-tolerance', type=float, default=0.2, help='meters')
+    args = parser.parse_args()
+
+    pairs = fixture_pairs(args.fixture_dir)
+    if not pairs:
+        print(f"No <name>.zip / <name>.gpx fixture pairs in {args.fixture_dir}; "
+              f"add one with bench/fixtures/anonymize_fit_pair.py", file=sys.stderr)
+        return 1
+
+    failures = 0
+    for zip_path, gpx_path in pairs:
+        summary, problems = check_pair(zip_path, gpx_path, args.lat_lon_tolerance, args.ele_tolerance)
+        failures += bool(problems)
+        print(json.dumps(summary))
+        for problem in problems[:20]:
+            print(f"  {problem}", file=sys.stderr)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
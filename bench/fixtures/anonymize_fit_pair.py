@@ -0,0 +1,218 @@
+# ========================================================
+# = bench/fixtures/anonymize_fit_pair.py - Anonymize a Garmin export pair for bench/fixtures/fit
+# ========================================================
+# Takes an activity downloaded from Garmin Connect twice, as "Export
+# Original" (the zipped FIT file) and as "Export to GPX", and writes an
+# anonymized copy of both to bench/fixtures/fit/NAME.zip and NAME.gpx:
+#   - every position is moved by the same offset, so the track starts at
+#     --origin (default 0,0) in both files; the GPX keeps Garmin's own
+#     formatting of everything else, e.g. float32 elevations,
+#   - device serial numbers and the user profile name in the FIT file are
+#     cleared, and the track name in the GPX is replaced.
+# Timestamps, elevations and sensor values are kept, as they are what the
+# conversion is compared on.
+#
+# Usage (from the repository root):
+#   python bench/fixtures/anonymize_fit_pair.py ORIGINAL.zip EXPORT.gpx NAME [--origin LAT,LON]
+import argparse
+import io
+import os
+import struct
+import sys
+import zipfile
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fit')
+DEGREES_TO_SEMICIRCLES = 2 ** 31 / 180.0
+INVALID_SINT32 = 0x7FFFFFFF
+
+# Global message number -> (latitude fields, longitude fields), in semicircles
+POSITION_FIELDS = {
+    18: ({3, 29, 31}, {4, 30, 32}),       # session: start, north-east and south-west corners
+    19: ({3, 5, 27, 29}, {4, 6, 28, 30}), # lap: start, end, corners
+    20: ({0}, {1}),                       # record
+    29: ({1}, {2}),                       # location
+    32: ({2}, {3}),                       # course_point
+    160: ({1}, {2}),                      # gps_metadata
+}
+# Global message number -> fields cleared to zero (serial numbers, uint32z)
+SERIAL_FIELDS = {0: {3}, 23: {3}}
+USER_PROFILE = 3 # its string fields (friendly name) are blanked
+BASE_STRING = 0x07
+
+
+def crc16(data, crc=0):
+    """The FIT CRC-16."""
+    table = (0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401,
+             0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400)
+    for byte in data:
+        for nibble in (byte & 0x0F, byte >> 4):
+            tmp = table[crc & 0x0F]
+            crc = (crc >> 4) & 0x0FFF
+            crc = crc ^ tmp ^ table[nibble]
+    return crc
+
+
+def _shift(value, offset):
+    """Adds offset to a sint32 semicircle value, keeping invalid values and wrapping around."""
+    if value == INVALID_SINT32:
+        return value
+    shifted = (value + offset + 2 ** 31) % 2 ** 32 - 2 ** 31
+    return shifted if shifted != INVALID_SINT32 else shifted - 1
+
+
+# --------------------------------------------------------
+# - FIT
+#---------------------------------------------------------
+def _walk_fit(data):
+    """
+    Yields (offset of the file, header size, data size) for each FIT file of
+    a possibly chained FIT stream, and ('message', global number, big_endian,
+    fields, start of the message content) for every data message, where
+    fields are (field number, offset, size, base type).
+    """
+    pos = 0
+    while pos < len(data):
+        header_size = data[pos]
+        if data[pos + 8:pos + 12] != b'.FIT':
+            raise ValueError("Missing FIT file header.")
+        data_size = struct.unpack_from('<I', data, pos + 4)[0]
+        yield ('file', pos, header_size, data_size)
+        cursor, end = pos + header_size, pos + header_size + data_size
+        definitions = {}
+        while cursor < end:
+            record_header = data[cursor]
+            cursor += 1
+            if record_header & 0x80:
+                local = (record_header >> 5) & 0x03
+            elif record_header & 0x40:
+                big_endian = data[cursor + 1] == 1
+                global_num = struct.unpack_from('>H' if big_endian else '<H', data, cursor + 2)[0]
+                count = data[cursor + 4]
+                cursor += 5
+                fields, offset = [], 0
+                for i in range(count):
+                    field_num, size, base_type = data[cursor + 3 * i:cursor + 3 * i + 3]
+                    fields.append((field_num, offset, size, base_type & 0x1F))
+                    offset += size
+                cursor += 3 * count
+                if record_header & 0x20:
+                    dev_count = data[cursor]
+                    offset += sum(data[cursor + 1 + 3 * i + 1] for i in range(dev_count))
+                    cursor += 1 + 3 * dev_count
+                definitions[record_header & 0x0F] = (global_num, big_endian, fields, offset)
+                continue
+            else:
+                local = record_header & 0x0F
+            global_num, big_endian, fields, size = definitions[local]
+            yield ('message', global_num, big_endian, fields, cursor)
+            cursor += size
+        pos = end + 2 # file CRC
+
+
+def first_position(fit):
+    """(lat, lon) in semicircles of the first record with a position, or None."""
+    for item in _walk_fit(fit):
+        if item[0] != 'message' or item[1] != 20:
+            continue
+        _, _, big_endian, fields, start = item
+        values = {num: struct.unpack_from('>i' if big_endian else '<i', fit, start + offset)[0]
+                  for num, offset, size, base in fields if num in (0, 1) and size == 4}
+        if len(values) == 2 and INVALID_SINT32 not in values.values():
+            return values[0], values[1]
+    return None
+
+
+def anonymize_fit(fit, lat_offset, lon_offset):
+    """Returns a copy of the FIT data with positions shifted, serials and the profile name cleared, and new CRCs."""
+    out = bytearray(fit)
+    files = []
+    for item in _walk_fit(fit):
+        if item[0] == 'file':
+            files.append(item[1:])
+            continue
+        _, global_num, big_endian, fields, start = item
+        lat_fields, lon_fields = POSITION_FIELDS.get(global_num, ((), ()))
+        sint32 = '>i' if big_endian else '<i'
+        for num, offset, size, base in fields:
+            at = start + offset
+            if size == 4 and (num in lat_fields or num in lon_fields):
+                value = struct.unpack_from(sint32, out, at)[0]
+                struct.pack_into(sint32, out, at, _shift(value, lat_offset if num in lat_fields else lon_offset))
+            elif num in SERIAL_FIELDS.get(global_num, ()) or (global_num == USER_PROFILE and base == BASE_STRING):
+                out[at:at + size] = bytes(size)
+    for pos, header_size, data_size in files:
+        if header_size >= 14:
+            struct.pack_into('<H', out, pos + 12, crc16(out[pos:pos + 12]))
+        end = pos + header_size + data_size
+        struct.pack_into('<H', out, end, crc16(out[pos:end]))
+    return bytes(out)
+
+
+def read_original(data):
+    """(member name, FIT bytes) of a Garmin ORIGINAL download, or of a bare FIT file."""
+    if data[:2] != b'PK':
+        return 'activity.fit', data
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        name = next(m for m in archive.namelist() if m.lower().endswith('.fit'))
+        return name, archive.read(name)
+
+
+# --------------------------------------------------------
+# - GPX
+#---------------------------------------------------------
+def anonymize_gpx(gpx, lat_offset, lon_offset):
+    """Returns the GPX with every point moved by the offsets (semicircles) and its names replaced."""
+    from lxml import etree
+
+    tree = etree.parse(io.BytesIO(gpx))
+    for point in tree.xpath('//*[local-name()="trkpt" or local-name()="wpt" or local-name()="rtept"]'):
+        for attribute, offset in (('lat', lat_offset), ('lon', lon_offset)):
+            semicircles = _shift(round(float(point.get(attribute)) * DEGREES_TO_SEMICIRCLES), offset)
+            point.set(attribute, repr(semicircles / DEGREES_TO_SEMICIRCLES))
+    for name in tree.xpath('//*[local-name()="trk" or local-name()="rte" or local-name()="wpt"]/*[local-name()="name"]'):
+        name.text = 'Activity'
+    return etree.tostring(tree, xml_declaration=True, encoding='UTF-8')
+
+
+def anonymize_pair(original, gpx, name, origin=(0.0, 0.0), dest_dir=FIXTURE_DIR):
+    """Writes the anonymized NAME.zip and NAME.gpx into dest_dir. Returns their paths."""
+    _, fit = read_original(original)
+    start = first_position(fit)
+    if start is None:
+        raise ValueError("The FIT file has no record with a position.")
+    lat_offset = round(origin[0] * DEGREES_TO_SEMICIRCLES) - start[0]
+    lon_offset = round(origin[1] * DEGREES_TO_SEMICIRCLES) - start[1]
+
+    os.makedirs(dest_dir, exist_ok=True)
+    zip_path, gpx_path = os.path.join(dest_dir, f'{name}.zip'), os.path.join(dest_dir, f'{name}.gpx')
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(zipfile.ZipInfo(f'{name}_ACTIVITY.fit', date_time=(2000, 1, 1, 0, 0, 0)),
+                    anonymize_fit(fit, lat_offset, lon_offset))
+    with open(zip_path, 'wb') as f:
+        f.write(archive.getvalue())
+    with open(gpx_path, 'wb') as f:
+        f.write(anonymize_gpx(gpx, lat_offset, lon_offset))
+    return zip_path, gpx_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Anonymize a Garmin ORIGINAL download and its GPX export.')
+    parser.add_argument('original')
+    parser.add_argument('gpx')
+    parser.add_argument('name', help='fixture name, e.g. forerunner255_run')
+    parser.add_argument('--origin', default='0,0', help='LAT,LON the track is moved to start at')
+    args = parser.parse_args()
+
+    origin = tuple(float(value) for value in args.origin.split(','))
+    with open(args.original, 'rb') as f:
+        original = f.read()
+    with open(args.gpx, 'rb') as f:
+        gpx = f.read()
+    for path in anonymize_pair(original, gpx, args.name, origin):
+        print(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
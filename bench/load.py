@@ -0,0 +1,167 @@
+# ========================================================
+# = bench/load.py - UI latency under concurrent use
+# ========================================================
+# Starts the app on a scratch database with seeded records, under gunicorn
+# (the production setup) or the Flask development server, and measures the
+# latency of UI and API requests from concurrent clients. Optionally one
+# client keeps starting uploads to show that long work no longer holds
+# request workers.
+#
+# Usage (from the repository root):
+#   python bench/load.py [--server gunicorn|dev] [--clients 16] [--requests 50]
+#                        [--records 2000] [--with-uploads] [--p95-budget 0.5]
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATHS = ('/', '/?before={cursor}', '/api/stats', '/api/records?limit=50', '/custom_check_status')
+
+SEED_SCRIPT = """
+import datetime, sys
+from app import create_app
+from models import db, DownloadRecord
+app = create_app(start_services=False)
+with app.app_context():
+    start = datetime.date(2020, 1, 1)
+    db.session.bulk_save_objects([
+        DownloadRecord(filename=f"{start + datetime.timedelta(days=i // 3)}_{1000 + i}.gpx",
+                       dawarich=i % 5 != 0, file_exists=False)
+        for i in range(int(sys.argv[1]))
+    ])
+    db.session.commit()
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server did not come up at {url}")
+
+
+def start_server(kind, env, port):
+    if kind == 'gunicorn':
+        env = dict(env, GUNICORN_BIND=f'127.0.0.1:{port}', GUNICORN_ACCESSLOG='')
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+    else:
+        env = dict(env, FLASK_APP='app.py')
+        cmd = [sys.executable, '-m', 'flask', 'run', '--port', str(port), '--no-reload']
+    return subprocess.Popen(cmd, cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def client(base_url, count, latencies, errors):
+    for i in range(count):
+        path = PATHS[i % len(PATHS)].format(cursor=1000)
+        started = time.perf_counter()
+        try:
+            urllib.request.urlopen(base_url + path, timeout=30).read()
+            latencies.append(time.perf_counter() - started)
+        except OSError:
+            errors.append(path)
+
+
+def upload_client(base_url, stop):
+    # Keeps asking for uploads of every pending record, as an impatient user would
+    while not stop.is_set():
+        try:
+            urllib.request.urlopen(base_url + '/upload', timeout=30).read()
+        except OSError:
+            pass
+        time.sleep(0.5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UI latency under concurrent use.')
+    parser.add_argument('--server', choices=('gunicorn', 'dev'), default='gunicorn')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=50, help='per client')
+    parser.add_argument('--records', type=int, default=2000)
+    parser.add_argument('--with-uploads', action='store_true')
+    parser.add_argument('--p95-budget', type=float, default=0.5, help='seconds')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.update(
+            LITEFS_DB_PATH=os.path.join(tmp, 'load.db'),
+            ACTIVITIES_DIR=os.path.join(tmp, 'activities'),
+            SERVICE_LOCK_FILE=os.path.join(tmp, 'services.lock'),
+            ACCOUNTS_FILE=os.path.join(tmp, 'accounts.json'),
+            RECONCILE_INTERVAL_HOURS='0',
+            FLASK_DEBUG='0',
+        )
+        # Keep the Dawarich pre-flight check off the network
+        for key in ('DAWARICH_HOST', 'DAWARICH_EMAIL', 'DAWARICH_PASSWORD', 'POSTGRES_USER'):
+            env.pop(key, None)
+        subprocess.run([sys.executable, '-c', SEED_SCRIPT, str(args.records)],
+                       cwd=REPO_ROOT, env=env, check=True, capture_output=True)
+
+        port = free_port()
+        base_url = f'http://127.0.0.1:{port}'
+        server = start_server(args.server, env, port)
+        stop = threading.Event()
+        try:
+            wait_until_up(base_url + '/api/stats')
+            if args.with_uploads:
+                threading.Thread(target=upload_client, args=(base_url, stop), daemon=True).start()
+
+            latencies, errors = [], []
+            workers = [
+                threading.Thread(target=client, args=(base_url, args.requests, latencies, errors))
+                for _ in range(args.clients)
+            ]
+            started = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            stop.set()
+            server.terminate()
+            server.wait(timeout=30)
+
+    latencies.sort()
+    summary = {
+        'server': args.server,
+        'clients': args.clients,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50': round(statistics.median(latencies), 4) if latencies else None,
+        'p95': round(latencies[int(len(latencies) * 0.95) - 1], 4) if latencies else None,
+        'max': round(latencies[-1], 4) if latencies else None,
+    }
+    print(json.dumps(summary, indent=2))
+
+    failures = []
+    if errors:
+        failures.append(f"{len(errors)} requests failed")
+    if summary['p95'] is None or summary['p95'] > args.p95_budget:
+        failures.append(f"p95 latency {summary['p95']}s exceeds the budget of {args.p95_budget}s")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
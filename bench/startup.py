@@ -0,0 +1,102 @@
+# ========================================================
+# = bench/startup.py - Cold start benchmark with a regression budget
+# ========================================================
+# Measures, in a fresh interpreter per run:
+#   - the time to import the app module
+#   - the time for create_app()
+#   - the time to first response (GET / through the test client)
+# and fails when the median exceeds the budget or when a heavy module is
+# imported eagerly again.
+#
+# Usage (from the repository root):
+#   python bench/startup.py [--runs 5] [--import-budget 0.5] [--first-response-budget 1.5]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported when they are actually used
+LAZY_MODULES = ('garminconnect', 'garth', 'bs4', 'requests', 'apscheduler')
+
+CHILD_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+eager = [m for m in %r if m in sys.modules]
+# Background services are left out, as in the other benchmarks and the tests
+flask_app = app.create_app(start_services=False)
+t2 = time.perf_counter()
+response = flask_app.test_client().get('/')
+t3 = time.perf_counter()
+print(json.dumps({
+    'import': t1 - t0,
+    'create_app': t2 - t1,
+    'first_response': t3 - t0,
+    'status': response.status_code,
+    'eager_modules': eager,
+}))
+""" % (LAZY_MODULES,)
+
+
+def run_once(tmp):
+    env = dict(os.environ)
+    env.update(
+        LITEFS_DB_PATH=os.path.join(tmp, 'bench.db'),
+        ACTIVITIES_DIR=os.path.join(tmp, 'activities'),
+        ACCOUNTS_FILE=os.path.join(tmp, 'accounts.json'),
+        PROFILE_DIR=os.path.join(tmp, 'profiles'),
+        FLASK_DEBUG='0',
+    )
+    # Keep the Dawarich pre-flight check off the network
+    for key in ('DAWARICH_HOST', 'DAWARICH_EMAIL', 'DAWARICH_PASSWORD', 'POSTGRES_USER'):
+        env.pop(key, None)
+    out = subprocess.run(
+        [sys.executable, '-c', CHILD_SCRIPT],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start benchmark with a regression budget.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--import-budget', type=float, default=0.5, help='seconds, median')
+    parser.add_argument('--first-response-budget', type=float, default=1.5, help='seconds, median')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The first run creates the schema; measure warm-database cold starts after it
+        run_once(tmp)
+        results = [run_once(tmp) for _ in range(args.runs)]
+
+    summary = {
+        key: round(statistics.median(r[key] for r in results), 4)
+        for key in ('import', 'create_app', 'first_response')
+    }
+    summary['eager_modules'] = sorted({m for r in results for m in r['eager_modules']})
+    summary['status'] = results[-1]['status']
+    print(json.dumps(summary, indent=2))
+
+    failures = []
+    if summary['import'] > args.import_budget:
+        failures.append(f"import took {summary['import']}s (budget {args.import_budget}s)")
+    if summary['first_response'] > args.first_response_budget:
+        failures.append(f"first response took {summary['first_response']}s (budget {args.first_response_budget}s)")
+    if summary['eager_modules']:
+        failures.append(f"modules imported eagerly: {', '.join(summary['eager_modules'])}")
+    if summary['status'] != 200:
+        failures.append(f"first response status was {summary['status']}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,303 @@
+# ========================================================
+# = cli.py - Headless commands for backfills, uploads and file checks
+# ========================================================
+# Runs the same download, upload and reconciliation code as the web UI,
+# without the web server or the scheduler, e.g. from cron or a one-off container:
+#   python cli.py backfill 2023-01-01 2023-12-31 --workers 2
+#   python cli.py upload --workers 4 --limit 500
+#   python cli.py reconcile --repair
+#   python cli.py rebuild
+# Progress goes to stderr; the final summary is printed to stdout as JSON.
+# The exit status is 0 on success, 1 when something failed and 130 when interrupted.
+import os
+import sys
+import json
+import time
+import queue
+import datetime
+import threading
+import click
+from flask import current_app
+from flask.cli import FlaskGroup
+from models import db, DownloadRecord, SyncRun
+
+DEFAULT_STATE_FILE = '/garmin/backfill-state.json'
+
+
+def _create_app():
+    from app import create_app
+    return create_app(start_services=False)
+
+
+cli = FlaskGroup(create_app=_create_app, add_default_commands=False, add_version_option=False,
+                 help="Headless sync commands. The web server and scheduler are not started.")
+
+# --------------------------------------------------------
+# - Helpers
+#---------------------------------------------------------
+class Progress:
+    """Progress lines with throughput on stderr, suppressed with --quiet."""
+    def __init__(self, total, unit, quiet=False):
+        self.total = total
+        self.unit = unit
+        self.quiet = quiet
+        self.done = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def rate(self):
+        """Units per minute so far."""
+        return self.done / (self.elapsed / 60) if self.elapsed else 0.0
+
+    def step(self, message, count=1):
+        with self._lock:
+            self.done += count
+            if not self.quiet:
+                click.echo(f"[{self.done}/{self.total}] {message} ({self.rate():.1f} {self.unit}/min)", err=True)
+
+
+def start_run(kind, upload_order=None):
+    run = SyncRun(kind=kind, upload_order=upload_order)
+    db.session.add(run)
+    db.session.commit()
+    return run
+
+
+def finish(run, summary, stop_reason):
+    """Stores the run summary, prints it as JSON and exits with the matching status."""
+    run = db.session.get(SyncRun, run.id)
+    run.finished_at = datetime.datetime.utcnow()
+    for key in ('downloaded', 'uploaded', 'failed', 'remaining'):
+        if key in summary:
+            setattr(run, key, summary[key])
+    run.stop_reason = stop_reason
+    db.session.commit()
+
+    summary = dict(summary, run_id=run.id, stop_reason=stop_reason)
+    click.echo(json.dumps(summary, indent=2, default=str))
+    if stop_reason == 'interrupted':
+        sys.exit(130)
+    sys.exit(1 if summary.get('failed') or summary.get('errors') else 0)
+
+
+def read_state(path, start, end):
+    """Returns the saved position of an interrupted backfill of the same range, or None."""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if state.get('start') != start.isoformat() or state.get('end') != end.isoformat():
+        return None
+    return state
+
+
+def write_state(path, state):
+    from storage import AtomicFile
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with AtomicFile(path) as f:
+        f.write(json.dumps(state).encode())
+
+
+# --------------------------------------------------------
+# - Commands
+#---------------------------------------------------------
+@cli.command('backfill')
+@click.argument('start', type=click.DateTime(formats=['%Y-%m-%d']), metavar='START')
+@click.argument('end', type=click.DateTime(formats=['%Y-%m-%d']), metavar='END')
+@click.option('--workers', type=int, default=None, help="Accounts synced in parallel (default SYNC_MAX_WORKERS).")
+@click.option('--delay', type=float, default=0, show_default=True, help="Seconds to wait between days.")
+@click.option('--upload/--no-upload', default=True, show_default=True, help="Upload files while downloading.")
+@click.option('--state-file', default=DEFAULT_STATE_FILE, show_default=True, help="Where the position is saved after every day.")
+@click.option('--restart', is_flag=True, help="Ignore the saved position and start at START.")
+@click.option('--quiet', is_flag=True, help="No progress output.")
+def backfill(start, end, workers, delay, upload, state_file, restart, quiet):
+    """
+    Downloads (and uploads) every account's activities from START to END,
+    day by day, like Custom Check. An interrupted backfill of the same range
+    continues at the first unfinished day. START and END are YYYY-MM-DD.
+    """
+    from pipeline import UploadPipeline
+    from utils import download_all_accounts
+
+    app = current_app._get_current_object()
+    if workers:
+        app.config['SYNC_MAX_WORKERS'] = workers
+    start, end = start.date(), end.date()
+    if end < start:
+        raise click.BadParameter("END is before START.")
+
+    state = None if restart else read_state(state_file, start, end)
+    totals = {'downloaded': 0, 'uploaded': 0, 'failed': 0}
+    day = start
+    if state:
+        day = datetime.date.fromisoformat(state['next_day'])
+        if not quiet:
+            click.echo(f"Resuming backfill at {day}.", err=True)
+
+    day_resumed = day if state else None
+    run = start_run('backfill')
+    progress = Progress((end - day).days + 1, 'days', quiet)
+    pipelines = {
+        name: UploadPipeline(app, account, f"Backfill[{name}]", take_slot=True).start()
+        for name, account in app.config['ACCOUNTS'].items()
+    } if upload else None
+
+    stop_reason = 'completed'
+    errors = {}
+    try:
+        while day <= end:
+            count, day_errors = download_all_accounts(
+                app, datetime.datetime.combine(day, datetime.time.min), datetime.datetime.combine(day, datetime.time.max),
+                pipelines, use_cache=True,
+            )
+            if day_errors:
+                errors = {name: f"{day}: {e}" for name, e in day_errors.items()}
+                stop_reason = 'error'
+                break
+            totals['downloaded'] += count
+            finished_day, day = day, day + datetime.timedelta(days=1)
+            write_state(state_file, {'start': start.isoformat(), 'end': end.isoformat(), 'next_day': day.isoformat()})
+            progress.step(f"{finished_day}: {count} downloaded, {totals['downloaded']} in total")
+            if delay and day <= end:
+                time.sleep(delay)
+    except KeyboardInterrupt:
+        stop_reason = 'interrupted'
+        if not quiet:
+            click.echo(f"Interrupted; the backfill resumes at {day} when run again.", err=True)
+    finally:
+        if pipelines:
+            if not quiet:
+                click.echo("Finishing uploads...", err=True)
+            for pipeline in pipelines.values():
+                pipeline.close()
+                totals['uploaded'] += pipeline.uploaded
+                totals['failed'] += pipeline.failed
+
+    if stop_reason == 'completed' and os.path.exists(state_file):
+        os.remove(state_file)
+    finish(run, dict(totals, start=start, end=end, resumed_from=day_resumed, next_day=day if day <= end else None,
+                     days_per_minute=round(progress.rate(), 2), duration_seconds=round(progress.elapsed, 1),
+                     errors=errors), stop_reason)
+
+
+@cli.command('upload')
+@click.option('--workers', type=int, default=1, show_default=True, help="Uploads running in parallel.")
+@click.option('--limit', type=int, default=0, help="Upload at most this many files (default: all).")
+@click.option('--max-seconds', type=int, default=0, help="Stop starting uploads after this many seconds.")
+@click.option('--order', type=click.Choice(['oldest', 'newest', 'smallest']), default=None, help="Default: UPLOAD_ORDER.")
+@click.option('--account', default=None, help="Only this account's files.")
+@click.option('--delay', type=float, default=None, help="Seconds each worker waits between uploads (default UPLOAD_DELAY_SECONDS).")
+@click.option('--quiet', is_flag=True, help="No progress output.")
+def upload(workers, limit, max_seconds, order, account, delay, quiet):
+    """
+    Uploads every file not yet in Dawarich, with CONSOLIDATE_DAILY one import
+    per account and day. Already uploaded files are never sent again, so an
+    interrupted upload simply continues on the next run.
+    """
+    from consolidate import bundle_size, group_by_day, upload_group
+    from pipeline import RunBudget
+    from utils import pending_uploads_query
+
+    app = current_app._get_current_object()
+    if order:
+        app.config['UPLOAD_ORDER'] = order
+    delay = app.config.get('UPLOAD_DELAY_SECONDS', 5) if delay is None else delay
+
+    rows = pending_uploads_query(account).with_entities(DownloadRecord.id, DownloadRecord.filename, DownloadRecord.account).all()
+    if limit:
+        rows = rows[:limit]
+    run = start_run('upload', app.config.get('UPLOAD_ORDER'))
+    budget = RunBudget(max_seconds)
+    progress = Progress(len(rows), 'files', quiet)
+    todo = queue.Queue()
+    for group in group_by_day(rows, bundle_size(app.config)):
+        todo.put([row.id for row in group])
+    counts = {'uploaded': 0, 'failed': 0}
+    counts_lock = threading.Lock()
+    stop = threading.Event()
+
+    def worker():
+        with app.app_context():
+            first = True
+            while not stop.is_set():
+                try:
+                    record_ids = todo.get_nowait()
+                except queue.Empty:
+                    return
+                if not budget.take():
+                    return
+                if not first and delay:
+                    time.sleep(delay)
+                first = False
+                records = [record for record in (db.session.get(DownloadRecord, record_id) for record_id in record_ids)
+                           if record is not None and not record.dawarich]
+                if not records:
+                    continue
+                name = records[0].filename if len(records) == 1 else f"{len(records)} activities of {records[0].filename[:10]}"
+                try:
+                    uploaded = upload_group(records, "CLI upload")
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"CLI upload: {name} failed: {e}", exc_info=True)
+                    uploaded = 0
+                with counts_lock:
+                    counts['uploaded'] += uploaded
+                    counts['failed'] += len(records) - uploaded
+                progress.step(f"{name} {'uploaded' if uploaded == len(records) else 'FAILED'}", len(records))
+
+    threads = [threading.Thread(target=worker, name=f"cli-upload-{i}", daemon=True) for i in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+    stop_reason = 'completed'
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        stop.set()
+        stop_reason = 'interrupted'
+        if not quiet:
+            click.echo("Interrupted; waiting for running uploads to finish...", err=True)
+        for thread in threads:
+            thread.join()
+    if stop_reason == 'completed' and budget.stop_reason == 'time_budget':
+        stop_reason = budget.stop_reason
+
+    finish(run, dict(counts, remaining=pending_uploads_query(account).count(),
+                     files_per_minute=round(progress.rate(), 2), duration_seconds=round(progress.elapsed, 1)),
+           stop_reason)
+
+
+@cli.command('reconcile')
+@click.option('--repair', is_flag=True, help="Relink moved files, remove duplicate names and adopt orphan GPX files.")
+def reconcile_command(repair):
+    """Compares the download records with the files on disk and prints the report."""
+    from reconcile import reconcile
+    from utils import invalidate_record_stats
+
+    report = reconcile(repair=repair)
+    invalidate_record_stats()
+    click.echo(json.dumps(report, indent=2))
+
+
+@cli.command('rebuild')
+def rebuild_command():
+    """
+    Recreates the download records from the Dawarich imports and the files on
+    disk after the database was lost. Only runs when there are no records.
+    """
+    from recovery import run_rebuild
+
+    report = run_rebuild(current_app._get_current_object())
+    click.echo(json.dumps(report, indent=2))
+    sys.exit(1 if report['status'] == 'error' else 0)
+
+
+if __name__ == '__main__':
+    cli()
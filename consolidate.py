@@ -0,0 +1,203 @@
+# ========================================================
+# = consolidate.py - One Dawarich import per day instead of one per activity
+# ========================================================
+# With CONSOLIDATE_DAILY, the pending files of one account and day are merged
+# into a single GPX with one <trk> per activity and uploaded as one import,
+# named after the day and the activity ids it holds, e.g.
+# '2024-01-05_123+456+789.gpx'. The member records are marked uploaded and
+# linked to an UploadBundle row. Activities of a day that arrive after its
+# bundle was uploaded go into another bundle.
+import os
+import re
+import datetime
+import tempfile
+from flask import current_app
+from models import db, UploadBundle
+from reconcile import ACTIVITY_FILE_RE
+
+# Activity ids in the import name; 20 keep it within the 255 byte file name limit
+MAX_BUNDLE_ACTIVITIES = 20
+BUNDLE_FILE_RE = re.compile(r'^(\d{4}-\d{2}-\d{2})_(\d+(?:\+\d+)+)\.gpx$')
+GPX_NS = 'http://www.topografix.com/GPX/1/1'
+GPX_NSMAP = {
+    None: GPX_NS,
+    'ns2': 'http://www.garmin.com/xmlschemas/GpxExtensions/v3',
+    'ns3': 'http://www.garmin.com/xmlschemas/TrackPointExtension/v1',
+}
+
+# --------------------------------------------------------
+# - Grouping
+#---------------------------------------------------------
+def bundle_size(config):
+    """Activities per upload: 1 without CONSOLIDATE_DAILY, else CONSOLIDATE_MAX_ACTIVITIES."""
+    if not config.get('CONSOLIDATE_DAILY'):
+        return 1
+    return max(1, min(config.get('CONSOLIDATE_MAX_ACTIVITIES', 10), MAX_BUNDLE_ACTIVITIES))
+
+
+def bundle_key(record):
+    """(account, 'YYYY-MM-DD') a record is bundled by, or None when its file name carries no date."""
+    if not ACTIVITY_FILE_RE.match(record.filename):
+        return None
+    return (record.account, record.filename[:10])
+
+
+def group_by_day(records, size):
+    """
+    Splits records into upload groups of at most size records of the same
+    account and day, in the order each day first appears. Records without
+    a date in their name are uploaded alone.
+    """
+    groups = []
+    open_groups = {}
+    for record in records:
+        key = bundle_key(record) if size > 1 else None
+        group = open_groups.get(key) if key else None
+        if group is None or len(group) >= size:
+            group = []
+            groups.append(group)
+            if key:
+                open_groups[key] = group
+        group.append(record)
+    return groups
+
+
+def bundle_filename(day, records):
+    """Import name of a bundle: the day and the activity ids of its members."""
+    return f"{day}_{'+'.join(ACTIVITY_FILE_RE.match(r.filename).group(1) for r in records)}.gpx"
+
+
+def bundle_members(import_name):
+    """File names of the activities in a bundle import, or [] when the name is not a bundle's."""
+    match = BUNDLE_FILE_RE.match(import_name)
+    if not match:
+        return []
+    return [f"{match.group(1)}_{activity_id}.gpx" for activity_id in match.group(2).split('+')]
+
+
+# --------------------------------------------------------
+# - Merging
+#---------------------------------------------------------
+def write_bundle(paths, dest):
+    """
+    Writes one GPX 1.1 file at dest holding every <trk> of the given files,
+    in order. The files are read with lxml's iterparse and each element is
+    copied to an incremental writer as it is parsed, then dropped, so memory
+    use stays flat however long the tracks are. Metadata, waypoints and
+    routes of the members are left out. Returns the number of tracks written.
+    Raises lxml.etree.XMLSyntaxError when a member is not well-formed.
+    """
+    from lxml import etree
+
+    tracks = 0
+    with etree.xmlfile(dest, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element(f'{{{GPX_NS}}}gpx', {'version': '1.1', 'creator': 'Garmin to Dawarich'}, nsmap=GPX_NSMAP):
+            for path in paths:
+                open_elements = [] # writer contexts of the track being copied
+                depth = 0
+                for event, element in etree.iterparse(path, events=('start', 'end'), huge_tree=True):
+                    if event == 'start':
+                        depth += 1
+                        if open_elements or (depth == 2 and etree.QName(element).localname == 'trk'):
+                            context = xf.element(element.tag, dict(element.attrib))
+                            context.__enter__()
+                            open_elements.append(context)
+                        continue
+                    depth -= 1
+                    if not open_elements:
+                        continue
+                    if len(element) == 0 and element.text and element.text.strip():
+                        xf.write(element.text.strip())
+                    open_elements.pop().__exit__(None, None, None)
+                    if not open_elements:
+                        tracks += 1
+                    # Drop what was copied, including the already written siblings
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+    return tracks
+
+
+# --------------------------------------------------------
+# - Upload
+#---------------------------------------------------------
+def upload_group(records, log_prefix, account=None):
+    """
+    Uploads a group from group_by_day(): alone when it has one record,
+    otherwise as one bundle. Returns the number of records uploaded.
+    """
+    from utils import upload_record
+
+    if len(records) == 1:
+        return 1 if upload_record(records[0], log_prefix, account) else 0
+    return upload_bundle(records, log_prefix, account)
+
+
+def upload_bundle(records, log_prefix, account=None):
+    """
+    Merges the GPX files of records of one account and day and uploads them
+    as a single import, then marks the records uploaded and links them to a
+    new UploadBundle; with delete_old_gpx their files are removed as after
+    a single upload. Records whose file is missing are marked and left out.
+    When a file cannot be merged, the records are uploaded one by one.
+    Returns the number of records uploaded.
+    """
+    from lxml import etree
+    from accounts import get_account
+    from storage import activities_dir, record_path
+    from utils import upload_record, submit_location_data, invalidate_record_stats, delete_uploaded_file
+
+    present = []
+    for record in records:
+        if record.relpath is None and not os.path.exists(record_path(record)):
+            # The layout migration may have just moved the file
+            db.session.refresh(record)
+        if os.path.exists(record_path(record)):
+            present.append(record)
+            continue
+        current_app.logger.error(f"{log_prefix}: File {record_path(record)} not found for record ID {record.id}. Skipping.")
+        record.file_exists = False
+    if len(present) < len(records):
+        db.session.commit()
+    if len(present) <= 1:
+        return sum(1 for record in present if upload_record(record, log_prefix, account))
+
+    account_name, day = bundle_key(present[0])
+    filename = bundle_filename(day, present)
+    try:
+        # A hidden directory, so a file check never takes the bundle for an orphan
+        with tempfile.TemporaryDirectory(prefix='.bundle-', dir=activities_dir()) as tmp:
+            path = os.path.join(tmp, filename)
+            try:
+                tracks = write_bundle([record_path(record) for record in present], path)
+            except etree.XMLSyntaxError as e:
+                current_app.logger.warning(f"{log_prefix}: Could not merge the files of {day} ({e}), uploading them one by one.")
+                return sum(1 for record in present if upload_record(record, log_prefix, account))
+            file_size = os.path.getsize(path)
+            current_app.logger.info(f"{log_prefix}: Attempting to upload {filename} ({len(present)} activities, {tracks} tracks, {file_size} bytes)")
+            success = submit_location_data(path, account=account or get_account(account_name))
+
+        if not success:
+            current_app.logger.warning(f"{log_prefix}: Upload of {filename} reported non-success by submit_location_data.")
+            return 0
+
+        bundle = UploadBundle(account=account_name, day=datetime.date.fromisoformat(day), filename=filename,
+                              activities=len(present), file_size=file_size)
+        db.session.add(bundle)
+        db.session.flush()
+        for record in present:
+            record.dawarich = True
+            record.bundle_id = bundle.id
+            # delete_old_gpx applies to the member files, not to the merged temporary file
+            delete_uploaded_file(record, log_prefix)
+            record.file_exists = os.path.exists(record_path(record))
+        db.session.commit()
+        invalidate_record_stats()
+        current_app.logger.info(f"{log_prefix}: Successfully uploaded {filename} and linked {len(present)} records to bundle ID {bundle.id}.")
+        return len(present)
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"{log_prefix}: Failed to upload {filename}: {e}", exc_info=True)
+        return 0
@@ -0,0 +1,274 @@
+# ========================================================
+# = exports.py - Export of downloaded GPX files to other destinations
+# ========================================================
+from flask import current_app
+import os
+import errno
+import shutil
+import datetime
+import threading
+from models import db, ExportRecord, DownloadRecord
+from storage import record_path
+
+# Linux ioctl request number for FICLONE (reflink a whole file)
+FICLONE = 0x40049409
+EXPORT_MAX_ATTEMPTS = 8
+EXPORT_RETRY_INTERVAL = 60 # seconds between queue scans when nothing wakes the worker
+EXPORT_BATCH_SIZE = 50
+
+# --------------------------------------------------------
+# - File Transfer
+#---------------------------------------------------------
+def _copy_file_contents(fsrc, fdst):
+    """
+    Copies file contents without going through Python buffers where possible.
+    Tries a reflink (FICLONE), then copy_file_range, then a streaming copy.
+    Returns the method that was used.
+    """
+    try:
+        import fcntl
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return 'reflink'
+    except (ImportError, OSError):
+        pass
+
+    if hasattr(os, 'copy_file_range'):
+        try:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+            if remaining == 0:
+                return 'copy_file_range'
+        except OSError:
+            pass
+        # Start over with a plain copy
+        fsrc.seek(0)
+        fdst.seek(0)
+        fdst.truncate()
+
+    shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+    return 'copy'
+
+
+def link_or_copy(src, dest):
+    """
+    Places src at dest with as little I/O as possible: a hardlink when both
+    paths are on the same filesystem, otherwise a reflink or kernel-side copy,
+    falling back to a streaming copy. dest is replaced atomically.
+    Returns the method that was used.
+    """
+    tmp_path = f"{dest}.part"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+
+    try:
+        os.link(src, tmp_path)
+        os.replace(tmp_path, dest)
+        return 'hardlink'
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EACCES):
+            raise
+
+    try:
+        with open(src, 'rb') as fsrc, open(tmp_path, 'wb') as fdst:
+            method = _copy_file_contents(fsrc, fdst)
+        shutil.copystat(src, tmp_path)
+        os.replace(tmp_path, dest)
+    except BaseException:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return method
+
+
+# --------------------------------------------------------
+# - Export Sinks
+#---------------------------------------------------------
+class DirectorySink:
+    """Exports GPX files into a directory on a local or mounted filesystem."""
+    type_name = 'directory'
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+
+    def export(self, src_path, filename):
+        os.makedirs(self.path, exist_ok=True)
+        return link_or_copy(src_path, os.path.join(self.path, filename))
+
+
+class GeoPulseSink(DirectorySink):
+    """Exports GPX files into the GeoPulse import drop folder of one user."""
+    type_name = 'geopulse'
+
+    def __init__(self, name, path, user):
+        super().__init__(name, os.path.join(path, user))
+
+
+# Sink types that can be configured through EXPORT_SINKS
+SINK_TYPES = {
+    DirectorySink.type_name: DirectorySink,
+    GeoPulseSink.type_name: GeoPulseSink,
+}
+
+
+def build_sinks(config, logger):
+    """
+    Builds the configured export sinks.
+    GeoPulse comes from the GEOPULSE_* settings, any other sinks from
+    EXPORT_SINKS, a list of dicts with a 'type', a unique 'name' and the
+    arguments of that sink type, e.g. [{'type': 'directory', 'name': 'nas', 'path': '/nas/gpx'}].
+    """
+    sinks = {}
+    if config.get('GEOPULSE_ENABLE') and config.get('GEOPULSE_USER') and config.get('GEOPULSE_PATH'):
+        sinks['geopulse'] = GeoPulseSink('geopulse', config['GEOPULSE_PATH'], config['GEOPULSE_USER'])
+
+    for sink_config in config.get('EXPORT_SINKS', []):
+        options = dict(sink_config)
+        sink_cls = SINK_TYPES.get(options.pop('type', 'directory'))
+        name = options.pop('name', None)
+        if not sink_cls or not name or name in sinks:
+            logger.error(f"Ignoring invalid export sink configuration: {sink_config}")
+            continue
+        try:
+            sinks[name] = sink_cls(name, **options)
+        except TypeError as e:
+            logger.error(f"Ignoring export sink '{name}': {e}")
+
+    return sinks
+
+
+# --------------------------------------------------------
+# - Export Queue
+#---------------------------------------------------------
+def queue_exports(record):
+    """Adds one pending export per configured sink for a new download record. Does not commit."""
+    for sink_name in current_app.config.get('EXPORT_SINKS_ACTIVE', {}):
+        db.session.add(ExportRecord(record_id=record.id, filename=record.filename, sink=sink_name))
+
+
+def has_pending_exports(record_id):
+    """True while an export of the record's file has not completed or failed for good."""
+    return db.session.query(ExportRecord.id).filter(
+        ExportRecord.record_id == record_id,
+        ExportRecord.status == 'pending',
+    ).first() is not None
+
+
+def release_uploaded_files(records):
+    """
+    Removes the files kept only for their exports: those of records already
+    uploaded to Dawarich while delete_old_gpx is on, once no export of them
+    is pending.
+    """
+    from utils import delete_uploaded_file
+
+    for record in records:
+        if record.dawarich and record.file_exists:
+            delete_uploaded_file(record, "Export")
+            record.file_exists = os.path.exists(record_path(record))
+    db.session.commit()
+
+
+def notify_export_worker():
+    """Wakes the export worker of this process, if it is running."""
+    worker = current_app.config.get('EXPORT_WORKER')
+    if worker:
+        worker.wake.set()
+
+
+def process_pending_exports(batch_size=EXPORT_BATCH_SIZE):
+    """
+    Runs at most batch_size exports that are due, oldest first.
+    Failures are retried with exponential backoff until EXPORT_MAX_ATTEMPTS.
+    Returns (number of exports that completed, number of exports fetched).
+    """
+    sinks = current_app.config.get('EXPORT_SINKS_ACTIVE', {})
+    now = datetime.datetime.utcnow()
+    due = ExportRecord.query.filter(
+        ExportRecord.status == 'pending',
+        ExportRecord.next_attempt_at <= now,
+    ).order_by(ExportRecord.id.asc()).limit(batch_size).all()
+    # Source files are resolved through their records, in one query per batch
+    record_ids = {export.record_id for export in due}
+    records = {
+        record.id: record
+        for record in DownloadRecord.query.filter(DownloadRecord.id.in_(record_ids))
+    } if record_ids else {}
+
+    done = 0
+    for export in due:
+        sink = sinks.get(export.sink)
+        record = records.get(export.record_id)
+        src_path = record_path(record) if record else export.filename
+        export.attempts += 1
+        try:
+            if sink is None:
+                raise LookupError(f"Export sink '{export.sink}' is no longer configured.")
+            if record is None or not os.path.exists(src_path):
+                raise FileNotFoundError(f"Source file {src_path} no longer exists.")
+            export.method = sink.export(src_path, export.filename)
+            export.status = 'done'
+            export.last_error = None
+            done += 1
+            current_app.logger.info(f"Exported {export.filename} to '{export.sink}' via {export.method}.")
+        except (LookupError, FileNotFoundError) as e:
+            # Retrying cannot fix these
+            export.status = 'failed'
+            export.last_error = str(e)
+            current_app.logger.error(f"Export of {export.filename} to '{export.sink}' failed: {e}")
+        except Exception as e:
+            export.last_error = str(e)[:500]
+            if export.attempts >= EXPORT_MAX_ATTEMPTS:
+                export.status = 'failed'
+                current_app.logger.error(f"Export of {export.filename} to '{export.sink}' failed permanently: {e}")
+            else:
+                delay = min(60 * 2 ** export.attempts, 6 * 3600)
+                export.next_attempt_at = now + datetime.timedelta(seconds=delay)
+                current_app.logger.warning(f"Export of {export.filename} to '{export.sink}' failed, retrying in {delay}s: {e}")
+        db.session.commit()
+
+    finished = {export.record_id for export in due if export.status != 'pending'}
+    release_uploaded_files([record for record_id, record in records.items() if record_id in finished])
+    return done, len(due)
+
+
+def drain_pending_exports(batch_size=EXPORT_BATCH_SIZE):
+    """
+    Runs batches of due exports until one comes back short, whatever the
+    outcome of each export. Returns the number of exports that completed.
+    """
+    total = 0
+    while True:
+        done, fetched = process_pending_exports(batch_size)
+        total += done
+        if fetched < batch_size:
+            return total
+
+
+class ExportWorker(threading.Thread):
+    """
+    Background thread that drains the export queue, so exports never slow
+    down the download loop. It wakes up when notified and otherwise rescans
+    every EXPORT_RETRY_INTERVAL seconds to pick up retries.
+    """
+    def __init__(self, app):
+        super().__init__(name='export-worker', daemon=True)
+        self.app = app
+        self.wake = threading.Event()
+
+    def run(self):
+        while True:
+            self.wake.clear()
+            with self.app.app_context():
+                try:
+                    drain_pending_exports()
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.error(f"Export worker error: {e}", exc_info=True)
+                finally:
+                    db.session.remove()
+            self.wake.wait(timeout=EXPORT_RETRY_INTERVAL)
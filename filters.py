@@ -0,0 +1,139 @@
+# ========================================================
+# = filters.py - Pre-download filtering of activity summaries
+# ========================================================
+import re
+import datetime
+import threading
+from collections import Counter
+
+# Conditions a rule can combine. A rule matches when all of its conditions do.
+#   names            exact activity names, e.g. ['Indoor Cycling']
+#   name_pattern     regular expression searched in the name, case-insensitive
+#   types            Garmin activity type keys, e.g. ['indoor_cycling', 'strength_training']
+#   duration_below / duration_above    seconds
+#   distance_below / distance_above    meters
+#   has_gps          True/False, from the summary's polyline and start coordinates
+RULE_CONDITIONS = (
+    'names', 'name_pattern', 'types',
+    'duration_below', 'duration_above',
+    'distance_below', 'distance_above',
+    'has_gps',
+)
+
+
+# --------------------------------------------------------
+# - Rule Compilation
+#---------------------------------------------------------
+def _string_set(rule, key):
+    """The values of a list condition; a bare string would otherwise become a set of characters."""
+    values = rule[key]
+    if not isinstance(values, (list, tuple)):
+        raise TypeError(f"'{key}' must be a list, not {type(values).__name__}")
+    return frozenset(values)
+
+
+def _compile_conditions(rule):
+    """Turns one rule dict into a list of predicates over activity rows."""
+    checks = []
+    if 'names' in rule:
+        names = _string_set(rule, 'names')
+        checks.append(lambda act: act['name'] in names)
+    if 'name_pattern' in rule:
+        pattern = re.compile(rule['name_pattern'], re.IGNORECASE)
+        checks.append(lambda act: pattern.search(act['name'] or '') is not None)
+    if 'types' in rule:
+        types = _string_set(rule, 'types')
+        checks.append(lambda act: act['activity_type'] in types)
+    if 'duration_below' in rule:
+        limit = float(rule['duration_below'])
+        checks.append(lambda act, limit=limit: (act['duration'] or 0) < limit)
+    if 'duration_above' in rule:
+        limit = float(rule['duration_above'])
+        checks.append(lambda act, limit=limit: (act['duration'] or 0) > limit)
+    if 'distance_below' in rule:
+        limit = float(rule['distance_below'])
+        checks.append(lambda act, limit=limit: (act['distance'] or 0) < limit)
+    if 'distance_above' in rule:
+        limit = float(rule['distance_above'])
+        checks.append(lambda act, limit=limit: (act['distance'] or 0) > limit)
+    if 'has_gps' in rule:
+        wanted = bool(rule['has_gps'])
+        checks.append(lambda act: bool(act['has_gps']) == wanted)
+    return checks
+
+
+def compile_rules(rules, logger):
+    """
+    Compiles ACTIVITY_FILTERS, a list of dicts with a unique 'name' and any of
+    RULE_CONDITIONS, into (name, predicates) tuples. Invalid rules are logged
+    and ignored. Called once at startup; the compiled rules are shared by all runs.
+    """
+    compiled = []
+    seen = set()
+    for rule in rules:
+        if not isinstance(rule, dict):
+            logger.error(f"Ignoring activity filter that is not a dict: {rule!r}")
+            continue
+        name = rule.get('name')
+        unknown = set(rule) - set(RULE_CONDITIONS) - {'name'}
+        if not name or name in seen or unknown or not set(rule) & set(RULE_CONDITIONS):
+            logger.error(f"Ignoring invalid activity filter: {rule}")
+            continue
+        try:
+            checks = _compile_conditions(rule)
+        except (re.error, TypeError, ValueError) as e:
+            logger.error(f"Ignoring activity filter '{name}': {e}")
+            continue
+        seen.add(name)
+        compiled.append((name, checks))
+    return compiled
+
+
+# --------------------------------------------------------
+# - Per-Run Filter
+#---------------------------------------------------------
+class ActivityFilter:
+    """
+    The filter of one download run: the compiled ACTIVITY_FILTERS rules plus
+    the account's name exclusions (EXCLUDE), counting which rules matched.
+    """
+    def __init__(self, rules, exclusions=()):
+        self.rules = list(rules)
+        if exclusions:
+            self.rules.insert(0, ('exclude', _compile_conditions({'names': exclusions})))
+        self.evaluated = 0
+        self.matched = Counter()
+
+    @classmethod
+    def for_account(cls, config, account):
+        return cls(config.get('ACTIVITY_FILTER_RULES', []), account.get('exclude', []))
+
+    def match(self, act):
+        """Returns the name of the first rule matching an activity row, or None."""
+        self.evaluated += 1
+        for name, checks in self.rules:
+            if all(check(act) for check in checks):
+                self.matched[name] += 1
+                return name
+        return None
+
+    def stats(self):
+        return {'evaluated': self.evaluated, 'matched': dict(self.matched)}
+
+
+_stats_lock = threading.Lock()
+
+
+def record_filter_stats(config, account_name, activity_filter):
+    """
+    Stores the match counts of a finished run in app.config['_FILTER_STATS'],
+    per account: the last run and the totals since startup.
+    """
+    run = activity_filter.stats()
+    with _stats_lock:
+        stats = config.setdefault('_FILTER_STATS', {})
+        entry = stats.setdefault(account_name, {'evaluated': 0, 'matched': {}, 'last_run': None})
+        entry['evaluated'] += run['evaluated']
+        for name, count in run['matched'].items():
+            entry['matched'][name] = entry['matched'].get(name, 0) + count
+        entry['last_run'] = dict(run, finished_at=datetime.datetime.now().isoformat(timespec='seconds'))
@@ -0,0 +1,254 @@
+# ========================================================
+# = fit_to_gpx.py - Convert Garmin FIT activity files to GPX
+# ========================================================
+import io
+import struct
+import zipfile
+import datetime
+from xml.sax.saxutils import escape
+
+# FIT timestamps count seconds from 1989-12-31 00:00:00 UTC
+FIT_EPOCH = datetime.datetime(1989, 12, 31, tzinfo=datetime.timezone.utc)
+SEMICIRCLES_TO_DEGREES = 180.0 / 2 ** 31
+GPX_FLUSH_POINTS = 500 # trackpoints buffered before writing to the output
+
+MESG_RECORD = 20
+FIELD_TIMESTAMP = 253
+
+# Record message fields that end up in the GPX, by field definition number
+RECORD_FIELDS = {
+    0: 'lat',            # position_lat, semicircles
+    1: 'lon',            # position_long, semicircles
+    2: 'altitude',       # uint16, scale 5, offset 500
+    3: 'hr',             # heart_rate, bpm
+    4: 'cad',            # cadence, rpm
+    13: 'atemp',         # temperature, degrees Celsius
+    78: 'enh_altitude',  # enhanced_altitude, uint32, scale 5, offset 500
+    FIELD_TIMESTAMP: 'timestamp',
+}
+
+# Base type number -> (struct format, invalid value)
+BASE_TYPES = {
+    0x00: ('B', 0xFF),                 # enum
+    0x01: ('b', 0x7F),                 # sint8
+    0x02: ('B', 0xFF),                 # uint8
+    0x03: ('h', 0x7FFF),               # sint16
+    0x04: ('H', 0xFFFF),               # uint16
+    0x05: ('i', 0x7FFFFFFF),           # sint32
+    0x06: ('I', 0xFFFFFFFF),           # uint32
+    0x0A: ('B', 0x00),                 # uint8z
+    0x0B: ('H', 0x0000),               # uint16z
+    0x0C: ('I', 0x00000000),           # uint32z
+    0x0D: ('B', 0xFF),                 # byte
+    0x0E: ('q', 0x7FFFFFFFFFFFFFFF),   # sint64
+    0x0F: ('Q', 0xFFFFFFFFFFFFFFFF),   # uint64
+    0x10: ('Q', 0x0000000000000000),   # uint64z
+}
+
+
+class FitError(ValueError):
+    """Raised when data is not a readable FIT file."""
+
+
+# --------------------------------------------------------
+# - FIT Decoding
+#---------------------------------------------------------
+class _Definition:
+    """Layout of one local message type, compiled into a single struct."""
+    __slots__ = ('global_num', 'size', 'struct', 'names', 'invalid')
+
+    def __init__(self, global_num, big_endian, fields, dev_size):
+        wanted = RECORD_FIELDS if global_num == MESG_RECORD else {FIELD_TIMESTAMP: 'timestamp'}
+        fmt = ['>' if big_endian else '<']
+        self.names = []
+        self.invalid = []
+        for field_num, size, base_type in fields:
+            base = BASE_TYPES.get(base_type & 0x1F)
+            if field_num in wanted and base and struct.calcsize(base[0]) == size:
+                fmt.append(base[0])
+                self.names.append(wanted[field_num])
+                self.invalid.append(base[1])
+            else:
+                fmt.append(f'{size}x')
+        self.global_num = global_num
+        self.struct = struct.Struct(''.join(fmt))
+        self.size = self.struct.size + dev_size
+
+    def decode(self, raw):
+        return {
+            name: value
+            for name, value, invalid in zip(self.names, self.struct.unpack_from(raw), self.invalid)
+            if value != invalid
+        }
+
+
+def _read_exact(read, size):
+    data = read(size)
+    if len(data) != size:
+        raise FitError("Unexpected end of FIT data.")
+    return data
+
+
+def iter_fit_records(stream):
+    """
+    Yields the record messages (track points) of a FIT file as dicts with
+    'timestamp' (FIT seconds) and whichever of RECORD_FIELDS they carry.
+    The stream is read sequentially, so memory use does not depend on the
+    file size. Chained FIT files are read one after the other.
+    """
+    read = stream.read
+    first = True
+    while True:
+        header_size = read(1)
+        if not header_size:
+            if first:
+                raise FitError("Empty FIT data.")
+            return
+        header = _read_exact(read, header_size[0] - 1)
+        if len(header) < 11 or header[7:11] != b'.FIT':
+            raise FitError("Missing FIT file header.")
+        first = False
+        remaining = struct.unpack_from('<I', header, 3)[0]
+
+        definitions = {}
+        last_timestamp = None
+        while remaining > 0:
+            record_header = _read_exact(read, 1)[0]
+            remaining -= 1
+
+            if record_header & 0x80:
+                # Compressed timestamp header: a data message with a 5-bit time offset
+                definition = definitions.get((record_header >> 5) & 0x03)
+                if definition is None or last_timestamp is None:
+                    raise FitError("Compressed timestamp without a definition or reference time.")
+                offset = record_header & 0x1F
+                last_timestamp += (offset - last_timestamp) & 0x1F
+                values = definition.decode(_read_exact(read, definition.size))
+                values['timestamp'] = last_timestamp
+                remaining -= definition.size
+            elif record_header & 0x40:
+                # Definition message
+                fixed = _read_exact(read, 5)
+                big_endian = fixed[1] == 1
+                global_num = struct.unpack_from('>H' if big_endian else '<H', fixed, 2)[0]
+                field_count = fixed[4]
+                raw_fields = _read_exact(read, 3 * field_count)
+                fields = [tuple(raw_fields[i:i + 3]) for i in range(0, len(raw_fields), 3)]
+                remaining -= 5 + 3 * field_count
+                dev_size = 0
+                if record_header & 0x20:
+                    # Developer fields are skipped, only their size matters
+                    dev_count = _read_exact(read, 1)[0]
+                    dev_fields = _read_exact(read, 3 * dev_count)
+                    dev_size = sum(dev_fields[i + 1] for i in range(0, len(dev_fields), 3))
+                    remaining -= 1 + 3 * dev_count
+                definitions[record_header & 0x0F] = _Definition(global_num, big_endian, fields, dev_size)
+                continue
+            else:
+                definition = definitions.get(record_header & 0x0F)
+                if definition is None:
+                    raise FitError("Data message without a definition.")
+                values = definition.decode(_read_exact(read, definition.size))
+                remaining -= definition.size
+                if 'timestamp' in values:
+                    last_timestamp = values['timestamp']
+
+            if definition.global_num == MESG_RECORD:
+                yield values
+
+        _read_exact(read, 2) # file CRC
+
+
+# --------------------------------------------------------
+# - GPX Output
+#---------------------------------------------------------
+GPX_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<gpx creator="Garmin Connect" version="1.1"'
+    ' xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/11.xsd"'
+    ' xmlns:ns3="http://www.garmin.com/xmlschemas/TrackPointExtension/v1"'
+    ' xmlns="http://www.topografix.com/GPX/1/1"'
+    ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+    ' xmlns:ns2="http://www.garmin.com/xmlschemas/GpxExtensions/v3">\n'
+)
+
+
+def _gpx_time(fit_timestamp):
+    moment = FIT_EPOCH + datetime.timedelta(seconds=fit_timestamp)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def _trackpoint(point):
+    parts = [
+        f'      <trkpt lat="{point["lat"] * SEMICIRCLES_TO_DEGREES!r}" lon="{point["lon"] * SEMICIRCLES_TO_DEGREES!r}">\n'
+    ]
+    altitude = point.get('enh_altitude', point.get('altitude'))
+    if altitude is not None:
+        parts.append(f'        <ele>{altitude / 5.0 - 500.0:.1f}</ele>\n') # FIT altitude resolution is 0.2 m
+    if 'timestamp' in point:
+        parts.append(f'        <time>{_gpx_time(point["timestamp"])}</time>\n')
+    extensions = [
+        f'            <ns3:{tag}>{point[tag]}</ns3:{tag}>\n'
+        for tag in ('atemp', 'hr', 'cad') if tag in point
+    ]
+    if extensions:
+        parts.append('        <extensions>\n          <ns3:TrackPointExtension>\n')
+        parts.extend(extensions)
+        parts.append('          </ns3:TrackPointExtension>\n        </extensions>\n')
+    parts.append('      </trkpt>\n')
+    return ''.join(parts)
+
+
+def fit_to_gpx(stream, out, name=None, activity_type=None):
+    """
+    Converts a FIT file into the GPX layout Garmin Connect exports: track
+    points with lat/lon, elevation, time and the heart rate, cadence and
+    temperature TrackPointExtension. Points without a position are left out,
+    as Garmin does. Output is written to the binary file out in chunks.
+    Returns the number of track points written; with none, nothing is written.
+    """
+    written = 0
+    pending = []
+    for point in iter_fit_records(stream):
+        if 'lat' not in point or 'lon' not in point:
+            continue
+        if not written:
+            header = [GPX_HEADER, '  <metadata>\n    <link href="connect.garmin.com">\n'
+                      '      <text>Garmin Connect</text>\n    </link>\n']
+            if 'timestamp' in point:
+                header.append(f'    <time>{_gpx_time(point["timestamp"])}</time>\n')
+            header.append('  </metadata>\n  <trk>\n')
+            if name:
+                header.append(f'    <name>{escape(name)}</name>\n')
+            if activity_type:
+                header.append(f'    <type>{escape(activity_type)}</type>\n')
+            header.append('    <trkseg>\n')
+            pending.append(''.join(header))
+        pending.append(_trackpoint(point))
+        written += 1
+        if len(pending) >= GPX_FLUSH_POINTS:
+            out.write(''.join(pending).encode('utf-8'))
+            pending = []
+
+    if written:
+        pending.append('    </trkseg>\n  </trk>\n</gpx>')
+        out.write(''.join(pending).encode('utf-8'))
+    return written
+
+
+def original_to_gpx(data, out, name=None, activity_type=None):
+    """
+    Converts a Garmin ORIGINAL download (a zip holding the FIT file, or a bare
+    FIT file) into GPX written to out. Returns the number of track points.
+    """
+    if data[:2] != b'PK':
+        return fit_to_gpx(io.BytesIO(data), out, name, activity_type)
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            members = [m for m in archive.namelist() if m.lower().endswith('.fit')]
+            if not members:
+                raise FitError("The download contains no FIT file.")
+            with archive.open(members[0]) as stream:
+                return fit_to_gpx(stream, out, name, activity_type)
+    except zipfile.BadZipFile as e:
+        raise FitError(f"Invalid ORIGINAL download: {e}") from e
@@ -0,0 +1,51 @@
+# ========================================================
+# = gunicorn.conf.py - Production server configuration
+# ========================================================
+# Run with:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+# Every setting can be overridden with the GUNICORN_* environment variables below.
+import os
+
+# --------------------------------------------------------
+# - Serving
+#---------------------------------------------------------
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# Threaded workers: requests mostly wait on the database, Garmin or Dawarich,
+# so threads keep the UI responsive without the memory of extra processes.
+worker_class = 'gthread'
+# One process by default: Quick Check, upload and custom check status live in
+# process memory, and SQLite prefers a single writer process.
+workers = int(os.environ.get('GUNICORN_WORKERS', '1'))
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+# Long work runs in background threads, so requests are short; these bound stuck ones
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+
+# Load the app once in the master: the schema check and imports run a single
+# time and workers start faster. Background services are started after the fork.
+preload_app = True
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-') or None # empty disables the access log
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+
+# --------------------------------------------------------
+# - Hooks
+#---------------------------------------------------------
+def post_fork(server, worker):
+    """
+    Runs in each new worker. Database connections inherited from the master
+    are dropped, and the scheduler, export worker and migrations are started
+    in the one worker that wins the service lock.
+    """
+    from wsgi import app
+    from app import start_background_services_once
+    from models import db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+    start_background_services_once(app)
@@ -1,13 +1,20 @@
 # ========================================================
 # = index.py
 # ========================================================
-from flask import Blueprint, render_template, request, current_app, flash, redirect, url_for, jsonify
+from flask import Blueprint, render_template, request, current_app, flash, redirect, url_for, jsonify, abort, send_from_directory
 import datetime
-from models import DownloadRecord, db, UserSettings
+from models import DownloadRecord, db
+from settings_cache import get_settings, update_settings
+from accounts import get_account
+from storage import record_path
+from reconcile import run_reconcile, is_reconcile_running
+from profiling import recent_profiles, list_profile_files
+from activities import activities_by_id, clear_skip_reasons
 from utils import (
-    download_activities, submit_location_data, run_custom_check,
+    run_quick_check, run_uploads, run_custom_check,
     get_garmin_login_status, garmin_interactive_login,
     garmin_complete_mfa, garmin_logout,
+    get_record_stats, invalidate_record_stats, get_records_page,
 )
 import os
 import time # Added for sleep functionality
@@ -15,83 +22,100 @@ import threading
 
 index_bp = Blueprint('index', __name__)
 
+_task_lock = threading.Lock()
+
+
+def _start_task(name, target, *args):
+    """
+    Runs target(app, task_info, *args) in a background thread, unless the
+    task of that name is still running. Returns True when it was started.
+    """
+    app = current_app._get_current_object()
+    with _task_lock:
+        task_info = app.config['BACKGROUND_TASKS'].setdefault(name, {'thread': None, 'status_message': 'Not running.'})
+        if task_info.get('thread') and task_info['thread'].is_alive():
+            return False
+        thread = threading.Thread(target=target, args=(app, task_info, *args), name=f"task-{name}", daemon=True)
+        task_info.update(thread=thread, status_message='Starting...', started_at=time.time())
+        thread.start()
+    return True
+
+
 @index_bp.route('/custom_check_status')
 def custom_check_status():
-    task_info = current_app.config['CUSTOM_CHECK_TASK']
-    is_running = task_info.get('thread') and task_info['thread'].is_alive()
-    message = task_info.get('status_message', 'N/A')
-    return jsonify(is_running=is_running, message=message)
+    """Status of the running background task (custom check, quick check or upload), else of the latest one."""
+    tasks = [('custom_check', current_app.config['CUSTOM_CHECK_TASK'])]
+    tasks += list(current_app.config['BACKGROUND_TASKS'].items())
+    for name, task_info in tasks:
+        if task_info.get('thread') and task_info['thread'].is_alive():
+            return jsonify(is_running=True, task=name, message=task_info.get('status_message', 'N/A'))
+
+    name, task_info = max(tasks, key=lambda item: item[1].get('started_at', 0))
+    return jsonify(is_running=False, task=name, message=task_info.get('status_message', 'N/A'))
 
 @index_bp.route('/')
 def index():
-    page = request.args.get('page', 1, type=int)
-    pagination = DownloadRecord.query \
-        .order_by(DownloadRecord.id.desc()) \
-        .paginate(page=page, per_page=20)
-    records = pagination.items
-    settings = UserSettings.query.first()
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+    pagination = get_records_page(before=before, after=after, per_page=20)
+    records = pagination['items']
+    settings = get_settings()
 
     task_info = current_app.config['CUSTOM_CHECK_TASK']
     is_custom_check_running = task_info.get('thread') and task_info['thread'].is_alive()
 
-    has_pending_uploads = db.session.query(DownloadRecord.query.filter(
-        (DownloadRecord.dawarich == False) | (DownloadRecord.dawarich == None)
-    ).exists()).scalar()
+    # Counts, skip reasons and the last run come from a cache shared by all page loads
+    record_stats = get_record_stats()
+    pagination['total'] = record_stats['total']
+    has_pending_uploads = record_stats['pending']
 
-    gpx_base_path = current_app.config.get('GPX_FILES_DIR', '/garmin/activities/')
-    for rec in records:
-        gpx_file_path = os.path.join(gpx_base_path, rec.filename)
-        rec.file_exists = os.path.exists(gpx_file_path)
+    accounts = current_app.config['ACCOUNTS']
+    # Names and types of the activities on this page, in one query
+    activities = activities_by_id(rec.activity_id for rec in records)
+    skipped_counts = record_stats['skipped']
+    reconcile_report = current_app.config.get('_RECONCILE_REPORT')
+    rebuild_report = current_app.config.get('_REBUILD_REPORT')
+    last_run = record_stats['last_run']
 
-    return render_template('index.html', records=records, pagination=pagination, settings=settings, is_custom_check_running=is_custom_check_running, has_pending_uploads=has_pending_uploads)
+    return render_template('index.html', records=records, pagination=pagination, settings=settings, is_custom_check_running=is_custom_check_running, has_pending_uploads=has_pending_uploads, accounts=accounts, activities=activities, skipped_counts=skipped_counts, reconcile_report=reconcile_report, rebuild_report=rebuild_report, last_run=last_run)
 
 @index_bp.route('/settings', methods=['POST'])
 def settings():
-    settings = UserSettings.query.first()
-    if not settings:
-        flash("Settings could not be found to update.", "error")
-        return redirect(url_for('index.index'))
-
-    settings.delete_old_gpx = 'delete_old_gpx' in request.form
-    settings.ignore_safe_dawarich_versions = 'ignore_safe_dawarich_versions' in request.form
+    changes = {
+        'delete_old_gpx': 'delete_old_gpx' in request.form,
+        'ignore_safe_dawarich_versions': 'ignore_safe_dawarich_versions' in request.form,
+    }
 
     start_date_str = request.form.get('manual_check_start_date')
     if start_date_str:
-        settings.manual_check_start_date = datetime.datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        changes['manual_check_start_date'] = datetime.datetime.strptime(start_date_str, '%Y-%m-%d').date()
     else:
-        settings.manual_check_start_date = None
+        changes['manual_check_start_date'] = None
 
     end_date_str = request.form.get('manual_check_end_date')
     if end_date_str:
-        settings.manual_check_end_date = datetime.datetime.strptime(end_date_str, '%Y-%m-%d').date()
+        changes['manual_check_end_date'] = datetime.datetime.strptime(end_date_str, '%Y-%m-%d').date()
     else:
-        settings.manual_check_end_date = None
+        changes['manual_check_end_date'] = None
 
     delay_val = request.form.get('manual_check_delay_seconds')
     if delay_val and delay_val.isdigit():
-        settings.manual_check_delay_seconds = int(delay_val)
+        changes['manual_check_delay_seconds'] = int(delay_val)
     else:
-        settings.manual_check_delay_seconds = None
-    
-    db.session.commit()
+        changes['manual_check_delay_seconds'] = None
+
+    update_settings(**changes)
     flash("Settings updated successfully.", "success")
     return redirect(url_for('index.index'))
 
 
 @index_bp.route('/check')
 def check():
-    today     = datetime.datetime.now().date()
-    yesterday = today - datetime.timedelta(days=1)
-    start     = datetime.datetime.combine(yesterday, datetime.time())
-    end       = datetime.datetime.now()
-
-    try:
-        count = download_activities(start, end)
-        current_app.logger.info(f"/check downloaded {count} GPX files")
-        flash(f"Downloaded {count} GPX file{'s' if count!=1 else ''}", "success")
-    except Exception as e:
-        current_app.logger.error(f"/check failed: {e}", exc_info=True)
-        flash(f"Error downloading GPX files: {e}", "error")
+    # Runs in the background, so the request returns at once; progress shows in the status bar
+    if _start_task('check', run_quick_check):
+        flash("Quick check started in the background.", "info")
+    else:
+        flash("A quick check is already running.", "warning")
     # go back to index page and show flash message
     return redirect(url_for('index.index'))
 
@@ -103,7 +127,7 @@ def start_custom_check():
         flash("A custom check is already running.", "warning")
         return redirect(url_for('index.index'))
 
-    settings = UserSettings.query.first()
+    settings = get_settings()
     if not all([settings.manual_check_start_date, settings.manual_check_end_date, settings.manual_check_delay_seconds is not None]):
         flash("Please set a valid start date, end date, and delay for the custom check in Settings.", "error")
         return redirect(url_for('index.index'))
@@ -118,6 +142,7 @@ def start_custom_check():
     
     task_info['thread'] = thread
     task_info['stop_event'] = stop_event
+    task_info['started_at'] = time.time()
     
     thread.start()
     
@@ -146,91 +171,32 @@ def stop_custom_check():
 @index_bp.route('/upload')
 @index_bp.route('/upload/<int:record_id>')
 def upload(record_id=None):
-    # Retrieve GPX_FILES_DIR from config, defaulting if not set
-    gpx_base_path = current_app.config.get('GPX_FILES_DIR', '/garmin/activities/')
-    
-    if record_id:
-        records_to_upload = DownloadRecord.query.filter_by(id=record_id).all()
+    # Uploads pause between files, so they run in the background instead of holding the request
+    if _start_task('upload', run_uploads, record_id):
+        flash("Upload started in the background.", "info")
     else:
-        records_to_upload = DownloadRecord.query.filter(
-            (DownloadRecord.dawarich == False) | (DownloadRecord.dawarich == None)
-        ).order_by(DownloadRecord.id.asc()).all() # Process oldest first
-
-    if not records_to_upload:
-        flash("No new files to upload to Dawarich.", "info")
-        return redirect(url_for('index.index'))
-
-    current_app.logger.info(f"/upload: Found {len(records_to_upload)} file(s) to attempt uploading.")
-    
-    uploaded_count = 0
-    failed_count = 0
-    processed_files_details = [] # To store details for flashing
-
-    for i, record in enumerate(records_to_upload):
-        filename = record.filename
-        gpx_file_path = os.path.join(gpx_base_path, filename) 
-
-        current_app.logger.info(f"/upload: Attempting to upload {filename} (path: {gpx_file_path})")
-
-        if not os.path.exists(gpx_file_path):
-            current_app.logger.error(f"/upload: File {gpx_file_path} not found for record ID {record.id}. Skipping.")
-            processed_files_details.append(f"File {filename} not found (Skipped).")
-            failed_count += 1
-            continue
-
-        try:
-            success = submit_location_data(gpx_file_path)
-            
-            if success:
-                record.dawarich = True
-                db.session.commit()
-                current_app.logger.info(f"/upload: Successfully uploaded {filename} and updated database record ID {record.id}.")
-                processed_files_details.append(f"Successfully uploaded {filename}.")
-                uploaded_count += 1
-            else:
-                current_app.logger.warning(f"/upload: Upload of {filename} reported non-success by submit_location_data.")
-                processed_files_details.append(f"Upload of {filename} reported non-success.")
-                failed_count += 1
-                
-        except Exception as e:
-            db.session.rollback() 
-            current_app.logger.error(f"/upload: Failed to upload {filename}: {e}", exc_info=True)
-            processed_files_details.append(f"Error uploading {filename}: {str(e)[:100]}...") # Keep error message brief for flash
-            failed_count += 1
-        
-        # Delay before processing the next file, if it's not the last one
-        if i < len(records_to_upload) - 1:
-            current_app.logger.info(f"/upload: Waiting 2 seconds before next upload...")
-            time.sleep(2)
-            
-    # Flash a summary message
-    if uploaded_count > 0 and failed_count == 0:
-        flash(f"Successfully uploaded {uploaded_count} file(s).", "success")
-    elif uploaded_count > 0 and failed_count > 0:
-        flash(f"Upload process completed. Successfully uploaded: {uploaded_count}, Failed/Skipped: {failed_count}. Check logs for details.", "warning")
-    elif failed_count > 0 and uploaded_count == 0:
-        flash(f"Upload process failed for all {failed_count} file(s). Check logs for details.", "error")
-    # If processed_files_details is long, consider not flashing all details or logging them instead.
-    # For now, we'll just flash the summary counts.
-
+        flash("An upload is already running.", "warning")
     return redirect(url_for('index.index'))
 
 
 @index_bp.route('/remove_file/<int:record_id>')
 def remove_file(record_id):
     record = DownloadRecord.query.get_or_404(record_id)
-    gpx_base_path = current_app.config.get('GPX_FILES_DIR', '/garmin/activities/')
-    gpx_file_path = os.path.join(gpx_base_path, record.filename)
+    gpx_file_path = record_path(record)
 
     if os.path.exists(gpx_file_path):
         try:
             os.remove(gpx_file_path)
+            record.file_exists = False
+            db.session.commit()
             flash(f"Successfully removed file: {record.filename}", "success")
             current_app.logger.info(f"Removed file {gpx_file_path} for record ID {record.id}")
         except OSError as e:
             flash(f"Error removing file {record.filename}: {e}", "error")
             current_app.logger.error(f"Error removing file {gpx_file_path}: {e}", exc_info=True)
     else:
+        record.file_exists = False
+        db.session.commit()
         flash(f"File not found, could not remove: {record.filename}", "warning")
         current_app.logger.warning(f"File {gpx_file_path} not found for removal for record ID {record.id}")
 
@@ -243,6 +209,7 @@ def remove_record(record_id):
     try:
         db.session.delete(record)
         db.session.commit()
+        invalidate_record_stats()
         flash(f"Successfully removed record ID: {record.id}", "success")
         current_app.logger.info(f"Removed record ID {record.id} from database.")
     except Exception as e:
@@ -253,10 +220,68 @@ def remove_record(record_id):
     return redirect(url_for('index.index'))
 
 
+@index_bp.route('/reevaluate_skipped')
+def reevaluate_skipped():
+    """Forgets why activities were skipped, so the next check downloads and checks them again."""
+    reason = request.args.get('reason') or None
+    try:
+        cleared = clear_skip_reasons(reason=reason, account_name=request.args.get('account') or None)
+        invalidate_record_stats()
+        flash(f"{cleared} skipped activit{'ies' if cleared != 1 else 'y'} will be checked again on the next run over their dates.", "success")
+        current_app.logger.info(f"Cleared the skip reason of {cleared} activities (reason: {reason or 'any'}).")
+    except Exception as e:
+        db.session.rollback()
+        flash(f"Error resetting skipped activities: {e}", "error")
+        current_app.logger.error(f"Error resetting skipped activities: {e}", exc_info=True)
+
+    return redirect(url_for('index.index'))
+
+
+@index_bp.route('/reconcile')
+def reconcile_files():
+    """Starts a background comparison of the records with the files on disk, optionally repairing them."""
+    if is_reconcile_running():
+        flash("A file check is already running.", "warning")
+        return redirect(url_for('index.index'))
+
+    repair = request.args.get('repair') == '1'
+    thread = threading.Thread(target=run_reconcile, args=(current_app._get_current_object(), repair), name='reconcile')
+    thread.start()
+    flash(f"File check{' and repair' if repair else ''} started in the background.", "info")
+    return redirect(url_for('index.index'))
+
+
+@index_bp.route('/profiles')
+def profiles():
+    """Recent profiles with their top hotspots (PROFILING)."""
+    summaries, total = recent_profiles(current_app.config['PROFILE_DIR'])
+    return render_template('profiles.html', profiles=summaries, total=total,
+                           targets=sorted(current_app.config['PROFILE_TARGETS']))
+
+
+@index_bp.route('/profiles/<path:filename>')
+def download_profile(filename):
+    """A raw profile in pstats format, e.g. for snakeviz or python -m pstats."""
+    if filename not in list_profile_files(current_app.config['PROFILE_DIR']):
+        abort(404)
+    return send_from_directory(current_app.config['PROFILE_DIR'], filename, as_attachment=True)
+
+
+def _request_account(name):
+    """Resolves the account a Garmin auth request is for, None if unknown."""
+    try:
+        return get_account(name)
+    except LookupError:
+        return None
+
+
 @index_bp.route('/garmin/status')
 def garmin_status():
     """JSON endpoint: check if Garmin tokens are valid."""
-    result = get_garmin_login_status()
+    account = _request_account(request.args.get('account'))
+    if account is None:
+        return jsonify(status="error", message="Unknown account."), 400
+    result = get_garmin_login_status(account)
     return jsonify(result)
 
 
@@ -273,7 +298,11 @@ def garmin_login():
     if not email or not password:
         return jsonify(status="error", message="Email and password are required."), 400
 
-    result = garmin_interactive_login(email, password)
+    account = _request_account(data.get('account'))
+    if account is None:
+        return jsonify(status="error", message="Unknown account."), 400
+
+    result = garmin_interactive_login(email, password, account)
     return jsonify(result)
 
 
@@ -288,14 +317,22 @@ def garmin_mfa():
     if not mfa_code:
         return jsonify(status="error", message="MFA code is required."), 400
 
-    result = garmin_complete_mfa(mfa_code)
+    account = _request_account(data.get('account'))
+    if account is None:
+        return jsonify(status="error", message="Unknown account."), 400
+
+    result = garmin_complete_mfa(mfa_code, account)
     return jsonify(result)
 
 
 @index_bp.route('/garmin/logout', methods=['POST'])
 def garmin_logout_route():
     """JSON endpoint: remove stored Garmin tokens."""
-    result = garmin_logout()
+    data = request.get_json(silent=True) or {}
+    account = _request_account(data.get('account'))
+    if account is None:
+        return jsonify(status="error", message="Unknown account."), 400
+    result = garmin_logout(account)
     return jsonify(result)
 
 
@@ -2,6 +2,7 @@
 # = models.py - Database schema definition
 # ========================================================
 from datetime import datetime
+import hashlib
 from flask_sqlalchemy import SQLAlchemy
 
 # --------------------------------------------------------
@@ -19,6 +20,16 @@ class DownloadRecord(db.Model):
     download_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     filename      = db.Column(db.String, nullable=False)
     dawarich      = db.Column(db.Boolean, nullable=False, default=False)
+    account       = db.Column(db.String, nullable=False, default='default', index=True)
+    activity_id   = db.Column(db.BigInteger, nullable=True, index=True)
+    relpath       = db.Column(db.String, nullable=True) # below ACTIVITIES_DIR, e.g. 2024/01/2024-01-05_123.gpx; None = flat layout
+    # Stored file state, kept up to date whenever the GPX file is written or removed,
+    # so listing pages never need a filesystem call per row.
+    file_exists   = db.Column(db.Boolean, nullable=False, default=True)
+    file_size     = db.Column(db.BigInteger, nullable=True) # bytes, as of the last write or reconciliation
+    file_mtime    = db.Column(db.DateTime, nullable=True) # UTC
+    updated_at    = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    bundle_id     = db.Column(db.Integer, nullable=True, index=True) # UploadBundle the file was uploaded in; None = uploaded alone
 
 
 # --------------------------------------------------------
@@ -31,4 +42,176 @@ class UserSettings(db.Model):
     manual_check_start_date = db.Column(db.Date, nullable=True)
     manual_check_end_date   = db.Column(db.Date, nullable=True)
     manual_check_delay_seconds = db.Column(db.Integer, nullable=True)
-    ignore_safe_dawarich_versions = db.Column(db.Boolean, nullable=False, default=False)
\ No newline at end of file
+    ignore_safe_dawarich_versions = db.Column(db.Boolean, nullable=False, default=False)
+    # Bumped on every write so cached copies in other processes can detect changes
+    version                 = db.Column(db.Integer, nullable=False, default=1)
+
+
+# --------------------------------------------------------
+# - Activity Metadata Models
+#---------------------------------------------------------
+class Activity(db.Model):
+    """Summary of a Garmin activity, upserted from every activity listing."""
+    __tablename__ = 'activities'
+    activity_id   = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    account       = db.Column(db.String, nullable=False, default='default', index=True)
+    name          = db.Column(db.String, nullable=True)
+    activity_type = db.Column(db.String, nullable=True)
+    start_time    = db.Column(db.DateTime, nullable=True, index=True) # local time of the activity
+    distance      = db.Column(db.Float, nullable=True) # meters
+    duration      = db.Column(db.Float, nullable=True) # seconds
+    has_gps       = db.Column(db.Boolean, nullable=False, default=False)
+    skip_reason   = db.Column(db.String, nullable=True, index=True) # 'no_gps' or 'excluded'; None = download
+    listed_at     = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class ListedDay(db.Model):
+    """A day whose activity listing for an account is stored in the activities table."""
+    __tablename__ = 'listed_days'
+    account   = db.Column(db.String, primary_key=True)
+    day       = db.Column(db.Date, primary_key=True)
+    listed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+# --------------------------------------------------------
+# - Export Queue Model
+#---------------------------------------------------------
+class ExportRecord(db.Model):
+    __tablename__ = 'export_records'
+    id              = db.Column(db.Integer, primary_key=True)
+    record_id       = db.Column(db.Integer, nullable=True, index=True)
+    filename        = db.Column(db.String, nullable=False)
+    sink            = db.Column(db.String, nullable=False)
+    status          = db.Column(db.String, nullable=False, default='pending', index=True) # pending | done | failed
+    attempts        = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error      = db.Column(db.String, nullable=True)
+    method          = db.Column(db.String, nullable=True) # hardlink | reflink | copy_file_range | copy
+    updated_at      = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+# --------------------------------------------------------
+# - Upload Bundle Model
+#---------------------------------------------------------
+class UploadBundle(db.Model):
+    """One Dawarich import holding the tracks of several activities of a day; its records link to it by bundle_id."""
+    __tablename__ = 'upload_bundles'
+    id          = db.Column(db.Integer, primary_key=True)
+    account     = db.Column(db.String, nullable=False, default='default', index=True)
+    day         = db.Column(db.Date, nullable=False, index=True)
+    filename    = db.Column(db.String, nullable=False) # import name, '{date}_{activityId}+{activityId}...gpx'
+    activities  = db.Column(db.Integer, nullable=False)
+    file_size   = db.Column(db.BigInteger, nullable=True) # bytes uploaded
+    uploaded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+# --------------------------------------------------------
+# - Sync Run Model
+#---------------------------------------------------------
+class SyncRun(db.Model):
+    """Summary of one scheduled run: what it did, why it stopped and the backlog it left."""
+    __tablename__ = 'sync_runs'
+    id           = db.Column(db.Integer, primary_key=True)
+    kind         = db.Column(db.String, nullable=False, default='scheduled')
+    started_at   = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    finished_at  = db.Column(db.DateTime, nullable=True) # None while running, or when the run was interrupted
+    upload_order = db.Column(db.String, nullable=True)
+    downloaded   = db.Column(db.Integer, nullable=False, default=0)
+    uploaded     = db.Column(db.Integer, nullable=False, default=0)
+    failed       = db.Column(db.Integer, nullable=False, default=0)
+    remaining    = db.Column(db.Integer, nullable=True) # uploads still pending after the run, carried over
+    stop_reason  = db.Column(db.String, nullable=True) # completed | time_budget | item_budget
+
+
+# --------------------------------------------------------
+# - SQLite Connection Settings
+#---------------------------------------------------------
+def configure_sqlite(engine, journal_mode='WAL', synchronous='NORMAL', busy_timeout_ms=15000):
+    """
+    Applies the PRAGMAs to every new SQLite connection of the engine:
+      - busy_timeout makes a writer wait for the lock held by another thread
+        or process instead of failing at once with "database is locked",
+      - WAL lets requests read while a sync or upload is writing,
+      - synchronous=NORMAL syncs the WAL at checkpoints instead of on every
+        commit; committed data survives a crash of the app, only a power loss
+        can undo the last commits.
+    The journal mode is stored in the database file, so switching it back
+    takes effect on the next start.
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # First, so that changing the journal mode also waits for other connections
+        cursor.execute(f'PRAGMA busy_timeout = {int(busy_timeout_ms)}')
+        cursor.execute(f'PRAGMA journal_mode = {journal_mode}')
+        cursor.execute(f'PRAGMA synchronous = {synchronous}')
+        cursor.close()
+
+
+# --------------------------------------------------------
+# - Schema Upgrades
+#---------------------------------------------------------
+def add_missing_columns():
+    """
+    Adds columns that exist on the models but not yet in the database.
+    db.create_all() only creates missing tables, so columns introduced after a
+    table was first created are added here with ALTER TABLE.
+    Returns a list of (table_name, column_name) tuples that were added.
+    """
+    inspector = db.inspect(db.engine)
+    dialect = db.engine.dialect
+    added = []
+
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {col['name'] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=dialect)}'
+            if column.default is not None and column.default.is_scalar:
+                default = db.literal(column.default.arg, type_=column.type)
+                ddl += f' DEFAULT {default.compile(dialect=dialect, compile_kwargs={"literal_binds": True})}'
+            with db.engine.begin() as conn:
+                conn.execute(db.text(ddl))
+                for index in table.indexes:
+                    if column.name in index.columns:
+                        index.create(bind=conn, checkfirst=True)
+            added.append((table.name, column.name))
+
+    return added
+
+
+def schema_fingerprint():
+    """
+    Returns a positive 31-bit number identifying the tables, columns and
+    indexes defined by the models. It changes whenever the schema does.
+    """
+    parts = []
+    for table in db.metadata.sorted_tables:
+        columns = ','.join(f'{col.name}:{col.type}' for col in table.columns)
+        indexes = ','.join(sorted(idx.name for idx in table.indexes))
+        parts.append(f'{table.name}({columns})[{indexes}]')
+    return int(hashlib.sha1(';'.join(parts).encode()).hexdigest()[:7], 16)
+
+
+def stored_schema_fingerprint():
+    """
+    Returns the fingerprint recorded by the last schema upgrade, or None when
+    unknown. SQLite keeps it in PRAGMA user_version, which costs no table scan;
+    other databases always go through the full schema check.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return None
+    with db.engine.connect() as conn:
+        return conn.execute(db.text('PRAGMA user_version')).scalar()
+
+
+def store_schema_fingerprint(fingerprint):
+    if db.engine.dialect.name != 'sqlite':
+        return
+    with db.engine.begin() as conn:
+        conn.execute(db.text(f'PRAGMA user_version = {int(fingerprint)}'))
@@ -0,0 +1,169 @@
+# ========================================================
+# = pipeline.py - Overlapping download and upload stages
+# ========================================================
+import queue
+import threading
+import time
+import contextlib
+from models import db, DownloadRecord
+from accounts import account_slot
+from consolidate import bundle_key, bundle_size, upload_group
+from profiling import profiled
+
+_DONE = object() # Sentinel telling the upload stage no more records are coming
+
+
+class RunBudget:
+    """
+    Time and item budget of one run, shared by the upload stages of all
+    accounts. take() claims one upload and returns False once the run is out
+    of time or items; everything not uploaded stays pending in the database
+    and is picked up by the next run. A limit of 0 means unlimited.
+    """
+    def __init__(self, max_seconds=0, max_items=0):
+        self.deadline = time.monotonic() + max_seconds if max_seconds else None
+        self.max_items = max_items
+        self.items = 0
+        self.stop_reason = None # 'time_budget' or 'item_budget' once exhausted
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            if self._check() is None:
+                self.items += 1
+            return self.stop_reason is None
+
+    @property
+    def exhausted(self):
+        with self._lock:
+            return self._check() is not None
+
+    def _check(self):
+        if self.stop_reason is None:
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                self.stop_reason = 'time_budget'
+            elif self.max_items and self.items >= self.max_items:
+                self.stop_reason = 'item_budget'
+        return self.stop_reason
+
+
+class UploadPipeline:
+    """
+    Upload stage of a download -> upload pipeline for one account.
+
+    The download loop hands each saved record id to submit(), which places it
+    on a bounded queue. A consumer thread uploads the records in order while
+    the producer keeps downloading, so network I/O of both stages overlaps.
+    When the queue is full submit() blocks, which keeps a fast producer from
+    running far ahead of Dawarich.
+
+    With CONSOLIDATE_DAILY, consecutive records of the same day are collected
+    and uploaded as one bundle once a record of another day arrives, the
+    bundle is full or the input ends.
+
+    With a RunBudget, each upload first claims an item from it; once the
+    budget is exhausted the remaining records are skipped and stay pending.
+    A bundle counts as one upload.
+
+    With take_slot, each upload holds the account's slot (ACCOUNT_CONCURRENCY)
+    while it runs. Pipelines fed by downloads that take the slot day by day
+    (custom check, backfill) need it; one fed from inside the slot, as in
+    sync_account(), must not take it again.
+
+    Use as a context manager; leaving the block waits for the queue to drain.
+    """
+    def __init__(self, app, account, log_prefix, budget=None, take_slot=False):
+        self.app = app
+        self.account = account
+        self.log_prefix = log_prefix
+        self.budget = budget
+        self.take_slot = take_slot
+        self.delay = app.config.get('UPLOAD_DELAY_SECONDS', 5)
+        self.queue = queue.Queue(maxsize=app.config.get('UPLOAD_QUEUE_SIZE', 16))
+        self.thread = threading.Thread(target=self._run, name=f"upload-{account['name']}", daemon=True)
+        self.bundle_size = bundle_size(app.config)
+        self.submitted = set()
+        self.uploads = 0 # imports started, one per record or bundle
+        self.uploaded = 0
+        self.failed = 0
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def submit(self, record_id):
+        """Queues a record for upload. Records already submitted are ignored."""
+        if record_id in self.submitted:
+            return
+        self.submitted.add(record_id)
+        self.queue.put(record_id)
+
+    def close(self):
+        """Signals the end of input and waits until every queued record is processed."""
+        if self.thread.is_alive():
+            self.queue.put(_DONE)
+            self.thread.join()
+
+    def _run(self):
+        try:
+            self._consume()
+        except Exception as e:
+            self.app.logger.error(f"{self.log_prefix}: Upload stage stopped: {e}", exc_info=True)
+            # Keep taking records so submit() never blocks on a full queue; they stay pending
+            while self.queue.get() is not _DONE:
+                pass
+
+    def _consume(self):
+        # The upload stage runs in its own app context, so it has its own database session
+        with self.app.app_context(), profiled(self.app, 'uploads', f"pipeline-{self.account['name']}"):
+            group = [] # consecutive records of one day, uploaded together with CONSOLIDATE_DAILY
+            while True:
+                record_id = self.queue.get()
+                if record_id is _DONE:
+                    break
+                if self.budget is not None and self.budget.exhausted:
+                    continue
+                try:
+                    record = db.session.get(DownloadRecord, record_id)
+                except Exception as e:
+                    db.session.rollback()
+                    self.failed += 1
+                    self.app.logger.error(f"{self.log_prefix}: Upload stage error for record ID {record_id}: {e}", exc_info=True)
+                    continue
+                if record is None or record.dawarich:
+                    continue
+                if group and (len(group) >= self.bundle_size or bundle_key(record) is None
+                              or bundle_key(record) != bundle_key(group[0])):
+                    self._upload(group)
+                    group = []
+                group.append(record)
+                if self.bundle_size == 1:
+                    self._upload(group)
+                    group = []
+            if group:
+                self._upload(group)
+
+    def _upload(self, records):
+        """Uploads one record, or one day's records as a bundle, as a single import of the budget."""
+        if self.budget is not None and not self.budget.take():
+            return
+        if self.uploads and self.delay:
+            self.app.logger.info(f"{self.log_prefix}: Waiting {self.delay} seconds before next upload...")
+            time.sleep(self.delay)
+        self.uploads += 1
+        try:
+            with account_slot(self.app, self.account) if self.take_slot else contextlib.nullcontext():
+                uploaded = upload_group(records, self.log_prefix, self.account)
+        except Exception as e:
+            db.session.rollback()
+            uploaded = 0
+            self.app.logger.error(f"{self.log_prefix}: Upload stage error for record IDs {[r.id for r in records]}: {e}", exc_info=True)
+        self.uploaded += uploaded
+        self.failed += len(records) - uploaded
@@ -0,0 +1,161 @@
+# ========================================================
+# = poller.py - Frequent lightweight checks for new Garmin activities
+# ========================================================
+import time
+import datetime
+import threading
+from models import db, Activity, DownloadRecord
+from accounts import account_slot
+
+POLL_BACKOFF_MAX_SECONDS = 4 * 3600
+RATE_LIMIT_MIN_BACKOFF_SECONDS = 15 * 60
+
+_state_lock = threading.Lock()
+
+# --------------------------------------------------------
+# - Poll State
+#---------------------------------------------------------
+def poll_state(app, account_name):
+    """
+    Per-account poll state, kept in app.config['_POLL_STATE'] of the process
+    running the scheduler. The Garmin client is kept between polls, so a poll
+    costs one small listing request instead of a login.
+    """
+    with _state_lock:
+        states = app.config.setdefault('_POLL_STATE', {})
+        if account_name not in states:
+            states[account_name] = {
+                'client': None,
+                'last_activity_id': None,
+                'last_poll': None,
+                'last_success': None,
+                'last_change': None,
+                'polls': 0,
+                'changes': 0,
+                'backoff_seconds': 0,
+                'backoff_until': None,
+                'last_error': None,
+            }
+        return states[account_name]
+
+
+def public_poll_state(app):
+    """Poll state of every account without the Garmin clients, for the API."""
+    return {
+        name: {
+            key: value.isoformat(timespec='seconds') if isinstance(value, datetime.datetime) else value
+            for key, value in state.items() if key != 'client'
+        }
+        for name, state in app.config.get('_POLL_STATE', {}).items()
+    }
+
+
+def is_rate_limited(error):
+    from garminconnect import GarminConnectTooManyRequestsError
+
+    if isinstance(error, GarminConnectTooManyRequestsError):
+        return True
+    response = getattr(error, 'response', None) or getattr(getattr(error, 'error', None), 'response', None)
+    return getattr(response, 'status_code', None) == 429
+
+
+# --------------------------------------------------------
+# - Polling
+#---------------------------------------------------------
+def is_known_activity(activity_id):
+    """True when the activity was already listed by a sync (downloaded, skipped or filtered)."""
+    if db.session.get(Activity, activity_id) is not None:
+        return True
+    return db.session.query(DownloadRecord.id).filter(DownloadRecord.activity_id == activity_id).first() is not None
+
+
+def latest_activity(state, account):
+    """Returns the summary of the account's most recent activity, or None when it has none."""
+    from utils import init_garmin
+
+    if state['client'] is None:
+        state['client'] = init_garmin(account)
+    activities = state['client'].get_activities(0, 1)
+    return activities[0] if activities else None
+
+
+def poll_account(app, account, interval_seconds):
+    """
+    Checks one account for a new activity and, when there is one, runs the
+    normal download and upload flow from the day before the last successful
+    poll until now. Errors back off exponentially, rate limits for at least
+    RATE_LIMIT_MIN_BACKOFF_SECONDS. Returns the sync result, or None when
+    nothing was synced.
+    """
+    from utils import sync_account
+
+    log_prefix = f"Poll[{account['name']}]"
+    state = poll_state(app, account['name'])
+    now = datetime.datetime.now()
+    if state['backoff_until'] and now < state['backoff_until']:
+        return None
+
+    state['polls'] += 1
+    state['last_poll'] = now
+    try:
+        latest = latest_activity(state, account)
+        activity_id = latest.get('activityId') if latest else None
+        # Each new activity triggers one sync; anything it missed is caught by the nightly run
+        is_new = activity_id is not None and activity_id != state['last_activity_id'] and not is_known_activity(activity_id)
+        result = None
+        if is_new:
+            since = state['last_success'] or now - datetime.timedelta(days=1)
+            start = datetime.datetime.combine(min(since.date(), now.date()) - datetime.timedelta(days=1), datetime.time())
+            app.logger.info(f"{log_prefix}: New activity {activity_id} ({latest.get('startTimeLocal')}), syncing since {start.date()}.")
+            result = sync_account(account, start, now, log_prefix)
+            state['changes'] += 1
+            state['last_change'] = now
+    except Exception as e:
+        db.session.rollback()
+        state['client'] = None # logs in again on the next poll
+        rate_limited = is_rate_limited(e)
+        floor = max(2 * interval_seconds, RATE_LIMIT_MIN_BACKOFF_SECONDS if rate_limited else 0)
+        state['backoff_seconds'] = min(max(floor, 2 * state['backoff_seconds']), POLL_BACKOFF_MAX_SECONDS)
+        state['backoff_until'] = now + datetime.timedelta(seconds=state['backoff_seconds'])
+        state['last_error'] = f"{'Rate limited: ' if rate_limited else ''}{e}"
+        app.logger.warning(f"{log_prefix}: Poll failed ({state['last_error']}), next poll in {state['backoff_seconds']}s or later.")
+        return None
+
+    state['last_activity_id'] = activity_id
+    state['last_success'] = now
+    state['backoff_seconds'] = 0
+    state['backoff_until'] = None
+    state['last_error'] = None
+    return result
+
+
+def poll_for_changes(app):
+    """
+    Scheduler job run every POLL_INTERVAL_MINUTES (with jitter). Accounts that
+    are busy with another sync are skipped until the next poll, so polling
+    never queues up behind the nightly run or a custom check. After a failed
+    rebuild of the download records, the rebuild is retried instead.
+    """
+    from recovery import retry_failed_rebuild
+
+    if not retry_failed_rebuild(app):
+        app.logger.warning("Poll: Download records are not rebuilt yet, skipping this poll.")
+        return
+    interval_seconds = app.config['POLL_INTERVAL_MINUTES'] * 60
+    started = time.monotonic()
+    synced = 0
+    for account in app.config['ACCOUNTS'].values():
+        slot = account_slot(app, account)
+        if not slot.acquire(blocking=False):
+            continue
+        try:
+            with app.app_context():
+                try:
+                    if poll_account(app, account, interval_seconds) is not None:
+                        synced += 1
+                finally:
+                    db.session.remove()
+        finally:
+            slot.release()
+    if synced:
+        app.logger.info(f"Poll: synced {synced} account(s) with new activities in {time.monotonic() - started:.1f}s.")
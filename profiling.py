@@ -0,0 +1,228 @@
+# ========================================================
+# = profiling.py - Opt-in cProfile hooks for requests and background jobs
+# ========================================================
+# Enabled with PROFILING, a comma separated list of targets:
+#   requests      - HTTP requests (optionally only PROFILE_ENDPOINTS)
+#   scheduled     - the nightly scheduled_download_job
+#   custom_check  - run_custom_check
+#   uploads       - the upload loops (upload pipelines and /upload)
+# or 'all'. When PROFILING is empty nothing is registered or wrapped, so
+# profiling costs nothing.
+import os
+import time
+import marshal
+import pstats
+import datetime
+import threading
+import contextlib
+
+PROFILE_TARGETS = ('requests', 'scheduled', 'custom_check', 'uploads')
+HOTSPOT_COUNT = 8
+
+_summaries = {} # filename -> summary; profile files never change once written
+_write_lock = threading.Lock()
+# Held while a profile is recorded. Since Python 3.12 only one profiler can be
+# active per process, so work starting while another is profiled runs unprofiled.
+_active_lock = threading.Lock()
+
+# --------------------------------------------------------
+# - Configuration
+#---------------------------------------------------------
+def parse_targets(raw, logger):
+    """Returns the set of enabled targets from the PROFILING value."""
+    names = {name.strip().lower() for name in (raw or '').split(',') if name.strip()}
+    if 'all' in names:
+        return set(PROFILE_TARGETS)
+    for name in names - set(PROFILE_TARGETS):
+        logger.warning(f"Unknown PROFILING target '{name}' ignored. Known targets: {', '.join(PROFILE_TARGETS)}.")
+    return names & set(PROFILE_TARGETS)
+
+
+def init_profiling(app):
+    """Registers the request hooks when request profiling is enabled."""
+    if 'requests' not in app.config['PROFILE_TARGETS']:
+        return
+    from flask import g, request
+
+    endpoints = app.config['PROFILE_ENDPOINTS']
+
+    @app.before_request
+    def start_request_profile():
+        if endpoints and request.endpoint not in endpoints:
+            return
+        if request.endpoint in ('static', 'index.profiles', 'index.download_profile'):
+            return
+        g.profile = ProfileSession(app, 'requests', request.endpoint or 'unknown')
+        g.profile.start()
+
+    @app.teardown_request
+    def stop_request_profile(exc):
+        session = g.pop('profile', None)
+        if session is not None:
+            session.stop()
+
+    app.logger.info(f"Profiling requests{' to ' + ', '.join(endpoints) if endpoints else ''}.")
+
+
+# --------------------------------------------------------
+# - Profiling
+#---------------------------------------------------------
+class ProfileSession:
+    """
+    cProfile of one unit of work in the current thread. On stop() the
+    profile is written to PROFILE_DIR when the work took at least
+    PROFILE_MIN_SECONDS, and the oldest profiles beyond PROFILE_KEEP are removed.
+    Only one session records at a time; start() leaves the session inactive
+    when another one is running, and the work then simply runs unprofiled.
+    """
+    def __init__(self, app, target, label):
+        import cProfile
+
+        self.app = app
+        self.target = target
+        self.label = label
+        self.profiler = cProfile.Profile()
+        self.started = None
+        self.active = False
+
+    def start(self):
+        if not _active_lock.acquire(blocking=False):
+            return False
+        try:
+            self.profiler.enable()
+        except ValueError as e:
+            # Another profiler (e.g. a debugger or sys.monitoring tool) is active
+            _active_lock.release()
+            self.app.logger.debug(f"Not profiling {self.target} {self.label}: {e}")
+            return False
+        self.active = True
+        self.started = time.perf_counter()
+        return True
+
+    def stop(self):
+        if not self.active:
+            return None
+        self.profiler.disable()
+        self.active = False
+        _active_lock.release()
+        elapsed = time.perf_counter() - self.started
+        if elapsed < self.app.config['PROFILE_MIN_SECONDS']:
+            return None
+        try:
+            return write_profile(self.app.config, self.profiler, self.target, self.label, elapsed)
+        except OSError as e:
+            self.app.logger.warning(f"Could not write {self.target} profile: {e}")
+            return None
+
+
+def profiled(app, target, label):
+    """
+    Context manager profiling the block when target is enabled, and a no-op
+    nullcontext otherwise:
+
+        with profiled(app, 'scheduled', 'scheduled_download_job'):
+            ...
+    """
+    if target not in app.config.get('PROFILE_TARGETS', ()):
+        return contextlib.nullcontext()
+    return _profiled(app, target, label)
+
+
+@contextlib.contextmanager
+def _profiled(app, target, label):
+    session = ProfileSession(app, target, label)
+    session.start()
+    try:
+        yield session
+    finally:
+        session.stop()
+
+
+# --------------------------------------------------------
+# - Profile Files
+#---------------------------------------------------------
+def write_profile(config, profiler, target, label, elapsed):
+    """
+    Writes a profile in pstats format, named
+    '{timestamp}_{target}_{label}_{milliseconds}ms.prof' so a listing needs no
+    parsing, and rotates the directory. Returns the file name.
+    """
+    from storage import AtomicFile
+
+    directory = config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    safe_label = ''.join(c if c.isalnum() or c in '-.' else '-' for c in label)[:60]
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    filename = f"{stamp}_{target}_{safe_label}_{int(elapsed * 1000)}ms.prof"
+
+    profiler.create_stats()
+    with AtomicFile(os.path.join(directory, filename)) as f:
+        f.write(marshal.dumps(profiler.stats))
+
+    with _write_lock:
+        files = list_profile_files(directory)
+        for old in files[config['PROFILE_KEEP']:]:
+            try:
+                os.remove(os.path.join(directory, old))
+            except FileNotFoundError:
+                pass
+            _summaries.pop(old, None)
+    return filename
+
+
+def list_profile_files(directory):
+    """Profile file names, newest first."""
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith('.prof') and not name.startswith('.')]
+    except FileNotFoundError:
+        return []
+    return sorted(names, reverse=True)
+
+
+def summarize_profile(directory, filename):
+    """
+    Returns a dict describing a profile: target, label, recorded time and
+    duration from its name, plus the top functions by own time (hotspots).
+    """
+    summary = _summaries.get(filename)
+    if summary is not None:
+        return summary
+
+    stamp, target, rest = filename[:-len('.prof')].split('_', 2)
+    label, _, duration = rest.rpartition('_')
+    stats = pstats.Stats(os.path.join(directory, filename))
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)
+    summary = {
+        'filename': filename,
+        'target': target,
+        'label': label,
+        'recorded_at': datetime.datetime.strptime(stamp, '%Y%m%d-%H%M%S-%f').strftime('%Y-%m-%d %H:%M:%S'),
+        'duration_ms': int(duration.rstrip('ms') or 0),
+        'total_calls': stats.total_calls,
+        'hotspots': [
+            {
+                'function': pstats.func_std_string(func),
+                'calls': calls,
+                'own_seconds': round(own, 4),
+                'cumulative_seconds': round(cumulative, 4),
+            }
+            for func, (_, calls, own, cumulative, _) in rows[:HOTSPOT_COUNT]
+        ],
+    }
+    _summaries[filename] = summary
+    return summary
+
+
+def recent_profiles(directory, limit=30):
+    """Summaries of the newest profiles and the number on disk; unreadable files carry an error."""
+    files = list_profile_files(directory)
+    for stale in set(_summaries) - set(files):
+        _summaries.pop(stale, None)
+
+    summaries = []
+    for filename in files[:limit]:
+        try:
+            summaries.append(summarize_profile(directory, filename))
+        except (OSError, ValueError, EOFError, TypeError) as e:
+            summaries.append({'filename': filename, 'error': str(e), 'hotspots': []})
+    return summaries, len(files)
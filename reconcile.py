@@ -0,0 +1,219 @@
+# ========================================================
+# = reconcile.py - Reconcile download records with the files on disk
+# ========================================================
+import os
+import re
+import time
+import datetime
+import threading
+from models import db, DownloadRecord
+from storage import activities_dir, needs_layout_migration
+
+RECENT_FILE_GRACE_SECONDS = 600 # newer files may belong to a download that is still being committed
+REPORT_SAMPLE_SIZE = 100 # orphans and missing files listed in a report; counts are always complete
+ACTIVITY_FILE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}_(\d+)\.gpx$')
+
+_reconcile_lock = threading.Lock()
+
+# --------------------------------------------------------
+# - Scanning
+#---------------------------------------------------------
+def scan_activities_dir(root):
+    """
+    Walks the activities directory once with os.scandir and returns
+    {relpath: (size, mtime)} for every GPX file. Temporary files of
+    in-progress writes (hidden names) are ignored.
+    """
+    found = {}
+    pending = [('', root)]
+    while pending:
+        prefix, path = pending.pop()
+        try:
+            entries = os.scandir(path)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                relpath = os.path.join(prefix, entry.name) if prefix else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append((relpath, entry.path))
+                elif entry.name.lower().endswith('.gpx') and entry.is_file():
+                    stat = entry.stat()
+                    found[relpath] = (stat.st_size, stat.st_mtime)
+    return found
+
+
+def _utc(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).replace(tzinfo=None)
+
+
+# --------------------------------------------------------
+# - Reconciliation
+#---------------------------------------------------------
+def reconcile(repair=False):
+    """
+    Diffs the files on disk against download_records in one set-based pass
+    and stores file presence, size and mtime on every record whose state
+    changed. With repair:
+      - orphans that are another name of a record's file (e.g. left over by
+        an interrupted layout migration) are removed,
+      - records whose file is missing get it back when a file of the same
+        name is found elsewhere in the directory,
+      - remaining orphans named '{date}_{activityId}.gpx' are adopted as new
+        records of the only account, or of the first one when there are
+        several, pending upload.
+    Returns a report dict.
+    """
+    from flask import current_app
+    from sqlalchemy import update
+
+    started = time.monotonic()
+    root = activities_dir()
+    on_disk = scan_activities_dir(root)
+
+    rows = db.session.query(
+        DownloadRecord.id, DownloadRecord.filename, DownloadRecord.relpath,
+        DownloadRecord.file_exists, DownloadRecord.file_size, DownloadRecord.file_mtime,
+    ).all()
+
+    referenced = set()
+    missing = []
+    updates = []
+    for record_id, filename, relpath, file_exists, file_size, file_mtime in rows:
+        relpath = relpath or filename
+        referenced.add(relpath)
+        state = on_disk.get(relpath)
+        if state is None:
+            missing.append((record_id, filename))
+            if file_exists:
+                updates.append({'id': record_id, 'file_exists': False})
+            continue
+        size, mtime = state[0], _utc(state[1])
+        if not file_exists or file_size != size or file_mtime != mtime:
+            updates.append({'id': record_id, 'file_exists': True, 'file_size': size, 'file_mtime': mtime})
+
+    recent = time.time() - RECENT_FILE_GRACE_SECONDS
+    orphans = sorted(rel for rel in set(on_disk) - referenced if on_disk[rel][1] < recent)
+    repaired = {'removed_duplicates': 0, 'relinked': 0, 'adopted': 0}
+
+    if repair and needs_layout_migration():
+        # The layout migration links files before committing their new paths; leave them alone until it is done
+        repair = False
+        repaired = None
+    if repair and (orphans or missing):
+        records_by_name = {}
+        for record_id, filename, relpath, *_ in rows:
+            records_by_name.setdefault(filename, []).append((record_id, relpath or filename))
+        missing_ids = {record_id for record_id, _ in missing}
+        remaining = []
+        owner = next(iter(current_app.config['ACCOUNTS']))
+
+        for orphan in orphans:
+            name = os.path.basename(orphan)
+            candidates = records_by_name.get(name, [])
+            orphan_path = os.path.join(root, orphan)
+
+            # Another name for a record's existing file
+            if any(rel in on_disk and os.path.samefile(orphan_path, os.path.join(root, rel))
+                   for _, rel in candidates):
+                os.remove(orphan_path)
+                repaired['removed_duplicates'] += 1
+                continue
+
+            # The file of a record whose own path is missing
+            lost = [record_id for record_id, _ in candidates if record_id in missing_ids]
+            if lost:
+                size, mtime = on_disk[orphan]
+                updates = [u for u in updates if u['id'] != lost[0]]
+                updates.append({'id': lost[0], 'relpath': orphan, 'file_exists': True,
+                                'file_size': size, 'file_mtime': _utc(mtime)})
+                missing_ids.discard(lost[0])
+                repaired['relinked'] += 1
+                continue
+
+            remaining.append(orphan)
+
+        orphans = []
+        for orphan in remaining:
+            match = ACTIVITY_FILE_RE.match(os.path.basename(orphan))
+            if not match or os.path.basename(orphan) in records_by_name:
+                orphans.append(orphan)
+                continue
+            size, mtime = on_disk[orphan]
+            db.session.add(DownloadRecord(
+                filename=os.path.basename(orphan), relpath=orphan, account=owner,
+                activity_id=int(match.group(1)), dawarich=False,
+                file_exists=True, file_size=size, file_mtime=_utc(mtime),
+            ))
+            repaired['adopted'] += 1
+
+        missing = [(record_id, filename) for record_id, filename in missing if record_id in missing_ids]
+
+    for i in range(0, len(updates), 500):
+        db.session.execute(update(DownloadRecord), updates[i:i + 500])
+    db.session.commit()
+
+    report = {
+        'finished_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'duration_seconds': round(time.monotonic() - started, 3),
+        'files_on_disk': len(on_disk),
+        'records': len(rows),
+        'records_updated': len(updates),
+        'missing_count': len(missing),
+        'missing': [{'id': record_id, 'filename': filename} for record_id, filename in missing[:REPORT_SAMPLE_SIZE]],
+        'orphan_count': len(orphans),
+        'orphans': orphans[:REPORT_SAMPLE_SIZE],
+        'repair': repair,
+    }
+    if repaired is None:
+        report['repair_skipped'] = "The storage layout migration is still running."
+    elif repair:
+        report['repaired'] = repaired
+    return report
+
+
+def run_reconcile(app, repair=False):
+    """
+    Runs reconcile() in its own app context and keeps the report in
+    app.config['_RECONCILE_REPORT']. Returns the report, or None when a
+    reconciliation is already running.
+    """
+    from recovery import rebuild_failed
+
+    if not _reconcile_lock.acquire(blocking=False):
+        app.logger.info("Reconciliation already running, skipping.")
+        return None
+    try:
+        with app.app_context():
+            if repair and rebuild_failed(app):
+                # Adopting orphans would fill the empty table before the rebuild marks what Dawarich has
+                app.logger.warning("Reconciliation: download records are not rebuilt yet, checking without repair.")
+                repair = False
+            try:
+                report = reconcile(repair=repair)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Reconciliation failed: {e}", exc_info=True)
+                return None
+            finally:
+                db.session.remove()
+        app.config['_RECONCILE_REPORT'] = report
+        if report['records_updated'] or report.get('repaired', {}).get('adopted'):
+            from utils import invalidate_record_stats
+            with app.app_context():
+                invalidate_record_stats()
+        app.logger.info(
+            f"Reconciliation: {report['files_on_disk']} files, {report['records']} records, "
+            f"{report['records_updated']} updated, {report['missing_count']} missing, "
+            f"{report['orphan_count']} orphans{', repaired: ' + str(report['repaired']) if 'repaired' in report else ''} "
+            f"({report['duration_seconds']}s)."
+        )
+        return report
+    finally:
+        _reconcile_lock.release()
+
+
+def is_reconcile_running():
+    return _reconcile_lock.locked()
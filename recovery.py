@@ -0,0 +1,256 @@
+# ========================================================
+# = recovery.py - Rebuild download records after a database loss
+# ========================================================
+import re
+import time
+import threading
+import datetime
+import contextlib
+from models import db, DownloadRecord
+from reconcile import ACTIVITY_FILE_RE, scan_activities_dir
+from consolidate import bundle_members
+
+IMPORT_LINK_RE = re.compile(r'^/imports/\d+/?$')
+MAX_IMPORT_PAGES = 5000 # safety stop for the paged imports listing
+INSERT_CHUNK_SIZE = 1000
+REBUILD_ATTEMPTS = 5
+REBUILD_RETRY_SECONDS = 60
+
+# --------------------------------------------------------
+# - Sources
+#---------------------------------------------------------
+def dawarich_import_names(account):
+    """
+    Names of all imports of the account's Dawarich user, read from the paged
+    /imports list in one pass. Uploads are named after their GPX file, so
+    these are the files already in Dawarich. Only the import links of each
+    page are parsed. The listing ends at the first page without imports, or
+    one that repeats the previous page exactly (Dawarich past its last page).
+    Raises on any HTTP error or when MAX_IMPORT_PAGES is reached, so a
+    partial listing is never mistaken for the complete one.
+    """
+    from bs4 import BeautifulSoup, SoupStrainer
+    from utils import dawarich_login
+
+    sess = dawarich_login(account, f"Rebuild[{account['name']}]")
+    imports_url = f"{account.get('dawarich_host')}/imports"
+    only_import_links = SoupStrainer('a', href=IMPORT_LINK_RE)
+
+    names = set()
+    previous = None
+    for page in range(1, MAX_IMPORT_PAGES + 1):
+        resp = sess.get(imports_url, params={'page': page}, timeout=60)
+        resp.raise_for_status()
+        soup = BeautifulSoup(resp.text, 'html.parser', parse_only=only_import_links)
+        # Hrefs identify the imports; two imports may share a name
+        page_imports = [(link['href'], link.get_text(strip=True)) for link in soup.find_all('a')]
+        if not page_imports or page_imports == previous:
+            return names
+        names.update(name for _, name in page_imports if name)
+        previous = page_imports
+    raise RuntimeError(f"The Dawarich imports list has more than {MAX_IMPORT_PAGES} pages.")
+
+
+def files_on_disk(root):
+    """Returns {filename: (relpath, size, mtime)} of the activity GPX files below root."""
+    from storage import sharded_relpath
+
+    files = {}
+    for relpath, (size, mtime) in scan_activities_dir(root).items():
+        name = relpath.rsplit('/', 1)[-1]
+        if not ACTIVITY_FILE_RE.match(name):
+            continue
+        # Of two copies of one file, keep the one at its proper place in the layout
+        if name not in files or relpath == sharded_relpath(name):
+            files[name] = (relpath, size, mtime)
+    return files
+
+
+# --------------------------------------------------------
+# - Rebuild
+#---------------------------------------------------------
+def needs_rebuild():
+    """True when download_records is empty, e.g. after the database file was lost or reset."""
+    return db.session.query(DownloadRecord.id).first() is None
+
+
+def rebuild_records(accounts):
+    """
+    Recreates download records from the activity files on disk and the
+    imports already in each account's Dawarich:
+      - a file or import listed in an account's Dawarich becomes a record of
+        that account with dawarich=True, so it is never uploaded again; the
+        activities of a day bundle count as listed, though the records are
+        not linked to a bundle again,
+      - imports whose file is gone (e.g. deleted after upload) still get a
+        record, so the file is not downloaded again,
+      - files in no Dawarich become pending records of the only account, or
+        of the first one when there are several.
+    Only runs on an empty download_records table. Nothing is written when
+    any account's imports cannot be listed. A fresh install, with no files
+    and no imports in any Dawarich, reports 'skipped'. Returns a report dict.
+    """
+    from sqlalchemy import insert
+    from storage import activities_dir, sharded_relpath
+
+    started = time.monotonic()
+    if not needs_rebuild():
+        return {'status': 'skipped', 'message': "Download records exist; nothing to rebuild."}
+
+    files = files_on_disk(activities_dir())
+
+    owner = {}
+    imports = {}
+    for name, account in accounts.items():
+        if not all(account.get(key) for key in ('dawarich_host', 'dawarich_email', 'dawarich_password')):
+            continue
+        try:
+            listed = dawarich_import_names(account)
+        except Exception as e:
+            return {'status': 'error', 'message': f"Could not list the Dawarich imports of account {name}: {e}"}
+        imports[name] = len(listed)
+        for import_name in listed:
+            if ACTIVITY_FILE_RE.match(import_name):
+                owner.setdefault(import_name, name)
+            for member in bundle_members(import_name):
+                owner.setdefault(member, name)
+
+    if not files and not owner:
+        return {'status': 'skipped', 'message': "No activity files and no Dawarich imports found; nothing to rebuild.",
+                'imports_listed': imports}
+
+    fallback = next(iter(accounts))
+    now = datetime.datetime.utcnow()
+    rows = []
+    for filename in sorted(set(files) | set(owner)):
+        relpath, size, mtime = files.get(filename, (sharded_relpath(filename), None, None))
+        mtime = datetime.datetime.fromtimestamp(mtime, datetime.timezone.utc).replace(tzinfo=None) if mtime else None
+        rows.append({
+            'filename': filename,
+            'relpath': relpath,
+            'account': owner.get(filename, fallback),
+            'activity_id': int(ACTIVITY_FILE_RE.match(filename).group(1)),
+            'dawarich': filename in owner,
+            'file_exists': size is not None,
+            'file_size': size,
+            'file_mtime': mtime,
+            'download_time': mtime or now,
+        })
+
+    # Records and their upload state go in together, before any sync can see an empty table
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        db.session.execute(insert(DownloadRecord), rows[i:i + INSERT_CHUNK_SIZE])
+    db.session.commit()
+
+    uploaded = sum(1 for row in rows if row['dawarich'])
+    return {
+        'status': 'success',
+        'message': f"Rebuilt {len(rows)} records: {uploaded} already in Dawarich, {len(rows) - uploaded} pending upload.",
+        'records': len(rows),
+        'uploaded': uploaded,
+        'pending': len(rows) - uploaded,
+        'files_on_disk': len(files),
+        'imports_missing_file': sum(1 for filename in owner if filename not in files),
+        'imports_listed': imports,
+        'duration_seconds': round(time.monotonic() - started, 3),
+    }
+
+
+def run_rebuild(app, ready=None, attempts=REBUILD_ATTEMPTS):
+    """
+    Rebuilds the records while holding every account's sync slot, so no
+    download or upload can start on the still empty table. A failed attempt
+    (e.g. Dawarich unreachable) is retried up to attempts times; after that
+    the slots are released, but syncs keep refusing to run (see
+    check_records_rebuilt()) until a later retry succeeds. ready, if given,
+    is set once the slots are held. Keeps the report in
+    app.config['_REBUILD_REPORT'] and returns it.
+    """
+    from accounts import account_slot
+    from utils import invalidate_record_stats
+
+    accounts = app.config['ACCOUNTS']
+    with contextlib.ExitStack() as stack:
+        try:
+            for account in accounts.values():
+                stack.enter_context(account_slot(app, account))
+        finally:
+            if ready is not None:
+                ready.set()
+        for attempt in range(1, attempts + 1):
+            with app.app_context():
+                try:
+                    report = rebuild_records(accounts)
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Rebuild of download records failed: {e}", exc_info=True)
+                    report = {'status': 'error', 'message': str(e)}
+                if report.get('records'):
+                    invalidate_record_stats()
+            if report['status'] != 'error' or attempt == attempts:
+                break
+            app.logger.warning(f"Rebuild of download records: {report['message']} Retrying in {REBUILD_RETRY_SECONDS}s.")
+            time.sleep(REBUILD_RETRY_SECONDS)
+        # Set before the slots are released, so no sync slips in between
+        app.config['_REBUILD_REPORT'] = report
+
+    log = app.logger.info if report['status'] != 'error' else app.logger.error
+    log(f"Rebuild of download records: {report['message']}")
+    return report
+
+
+def start_rebuild(app):
+    """
+    Starts run_rebuild() in a background thread when download_records is
+    empty. A fresh install is told apart from a lost database by the rebuild
+    itself: with no files and no imports in Dawarich nothing is written.
+    Returns once the thread holds the account slots, so syncs wait for it
+    but startup does not. Returns the thread, or None when records exist.
+    """
+    with app.app_context():
+        if not needs_rebuild():
+            return None
+
+    app.logger.info("No download records found, rebuilding them from Dawarich and the activities directory in the background.")
+    ready = threading.Event()
+    thread = threading.Thread(target=run_rebuild, args=(app, ready), name='rebuild', daemon=True)
+    thread.start()
+    ready.wait()
+    return thread
+
+
+# --------------------------------------------------------
+# - Sync Guard
+#---------------------------------------------------------
+class RebuildPendingError(RuntimeError):
+    """Raised when a sync would run on download records that could not be rebuilt."""
+
+
+def rebuild_failed(app):
+    """True while the last rebuild failed and download_records is still empty. Needs an app context."""
+    report = app.config.get('_REBUILD_REPORT')
+    return bool(report) and report['status'] == 'error' and needs_rebuild()
+
+
+def check_records_rebuilt(app):
+    """
+    Raises RebuildPendingError after a failed rebuild, so no download or
+    upload runs on the empty table and imports everything a second time.
+    """
+    if rebuild_failed(app):
+        raise RebuildPendingError(
+            f"Download records could not be rebuilt ({app.config['_REBUILD_REPORT']['message']}); "
+            "syncs wait until the rebuild succeeds."
+        )
+
+
+def retry_failed_rebuild(app):
+    """
+    Run by the scheduler jobs before they sync: after a failed rebuild,
+    tries it once more. Returns True when syncs may run.
+    """
+    with app.app_context():
+        if not rebuild_failed(app):
+            return True
+    app.logger.info("Retrying the rebuild of download records before syncing.")
+    return run_rebuild(app, attempts=1)['status'] != 'error'
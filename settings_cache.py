@@ -0,0 +1,101 @@
+# ========================================================
+# = settings_cache.py - In-process cache of the UserSettings row
+# ========================================================
+from flask import current_app
+import threading
+import time
+from models import db, UserSettings
+
+SETTINGS_VERSION_CHECK_INTERVAL = 5 # seconds between version checks against the database
+
+_lock = threading.Lock()
+
+# --------------------------------------------------------
+# - Settings Snapshot
+#---------------------------------------------------------
+class SettingsSnapshot:
+    """
+    Read-only copy of the UserSettings row. Unlike the ORM object it is not
+    bound to a database session, so one instance can be shared by all
+    requests and background threads of a process.
+    """
+    __slots__ = tuple(col.name for col in UserSettings.__table__.columns)
+
+    id: int
+    version: int
+    delete_old_gpx: bool
+    manual_check_start_date: object # datetime.date or None
+    manual_check_end_date: object # datetime.date or None
+    manual_check_delay_seconds: object # int or None
+    ignore_safe_dawarich_versions: bool
+
+    def __init__(self, row):
+        for name in self.__slots__:
+            object.__setattr__(self, name, getattr(row, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Settings are read-only; use update_settings() to change them.")
+
+
+# --------------------------------------------------------
+# - Cache Access
+#---------------------------------------------------------
+def _load_snapshot():
+    row = UserSettings.query.first()
+    if row is None:
+        row = UserSettings()
+        db.session.add(row)
+        db.session.commit()
+        current_app.logger.info("Created default user settings.")
+    return SettingsSnapshot(row)
+
+
+def get_settings():
+    """
+    Returns the current settings snapshot.
+    The row is loaded once per process. Afterwards only its version number is
+    read, at most every SETTINGS_VERSION_CHECK_INTERVAL seconds, so changes
+    made by other processes are picked up without a query on every call.
+    """
+    cache = current_app.config.setdefault('_SETTINGS_CACHE', {'snapshot': None, 'checked': 0.0})
+    now = time.monotonic()
+    snapshot = cache['snapshot']
+    if snapshot is not None and now - cache['checked'] < SETTINGS_VERSION_CHECK_INTERVAL:
+        return snapshot
+
+    with _lock:
+        snapshot = cache['snapshot']
+        if snapshot is not None:
+            version = db.session.query(UserSettings.version).filter_by(id=snapshot.id).scalar()
+            if version == snapshot.version:
+                cache['checked'] = now
+                return snapshot
+        snapshot = _load_snapshot()
+        cache.update({'snapshot': snapshot, 'checked': now})
+        return snapshot
+
+
+def update_settings(**changes):
+    """
+    Writes the given settings fields, bumps the version and refreshes this
+    process's cache with the committed values (write-through).
+    Returns the new snapshot.
+    """
+    unknown = set(changes) - set(SettingsSnapshot.__slots__) | ({'id', 'version'} & set(changes))
+    if unknown:
+        raise ValueError(f"Unknown or read-only settings: {', '.join(sorted(unknown))}")
+
+    row = UserSettings.query.first()
+    if row is None:
+        row = UserSettings()
+        db.session.add(row)
+    for name, value in changes.items():
+        setattr(row, name, value)
+    # Incremented in SQL so concurrent writers in different processes never reuse a version
+    row.version = (UserSettings.version + 1) if row.id else 1
+    db.session.commit()
+
+    snapshot = SettingsSnapshot(row)
+    with _lock:
+        current_app.config['_SETTINGS_CACHE'] = {'snapshot': snapshot, 'checked': time.monotonic()}
+    return snapshot
@@ -19,8 +19,11 @@ $(document).ready(function() {
             if (data.is_running) {
                 statusDiv.text('Background Task: ' + data.message);
                 statusContainer.show();
-                startBtn.removeClass('btn-primary').addClass('btn-secondary');
-                stopBtn.removeClass('btn-secondary').addClass('btn-primary');
+                // Quick Check and uploads also report here; only a custom check can be stopped
+                if (data.task === 'custom_check') {
+                    startBtn.removeClass('btn-primary').addClass('btn-secondary');
+                    stopBtn.removeClass('btn-secondary').addClass('btn-primary');
+                }
             } else {
                 // If it was running and now it's not, show the final message and then stop polling.
                 if (pollingInterval) {
@@ -92,6 +95,12 @@ $(document).ready(function() {
         var $mfaForm   = $('#garmin-mfa-form');
         var $msg       = $('#garmin-auth-message');
         var $name      = $('#garmin-display-name');
+        var $account   = $('#garmin-account');
+
+        // Selected account, empty when only one account is configured
+        function currentAccount() {
+            return $account.length ? $account.val() : '';
+        }
 
         function showMsg(text, type) {
             $msg.text(text)
@@ -126,15 +135,25 @@ $(document).ready(function() {
             }
         }
 
-        // Check status on page load
-        $.getJSON(urls.status, function(data) {
-            if (data.logged_in) {
-                showLoggedIn(data.display_name);
-            } else {
+        function checkGarminStatus() {
+            $loggedIn.hide(); $loggedOut.hide(); $mfaForm.hide();
+            $loading.show();
+            $.getJSON(urls.status, { account: currentAccount() }, function(data) {
+                if (data.logged_in) {
+                    showLoggedIn(data.display_name);
+                } else {
+                    showLoggedOut();
+                }
+            }).fail(function() {
                 showLoggedOut();
-            }
-        }).fail(function() {
-            showLoggedOut();
+            });
+        }
+
+        // Check status on page load and whenever another account is selected
+        checkGarminStatus();
+        $account.on('change', function() {
+            hideMsg();
+            checkGarminStatus();
         });
 
         // Login button
@@ -153,7 +172,7 @@ $(document).ready(function() {
                 url: urls.login,
                 method: 'POST',
                 contentType: 'application/json',
-                data: JSON.stringify({ email: email, password: password }),
+                data: JSON.stringify({ email: email, password: password, account: currentAccount() }),
                 success: function(resp) {
                     setButtonLoading($btn, false);
                     if (resp.status === 'success') {
@@ -196,7 +215,7 @@ $(document).ready(function() {
                 url: urls.mfa,
                 method: 'POST',
                 contentType: 'application/json',
-                data: JSON.stringify({ mfa_code: code }),
+                data: JSON.stringify({ mfa_code: code, account: currentAccount() }),
                 success: function(resp) {
                     setButtonLoading($btn, false);
                     if (resp.status === 'success') {
@@ -239,6 +258,7 @@ $(document).ready(function() {
                 url: urls.logout,
                 method: 'POST',
                 contentType: 'application/json',
+                data: JSON.stringify({ account: currentAccount() }),
                 success: function(resp) {
                     setButtonLoading($btn, false);
                     showMsg(resp.message, 'success');
@@ -0,0 +1,239 @@
+# ========================================================
+# = storage.py - Layout and crash-safe storage of downloaded activity files
+# ========================================================
+from flask import current_app
+import os
+import re
+import time
+import errno
+import shutil
+import tempfile
+from models import db, DownloadRecord
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DEFAULT_ACTIVITIES_DIR = '/garmin/activities'
+MIGRATION_BATCH_SIZE = 200
+MIGRATION_PAUSE_SECONDS = 1 # between batches, so the migration never hogs the disk or the database
+SHARDED_FILENAME_RE = re.compile(r'^(\d{4})-(\d{2})-\d{2}_')
+
+# --------------------------------------------------------
+# - Path Resolution
+#---------------------------------------------------------
+def activities_dir():
+    """Root directory of the downloaded activity files (ACTIVITIES_DIR)."""
+    return current_app.config.get('ACTIVITIES_DIR', DEFAULT_ACTIVITIES_DIR)
+
+
+def sharded_relpath(filename):
+    """
+    Returns where a file belongs below the activities directory: YYYY/MM/ from
+    its '{date}_{id}.gpx' name, or the bare name when it carries no date.
+    """
+    match = SHARDED_FILENAME_RE.match(filename)
+    if not match:
+        return filename
+    return os.path.join(match.group(1), match.group(2), filename)
+
+
+def record_relpath(record):
+    """Path of a record's file relative to the activities directory. Records without relpath predate sharding."""
+    return record.relpath or record.filename
+
+
+def record_path(record):
+    """Absolute path of a record's GPX file."""
+    return os.path.join(activities_dir(), record_relpath(record))
+
+
+def new_activity_path(filename):
+    """Returns (relpath, absolute path) for a new download, creating its shard directory."""
+    relpath = sharded_relpath(filename)
+    path = os.path.join(activities_dir(), relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return relpath, path
+
+
+# --------------------------------------------------------
+# - Atomic Writes
+#---------------------------------------------------------
+def fsync_dir(path):
+    """Flushes a directory entry change (e.g. a rename) to disk, where the OS supports it."""
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class AtomicFile:
+    """
+    Writes a file through a temporary file in the same directory, which is
+    fsynced and renamed over the target only when the block exits cleanly.
+    On an exception, or after discard(), the temporary file is removed and
+    the target is left untouched. Readers therefore never see a partial file.
+
+        with AtomicFile(path) as f:
+            for chunk in chunks:
+                f.write(chunk)
+    """
+    def __init__(self, path):
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.file = None
+        self.tmp_path = None
+        self.discarded = False
+
+    def __enter__(self):
+        fd, self.tmp_path = tempfile.mkstemp(
+            prefix=f".{os.path.basename(self.path)}.", suffix='.part', dir=self.directory
+        )
+        self.file = os.fdopen(fd, 'wb')
+        return self
+
+    def write(self, data):
+        self.file.write(data)
+
+    def discard(self):
+        """Drops the written data instead of replacing the target on exit."""
+        self.discarded = True
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None and not self.discarded:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                os.replace(self.tmp_path, self.path)
+                fsync_dir(self.directory)
+                return False
+        finally:
+            if not self.file.closed:
+                self.file.close()
+            if os.path.lexists(self.tmp_path):
+                os.remove(self.tmp_path)
+        return False
+
+
+# --------------------------------------------------------
+# - GPX Validation
+#---------------------------------------------------------
+class TrackpointCounter:
+    """
+    Incremental GPX check fed with the download chunks as they are written.
+    Counts <trkpt> elements with lxml's pull parser, dropping each one once
+    seen, so memory use stays flat for any file size. close() raises
+    lxml.etree.XMLSyntaxError when the document is malformed or truncated.
+    """
+    def __init__(self):
+        from lxml import etree
+
+        self.parser = etree.XMLPullParser(events=('end',), tag='{*}trkpt', huge_tree=True)
+        self.count = 0
+
+    def feed(self, data):
+        self.parser.feed(data)
+        self._drain()
+
+    def close(self):
+        self.parser.close()
+        self._drain()
+        return self.count
+
+    def _drain(self):
+        for _, element in self.parser.read_events():
+            self.count += 1
+            element.clear()
+            # Also drop the already counted siblings from the partial tree
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+
+# --------------------------------------------------------
+# - Layout Migration
+#---------------------------------------------------------
+def _link_into_place(src, dest):
+    """Makes src also available at dest, by hardlink where possible."""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if os.path.lexists(dest):
+        if os.path.samefile(src, dest):
+            return
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        with AtomicFile(dest) as f:
+            with open(src, 'rb') as fsrc:
+                shutil.copyfileobj(fsrc, f.file, 1024 * 1024)
+
+
+def migrate_layout_batch(batch_size=MIGRATION_BATCH_SIZE):
+    """
+    Moves one batch of files from the flat layout into YYYY/MM/ shards.
+    Each file is first linked at its new path, then the batch's relpaths are
+    committed, and only then are the old names removed. A record's path thus
+    resolves to an existing file at every moment, and the app keeps serving
+    and syncing while the migration runs.
+    Returns the number of records migrated.
+    """
+    root = activities_dir()
+    records = DownloadRecord.query.filter(DownloadRecord.relpath == None) \
+        .order_by(DownloadRecord.id.asc()).limit(batch_size).all()
+
+    moved = []
+    for record in records:
+        relpath = sharded_relpath(record.filename)
+        src = os.path.join(root, record.filename)
+        dest = os.path.join(root, relpath)
+        if relpath != record.filename and os.path.exists(src):
+            _link_into_place(src, dest)
+            moved.append(src)
+        record.relpath = relpath
+    db.session.commit()
+
+    for src in moved:
+        try:
+            os.remove(src)
+        except FileNotFoundError:
+            pass
+    if moved:
+        fsync_dir(root)
+    return len(records)
+
+
+def migrate_layout(app):
+    """
+    Background job migrating all records without a relpath to the sharded
+    layout, batch by batch. Safe to interrupt: it resumes where it stopped.
+    """
+    with app.app_context():
+        batch_size = app.config.get('STORAGE_MIGRATION_BATCH', MIGRATION_BATCH_SIZE)
+        total = 0
+        try:
+            while True:
+                migrated = migrate_layout_batch(batch_size)
+                total += migrated
+                if migrated < batch_size:
+                    break
+                app.logger.info(f"Storage migration: {total} records moved to the YYYY/MM layout so far.")
+                time.sleep(MIGRATION_PAUSE_SECONDS)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Storage migration stopped after {total} records: {e}", exc_info=True)
+            return total
+        finally:
+            db.session.remove()
+        if total:
+            app.logger.info(f"Storage migration finished: {total} records moved to the YYYY/MM layout.")
+        return total
+
+
+def needs_layout_migration():
+    """True when some records still use the flat layout."""
+    return db.session.query(DownloadRecord.id).filter(DownloadRecord.relpath == None).first() is not None
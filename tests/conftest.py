@@ -0,0 +1,32 @@
+# ========================================================
+# = tests/conftest.py - Shared fixtures
+# ========================================================
+import os
+import sys
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """An app on a scratch SQLite database and activities directory, without background services."""
+    monkeypatch.setenv('LITEFS_DB_PATH', str(tmp_path / 'test.db'))
+    monkeypatch.setenv('ACTIVITIES_DIR', str(tmp_path / 'activities'))
+    monkeypatch.setenv('ACCOUNTS_FILE', str(tmp_path / 'accounts.json'))
+    monkeypatch.setenv('PROFILE_DIR', str(tmp_path / 'profiles'))
+    monkeypatch.setenv('UPLOAD_DELAY_SECONDS', '0')
+    monkeypatch.setenv('FLASK_DEBUG', '0')
+    for key in ('POSTGRES_USER', 'DAWARICH_HOST', 'DAWARICH_EMAIL', 'DAWARICH_PASSWORD', 'PROFILING', 'CONSOLIDATE_DAILY'):
+        monkeypatch.delenv(key, raising=False)
+
+    from app import create_app
+    from models import db
+
+    app = create_app(start_services=False)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
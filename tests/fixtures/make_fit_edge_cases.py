@@ -0,0 +1,154 @@
+# ========================================================
+# = tests/fixtures/make_fit_edge_cases.py - Hand-encoded FIT file for decoder edge cases
+# ========================================================
+# Writes fit_edge_cases.zip, an ORIGINAL download holding a small FIT file
+# encoded by hand, and fit_edge_cases.gpx, the track points expected from
+# it, written from the same input values in the layout of Garmin's GPX
+# export. This is not Garmin output: it only checks the decoder against
+# the FIT format on cases real files rarely combine (little- and big-endian
+# definitions, altitude and enhanced altitude, compressed timestamp
+# headers, developer fields, invalid values, points without a position).
+# Equivalence with real Garmin exports is checked on the pairs in
+# bench/fixtures/fit.
+#
+# Usage (from the repository root):
+#   python tests/fixtures/make_fit_edge_cases.py
+import datetime
+import io
+import os
+import struct
+import zipfile
+
+FIXTURE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIT_EPOCH = datetime.datetime(1989, 12, 31, tzinfo=datetime.timezone.utc)
+START = datetime.datetime(2024, 1, 5, 8, 0, 0, tzinfo=datetime.timezone.utc)
+DEGREES_TO_SEMICIRCLES = 2 ** 31 / 180.0
+
+# (seconds after START, lat, lon, elevation m, hr, cadence, temperature °C); None = not recorded
+POINTS = [
+    (0, 52.520008, 13.404954, 35.8, 120, 80, 5),
+    (1, 52.520108, 13.405054, 36.0, 122, 81, 5),
+    (3, 52.520208, 13.405154, 36.4, 125, 82, 6), # compressed timestamp header
+    (4, None, None, 36.4, 125, 82, 6), # no position: not in the GPX
+    (6, 52.520408, 13.405354, 37.2, None, 83, 6), # heart rate invalid
+    (8, 52.520508, 13.405454, 1234.6, 131, None, None), # enhanced altitude, big-endian definition
+]
+
+
+def crc16(data, crc=0):
+    """The FIT CRC-16."""
+    table = (0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401,
+             0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400)
+    for byte in data:
+        for nibble in (byte & 0x0F, byte >> 4):
+            tmp = table[crc & 0x0F]
+            crc = (crc >> 4) & 0x0FFF
+            crc = crc ^ tmp ^ table[nibble]
+    return crc
+
+
+def fit_time(seconds):
+    return int((START - FIT_EPOCH).total_seconds()) + seconds
+
+
+def semicircles(degrees):
+    return 0x7FFFFFFF if degrees is None else round(degrees * DEGREES_TO_SEMICIRCLES)
+
+
+def build_fit():
+    messages = bytearray()
+    # file_id (global 0), local 3: type=activity, time_created
+    messages += bytes([0x43, 0, 0]) + struct.pack('<H', 0) + bytes([2, 0, 1, 0x00, 4, 4, 0x86])
+    messages += bytes([0x03, 4]) + struct.pack('<I', fit_time(0))
+    # record (global 20), local 0, little-endian: timestamp, lat, lon, altitude, hr, cad, temperature
+    messages += bytes([0x40, 0, 0]) + struct.pack('<H', 20) + bytes([7, 253, 4, 0x86, 0, 4, 0x85, 1, 4, 0x85,
+                                                                     2, 2, 0x84, 3, 1, 0x02, 4, 1, 0x02, 13, 1, 0x01])
+    # record, local 2, little-endian, for compressed timestamp headers: the same fields without timestamp
+    messages += bytes([0x42, 0, 0]) + struct.pack('<H', 20) + bytes([6, 0, 4, 0x85, 1, 4, 0x85,
+                                                                     2, 2, 0x84, 3, 1, 0x02, 4, 1, 0x02, 13, 1, 0x01])
+
+    def record_fields(point):
+        _, lat, lon, ele, hr, cad, temp = point
+        return struct.pack('<iiHBBb', semicircles(lat), semicircles(lon), round((ele + 500) * 5),
+                           0xFF if hr is None else hr, 0xFF if cad is None else cad, 0x7F if temp is None else temp)
+
+    for point in POINTS[:5]:
+        if point is POINTS[2]:
+            # Compressed timestamp header: local type 2 and the low 5 bits of the timestamp
+            messages += bytes([0x80 | (2 << 5) | (fit_time(point[0]) & 0x1F)]) + record_fields(point)
+        else:
+            messages += bytes([0x00]) + struct.pack('<I', fit_time(point[0])) + record_fields(point)
+
+    # record, local 1, big-endian with one developer field: timestamp, lat, lon, enhanced_altitude, hr
+    messages += bytes([0x61, 0, 1]) + struct.pack('>H', 20) + bytes([5, 253, 4, 0x86, 0, 4, 0x85, 1, 4, 0x85,
+                                                                     78, 4, 0x86, 3, 1, 0x02])
+    messages += bytes([1, 0, 2, 0]) # one developer field of 2 bytes
+    point = POINTS[5]
+    messages += bytes([0x01]) + struct.pack('>IiiIB', fit_time(point[0]), semicircles(point[1]), semicircles(point[2]),
+                                            round((point[3] + 500) * 5), point[4]) + b'\x12\x34'
+
+    header = struct.pack('<BBHI4s', 14, 0x20, 2132, len(messages), b'.FIT')
+    header += struct.pack('<H', crc16(header))
+    body = header + bytes(messages)
+    return body + struct.pack('<H', crc16(body))
+
+
+def float32(value):
+    """value as stored in a 32-bit float, which is how Garmin's GPX export prints elevations."""
+    return struct.unpack('<f', struct.pack('<f', value))[0]
+
+
+def build_gpx():
+    """The expected track points, in the layout of Garmin Connect's "Export to GPX"."""
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<gpx creator="Garmin Connect" version="1.1" xsi:schemaLocation="http://www.topografix.com/GPX/1/1 '
+        'http://www.topografix.com/GPX/11.xsd" xmlns:ns3="http://www.garmin.com/xmlschemas/TrackPointExtension/v1" '
+        'xmlns="http://www.topografix.com/GPX/1/1" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        'xmlns:ns2="http://www.garmin.com/xmlschemas/GpxExtensions/v3">',
+        '  <metadata>',
+        '    <link href="connect.garmin.com">',
+        '      <text>Garmin Connect</text>',
+        '    </link>',
+        f'    <time>{START:%Y-%m-%dT%H:%M:%S}.000Z</time>',
+        '  </metadata>',
+        '  <trk>',
+        '    <name>Edge Cases</name>',
+        '    <type>running</type>',
+        '    <trkseg>',
+    ]
+    for seconds, lat, lon, ele, hr, cad, temp in POINTS:
+        if lat is None:
+            continue
+        moment = START + datetime.timedelta(seconds=seconds)
+        lines += [
+            f'      <trkpt lat="{lat:.15f}" lon="{lon:.15f}">',
+            f'        <ele>{float32(ele)!r}</ele>',
+            f'        <time>{moment:%Y-%m-%dT%H:%M:%S}.000Z</time>',
+            '        <extensions>',
+            '          <ns3:TrackPointExtension>',
+        ]
+        lines += [f'            <ns3:{tag}>{value}</ns3:{tag}>'
+                  for tag, value in (('atemp', temp), ('hr', hr), ('cad', cad)) if value is not None]
+        lines += [
+            '          </ns3:TrackPointExtension>',
+            '        </extensions>',
+            '      </trkpt>',
+        ]
+    lines += ['    </trkseg>', '  </trk>', '</gpx>']
+    return '\n'.join(lines).encode('utf-8')
+
+
+def main():
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        info = zipfile.ZipInfo('12345678901_ACTIVITY.fit', date_time=(2024, 1, 5, 8, 0, 0))
+        zf.writestr(info, build_fit())
+    with open(os.path.join(FIXTURE_DIR, 'fit_edge_cases.zip'), 'wb') as f:
+        f.write(archive.getvalue())
+    with open(os.path.join(FIXTURE_DIR, 'fit_edge_cases.gpx'), 'wb') as f:
+        f.write(build_gpx())
+
+
+if __name__ == '__main__':
+    main()
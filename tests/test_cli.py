@@ -0,0 +1,161 @@
+# ========================================================
+# = tests/test_cli.py - Headless backfill and upload against stubbed Garmin and Dawarich
+# ========================================================
+import os
+import json
+import types
+import datetime
+import pytest
+from click.testing import CliRunner
+import cli
+import utils
+from models import db, DownloadRecord, SyncRun
+
+GPX = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+       '<gpx creator="Garmin Connect" version="1.1" xmlns="http://www.topografix.com/GPX/1/1">'
+       '<trk><trkseg>'
+       '<trkpt lat="52.1" lon="13.1"><time>{day}T08:00:00Z</time></trkpt>'
+       '<trkpt lat="52.2" lon="13.2"><time>{day}T08:00:05Z</time></trkpt>'
+       '</trkseg></trk></gpx>')
+
+
+class FakeGarmin:
+    """One activity with a track per day; listing the days in fail_days raises."""
+    ActivityDownloadFormat = types.SimpleNamespace(GPX='gpx', ORIGINAL='original')
+
+    def __init__(self):
+        self.listed = []
+        self.fail_days = set()
+
+    def get_activities_by_date(self, start, end):
+        self.listed.append(start)
+        if start in self.fail_days:
+            raise ConnectionError(f"Garmin unavailable for {start}")
+        day = datetime.date.fromisoformat(start)
+        return [{
+            'activityId': int(day.strftime('%Y%m%d')),
+            'activityName': f"Run {start}",
+            'activityType': {'typeKey': 'running'},
+            'startTimeLocal': f"{start} 08:00:00",
+            'hasPolyline': True,
+        }]
+
+    def download_activity(self, activity_id, dl_fmt=None):
+        day = datetime.datetime.strptime(str(activity_id), '%Y%m%d').date()
+        return GPX.format(day=day.isoformat()).encode()
+
+
+@pytest.fixture
+def garmin(monkeypatch):
+    client = FakeGarmin()
+    monkeypatch.setattr(utils, 'init_garmin', lambda account=None: client)
+    return client
+
+
+@pytest.fixture
+def dawarich(monkeypatch):
+    """Names of the files a stand-in for Dawarich imported; set ok to False to fail uploads."""
+    imports = types.SimpleNamespace(names=[], ok=True)
+
+    def submit(path, source='gpx', account=None):
+        if imports.ok:
+            imports.names.append(os.path.basename(path))
+        return imports.ok
+    monkeypatch.setattr(utils, 'submit_location_data', submit)
+    return imports
+
+
+@pytest.fixture
+def state_file(tmp_path):
+    return str(tmp_path / 'state' / 'backfill-state.json')
+
+
+def run_cli(*args):
+    result = CliRunner().invoke(cli.cli, list(args))
+    summary = json.loads(result.stdout) if result.stdout.strip() else None
+    return result, summary
+
+
+def test_backfill_downloads_uploads_and_clears_state(app, garmin, dawarich, state_file):
+    result, summary = run_cli('backfill', '2024-01-01', '2024-01-03', '--state-file', state_file, '--quiet')
+
+    assert result.exit_code == 0, result.output
+    assert summary['downloaded'] == 3
+    assert summary['uploaded'] == 3
+    assert summary['stop_reason'] == 'completed'
+    assert summary['resumed_from'] is None
+    assert sorted(dawarich.names) == ['2024-01-01_20240101.gpx', '2024-01-02_20240102.gpx', '2024-01-03_20240103.gpx']
+    assert not os.path.exists(state_file)
+    with app.app_context():
+        assert DownloadRecord.query.filter_by(dawarich=True).count() == 3
+        assert db.session.get(SyncRun, summary['run_id']).stop_reason == 'completed'
+
+
+def test_backfill_resumes_from_state_file(app, garmin, dawarich, state_file):
+    cli.write_state(state_file, {'start': '2024-01-01', 'end': '2024-01-03', 'next_day': '2024-01-03'})
+
+    result, summary = run_cli('backfill', '2024-01-01', '2024-01-03', '--state-file', state_file, '--quiet')
+
+    assert result.exit_code == 0, result.output
+    assert garmin.listed == ['2024-01-03']
+    assert summary['resumed_from'] == '2024-01-03'
+    assert summary['downloaded'] == 1
+    assert not os.path.exists(state_file)
+
+
+def test_backfill_ignores_state_of_another_range(app, garmin, dawarich, state_file):
+    cli.write_state(state_file, {'start': '2023-01-01', 'end': '2023-12-31', 'next_day': '2023-06-01'})
+
+    result, summary = run_cli('backfill', '2024-01-01', '2024-01-02', '--state-file', state_file, '--quiet')
+
+    assert result.exit_code == 0, result.output
+    assert garmin.listed == ['2024-01-01', '2024-01-02']
+    assert summary['resumed_from'] is None
+
+
+def test_backfill_error_keeps_position_for_the_next_run(app, garmin, dawarich, state_file):
+    garmin.fail_days = {'2024-01-02'}
+
+    result, summary = run_cli('backfill', '2024-01-01', '2024-01-03', '--state-file', state_file, '--quiet')
+
+    assert result.exit_code == 1
+    assert summary['stop_reason'] == 'error'
+    assert summary['next_day'] == '2024-01-02'
+    assert cli.read_state(state_file, datetime.date(2024, 1, 1), datetime.date(2024, 1, 3))['next_day'] == '2024-01-02'
+
+    garmin.fail_days = set()
+    garmin.listed = []
+    result, summary = run_cli('backfill', '2024-01-01', '2024-01-03', '--state-file', state_file, '--quiet')
+
+    assert result.exit_code == 0, result.output
+    assert garmin.listed == ['2024-01-02', '2024-01-03']
+    assert summary['resumed_from'] == '2024-01-02'
+    assert not os.path.exists(state_file)
+
+
+def test_upload_exit_status(app, garmin, dawarich, state_file):
+    result, _ = run_cli('backfill', '2024-01-01', '2024-01-02', '--no-upload', '--state-file', state_file, '--quiet')
+    assert result.exit_code == 0, result.output
+
+    dawarich.ok = False
+    result, summary = run_cli('upload', '--quiet')
+    assert result.exit_code == 1
+    assert summary['failed'] == 2
+    assert summary['remaining'] == 2
+
+    dawarich.ok = True
+    result, summary = run_cli('upload', '--quiet')
+    assert result.exit_code == 0, result.output
+    assert summary['uploaded'] == 2
+    assert summary['remaining'] == 0
+
+
+def test_backfill_with_upload_profiling(app, garmin, dawarich, state_file, monkeypatch):
+    monkeypatch.setenv('PROFILING', 'uploads')
+    monkeypatch.setenv('PROFILE_MIN_SECONDS', '0')
+
+    result, summary = run_cli('backfill', '2024-01-01', '2024-01-02', '--state-file', state_file, '--quiet')
+
+    assert result.exit_code == 0, result.output
+    assert summary['uploaded'] == 2
+    assert os.listdir(app.config['PROFILE_DIR'])
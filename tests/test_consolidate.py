@@ -0,0 +1,83 @@
+# ========================================================
+# = tests/test_consolidate.py - Per-day bundles of activity files
+# ========================================================
+import os
+import pytest
+import utils
+from lxml import etree
+from consolidate import group_by_day, upload_group, bundle_members
+from models import db, DownloadRecord, UploadBundle
+from settings_cache import update_settings
+from storage import new_activity_path
+
+GPX = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+       '<gpx creator="Garmin Connect" version="1.1" xmlns="http://www.topografix.com/GPX/1/1">'
+       '<metadata><time>2024-01-05T08:00:00Z</time></metadata>'
+       '<trk><name>{name}</name><trkseg>'
+       '<trkpt lat="52.1" lon="13.1"><ele>30</ele><time>2024-01-05T08:00:00Z</time></trkpt>'
+       '<trkpt lat="52.2" lon="13.2"><ele>31</ele><time>2024-01-05T08:00:05Z</time></trkpt>'
+       '</trkseg></trk></gpx>')
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    """Uploads seen by a stand-in for Dawarich: (import name, track names)."""
+    seen = []
+
+    def submit(path, source='gpx', account=None):
+        tree = etree.parse(path)
+        seen.append((os.path.basename(path), tree.xpath('//*[local-name()="trk"]/*[local-name()="name"]/text()')))
+        return True
+    monkeypatch.setattr(utils, 'submit_location_data', submit)
+    return seen
+
+
+def add_records(day, activity_ids):
+    records = []
+    for activity_id in activity_ids:
+        filename = f"{day}_{activity_id}.gpx"
+        relpath, path = new_activity_path(filename)
+        with open(path, 'w') as f:
+            f.write(GPX.format(name=f"Activity {activity_id}"))
+        records.append(DownloadRecord(filename=filename, relpath=relpath, activity_id=activity_id))
+    db.session.add_all(records)
+    db.session.commit()
+    return records
+
+
+def test_groups_by_account_and_day():
+    class Row:
+        def __init__(self, filename, account='default'):
+            self.filename, self.account = filename, account
+    rows = [Row('2024-01-05_1.gpx'), Row('2024-01-06_2.gpx'), Row('2024-01-05_3.gpx'),
+            Row('2024-01-05_4.gpx', 'bob'), Row('manual.gpx'), Row('2024-01-05_5.gpx')]
+
+    groups = [[row.filename for row in group] for group in group_by_day(rows, 2)]
+
+    assert groups == [['2024-01-05_1.gpx', '2024-01-05_3.gpx'], ['2024-01-06_2.gpx'], ['2024-01-05_4.gpx'],
+                      ['manual.gpx'], ['2024-01-05_5.gpx']]
+
+
+def test_bundle_upload_links_members(app, uploads):
+    with app.app_context():
+        records = add_records('2024-01-05', [11, 12, 13])
+
+        assert upload_group(records, "Test") == 3
+
+        assert uploads == [('2024-01-05_11+12+13.gpx', ['Activity 11', 'Activity 12', 'Activity 13'])]
+        bundle = UploadBundle.query.one()
+        assert (bundle.filename, bundle.activities) == ('2024-01-05_11+12+13.gpx', 3)
+        assert all(record.dawarich and record.bundle_id == bundle.id and record.file_exists for record in records)
+    assert bundle_members(bundle.filename) == ['2024-01-05_11.gpx', '2024-01-05_12.gpx', '2024-01-05_13.gpx']
+
+
+def test_bundle_upload_deletes_member_files(app, uploads):
+    with app.app_context():
+        update_settings(delete_old_gpx=True)
+        records = add_records('2024-01-05', [21, 22])
+
+        assert upload_group(records, "Test") == 2
+
+        for record in records:
+            assert record.file_exists is False
+            assert not os.path.exists(os.path.join(app.config['ACTIVITIES_DIR'], record.relpath))
@@ -0,0 +1,77 @@
+# ========================================================
+# = tests/test_exports.py - Exports of files deleted after upload
+# ========================================================
+import os
+import utils
+from exports import build_sinks, queue_exports, process_pending_exports, drain_pending_exports
+from models import db, DownloadRecord, ExportRecord
+from settings_cache import update_settings
+from storage import new_activity_path
+
+
+def test_delete_after_upload_waits_for_exports(app, tmp_path, monkeypatch):
+    app.config['EXPORT_SINKS'] = [{'type': 'directory', 'name': 'nas', 'path': str(tmp_path / 'nas')}]
+    app.config['EXPORT_SINKS_ACTIVE'] = build_sinks(app.config, app.logger)
+    monkeypatch.setattr(utils, 'submit_location_data', lambda path, source='gpx', account=None: True)
+
+    with app.app_context():
+        update_settings(delete_old_gpx=True)
+        relpath, path = new_activity_path('2024-01-05_123.gpx')
+        with open(path, 'w') as f:
+            f.write('<gpx/>')
+        record = DownloadRecord(filename='2024-01-05_123.gpx', relpath=relpath)
+        db.session.add(record)
+        db.session.flush()
+        queue_exports(record)
+        db.session.commit()
+
+        # Uploaded before the export worker ran: the file is kept for the export
+        assert utils.upload_record(record, "Test")
+        assert os.path.exists(path)
+        assert record.dawarich and record.file_exists
+
+        assert process_pending_exports() == (1, 1)
+        assert ExportRecord.query.one().status == 'done'
+        assert os.path.exists(tmp_path / 'nas' / '2024-01-05_123.gpx')
+        assert not os.path.exists(path)
+        assert db.session.get(DownloadRecord, record.id).file_exists is False
+
+
+def test_delete_after_upload_without_exports(app, monkeypatch):
+    monkeypatch.setattr(utils, 'submit_location_data', lambda path, source='gpx', account=None: True)
+
+    with app.app_context():
+        update_settings(delete_old_gpx=True)
+        relpath, path = new_activity_path('2024-01-06_124.gpx')
+        with open(path, 'w') as f:
+            f.write('<gpx/>')
+        record = DownloadRecord(filename='2024-01-06_124.gpx', relpath=relpath)
+        db.session.add(record)
+        db.session.commit()
+
+        assert utils.upload_record(record, "Test")
+        assert not os.path.exists(path)
+        assert record.file_exists is False
+
+
+def test_drain_continues_past_failed_exports(app, tmp_path):
+    app.config['EXPORT_SINKS'] = [{'type': 'directory', 'name': 'nas', 'path': str(tmp_path / 'nas')}]
+    app.config['EXPORT_SINKS_ACTIVE'] = build_sinks(app.config, app.logger)
+
+    with app.app_context():
+        for activity_id in range(1, 6):
+            filename = f'2024-01-07_{activity_id}.gpx'
+            relpath, path = new_activity_path(filename)
+            # The first file is missing, so its export fails for good
+            if activity_id > 1:
+                with open(path, 'w') as f:
+                    f.write('<gpx/>')
+            record = DownloadRecord(filename=filename, relpath=relpath)
+            db.session.add(record)
+            db.session.flush()
+            queue_exports(record)
+        db.session.commit()
+
+        assert drain_pending_exports(batch_size=2) == 4
+        assert ExportRecord.query.filter_by(status='pending').count() == 0
+        assert ExportRecord.query.filter_by(status='failed').count() == 1
@@ -0,0 +1,42 @@
+# ========================================================
+# = tests/test_filters.py - Activity filter rules
+# ========================================================
+import logging
+from filters import ActivityFilter, compile_rules
+
+
+def activity(**values):
+    act = {'name': 'Run', 'activity_type': 'running', 'duration': 0, 'distance': 0, 'has_gps': True}
+    act.update(values)
+    return act
+
+
+def test_each_threshold_uses_its_own_limit():
+    rules = compile_rules([{'name': 'short', 'duration_below': 300, 'distance_below': 1000}], logging.getLogger(__name__))
+    activity_filter = ActivityFilter(rules)
+
+    assert activity_filter.match(activity(duration=200, distance=500)) == 'short'
+    assert activity_filter.match(activity(duration=900, distance=500)) is None
+    assert activity_filter.match(activity(duration=200, distance=1500)) is None
+
+
+def test_above_and_below_in_one_rule():
+    rules = compile_rules([{'name': 'window', 'duration_above': 60, 'duration_below': 600,
+                            'distance_above': 100, 'distance_below': 5000}], logging.getLogger(__name__))
+    activity_filter = ActivityFilter(rules)
+
+    assert activity_filter.match(activity(duration=300, distance=1000)) == 'window'
+    assert activity_filter.match(activity(duration=30, distance=1000)) is None
+    assert activity_filter.match(activity(duration=300, distance=6000)) is None
+
+
+def test_bare_string_lists_are_rejected(caplog):
+    rules = compile_rules([
+        {'name': 'types', 'types': 'running'},
+        {'name': 'names', 'names': 'Indoor Cycling'},
+        {'name': 'listed', 'types': ['running']},
+    ], logging.getLogger(__name__))
+
+    assert [name for name, _ in rules] == ['listed']
+    assert "'types' must be a list" in caplog.text
+    assert "'names' must be a list" in caplog.text
@@ -0,0 +1,67 @@
+# ========================================================
+# = tests/test_fit_to_gpx.py - FIT to GPX conversion against expected GPX files
+# ========================================================
+import os
+import sys
+import zipfile
+import pytest
+from conftest import REPO_ROOT
+
+sys.path.insert(0, os.path.join(REPO_ROOT, 'bench'))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'bench', 'fixtures'))
+import fit_equivalence  # noqa: E402
+import anonymize_fit_pair  # noqa: E402
+
+EDGE_CASES = (os.path.join(REPO_ROOT, 'tests', 'fixtures', 'fit_edge_cases.zip'),
+              os.path.join(REPO_ROOT, 'tests', 'fixtures', 'fit_edge_cases.gpx'))
+# Anonymized pairs of a Garmin ORIGINAL download and Garmin's own GPX export
+GARMIN_PAIRS = fit_equivalence.fixture_pairs(fit_equivalence.DEFAULT_FIXTURE_DIR)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.skipif(not GARMIN_PAIRS, reason="no Garmin export pair in bench/fixtures/fit "
+                                             "(add one with bench/fixtures/anonymize_fit_pair.py)")
+@pytest.mark.parametrize('zip_path, gpx_path', GARMIN_PAIRS or [(None, None)],
+                         ids=[os.path.basename(z)[:-4] for z, _ in GARMIN_PAIRS] or ['none'])
+def test_conversion_matches_garmin_export(zip_path, gpx_path):
+    summary, problems = fit_equivalence.check_pair(zip_path, gpx_path)
+
+    assert problems == []
+    assert summary['points'] == len(fit_equivalence.read_points(read(gpx_path)))
+
+
+def test_decoder_edge_cases():
+    summary, problems = fit_equivalence.check_pair(*EDGE_CASES)
+
+    assert problems == []
+    assert summary['points'] == 5 # the point without a position is left out
+
+
+def test_differences_are_detected(tmp_path):
+    altered = tmp_path / 'altered.gpx'
+    altered.write_bytes(read(EDGE_CASES[1]).replace(b'<ns3:hr>122</ns3:hr>', b'<ns3:hr>123</ns3:hr>'))
+
+    _, problems = fit_equivalence.check_pair(EDGE_CASES[0], str(altered))
+
+    assert any('hr' in problem for problem in problems)
+
+
+def test_anonymized_pair_stays_equivalent(tmp_path):
+    zip_path, gpx_path = anonymize_fit_pair.anonymize_pair(read(EDGE_CASES[0]), read(EDGE_CASES[1]), 'moved',
+                                                           origin=(10.0, 20.0), dest_dir=str(tmp_path))
+
+    _, problems = fit_equivalence.check_pair(zip_path, gpx_path)
+    assert problems == []
+
+    with zipfile.ZipFile(zip_path) as archive:
+        fit = archive.read('moved_ACTIVITY.fit')
+    assert anonymize_fit_pair.crc16(fit) == 0 # a valid file CRC leaves a remainder of 0
+    points = fit_equivalence.read_points(read(gpx_path))
+    first = points[min(points)]
+    assert abs(first['lat'] - 10.0) < 1e-6 and abs(first['lon'] - 20.0) < 1e-6
+    assert b'Edge Cases' not in read(gpx_path)
+    assert b'<ele>35.79999923706055</ele>' in read(gpx_path)
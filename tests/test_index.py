@@ -0,0 +1,43 @@
+# ========================================================
+# = tests/test_index.py - Index page and its cached counts
+# ========================================================
+import datetime
+from models import db, Activity, DownloadRecord, SyncRun
+from utils import get_record_stats, invalidate_record_stats
+
+
+def test_empty_page_shows_no_cursor(app):
+    response = app.test_client().get('/')
+
+    assert response.status_code == 200
+    assert b'#None' not in response.data
+
+
+def test_page_shows_record_range(app):
+    with app.app_context():
+        db.session.add_all([DownloadRecord(filename=f"2024-01-0{i}_{i}.gpx", file_exists=False) for i in (1, 2)])
+        db.session.commit()
+
+    response = app.test_client().get('/')
+
+    assert b'Records #2&ndash;#1 (2 total)' in response.data
+
+
+def test_skip_counts_and_last_run_are_cached_until_invalidated(app):
+    with app.app_context():
+        assert get_record_stats()['skipped'] == {}
+        assert get_record_stats()['last_run'] is None
+
+        db.session.add(Activity(activity_id=1, skip_reason='no_gps'))
+        db.session.add(SyncRun(kind='scheduled', finished_at=datetime.datetime.utcnow(), uploaded=3))
+        db.session.commit()
+        assert get_record_stats()['skipped'] == {}
+
+        invalidate_record_stats()
+        stats = get_record_stats()
+        assert stats['skipped'] == {'no_gps': 1}
+        assert stats['last_run']['uploaded'] == 3
+
+    response = app.test_client().get('/')
+    assert response.status_code == 200
+    assert b'uploaded 3' in response.data
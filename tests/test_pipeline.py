@@ -0,0 +1,53 @@
+# ========================================================
+# = tests/test_pipeline.py - Upload stage of the download -> upload pipeline
+# ========================================================
+import threading
+import pytest
+import utils
+from accounts import account_slot
+from models import db, DownloadRecord
+from pipeline import UploadPipeline
+from storage import new_activity_path
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    """Names of the files a stand-in for Dawarich received, signalled as they arrive."""
+    seen = []
+    arrived = threading.Event()
+
+    def submit(path, source='gpx', account=None):
+        seen.append(path)
+        arrived.set()
+        return True
+    monkeypatch.setattr(utils, 'submit_location_data', submit)
+    return seen, arrived
+
+
+def add_record(app, filename):
+    with app.app_context():
+        relpath, path = new_activity_path(filename)
+        with open(path, 'w') as f:
+            f.write('<gpx/>')
+        record = DownloadRecord(filename=filename, relpath=relpath)
+        db.session.add(record)
+        db.session.commit()
+        return record.id
+
+
+@pytest.mark.parametrize('take_slot', [True, False])
+def test_upload_waits_for_the_account_slot(app, uploads, take_slot):
+    seen, arrived = uploads
+    account = app.config['ACCOUNTS']['default']
+    record_id = add_record(app, '2024-01-05_123.gpx')
+    slot = account_slot(app, account)
+
+    with slot: # e.g. a download of the same account
+        upload = UploadPipeline(app, account, 'Test', take_slot=take_slot).start()
+        upload.submit(record_id)
+        # Without take_slot the caller's slot covers the upload, so it goes ahead
+        assert arrived.wait(0.5) is not take_slot
+    upload.close()
+
+    assert upload.uploaded == 1
+    assert len(seen) == 1
@@ -0,0 +1,48 @@
+# ========================================================
+# = tests/test_profiling.py - Profiling never breaks the profiled work
+# ========================================================
+import time
+import pipeline
+from models import db, DownloadRecord
+from profiling import ProfileSession, profiled
+
+
+def test_only_one_session_records_at_a_time(app):
+    first = ProfileSession(app, 'uploads', 'first')
+    second = ProfileSession(app, 'uploads', 'second')
+
+    assert first.start() is True
+    assert second.start() is False
+    assert second.stop() is None
+    first.stop()
+    # Released again once the first session stopped
+    assert second.start() is True
+    second.stop()
+
+
+def test_profiled_block_runs_while_another_profile_is_active(app):
+    app.config['PROFILE_TARGETS'] = {'scheduled', 'uploads'}
+    with profiled(app, 'scheduled', 'outer'):
+        with profiled(app, 'uploads', 'inner') as inner:
+            assert inner.active is False
+
+
+def test_failed_upload_stage_keeps_draining_the_queue(app, monkeypatch):
+    def broken(*args):
+        raise ValueError('Another profiling tool is already active')
+    monkeypatch.setattr(pipeline, 'profiled', broken)
+
+    with app.app_context():
+        records = [DownloadRecord(filename=f"2024-01-01_{i}.gpx") for i in range(40)]
+        db.session.add_all(records)
+        db.session.commit()
+        record_ids = [record.id for record in records]
+
+    upload = pipeline.UploadPipeline(app, app.config['ACCOUNTS']['default'], 'Test').start()
+    started = time.monotonic()
+    for record_id in record_ids: # more than the queue holds
+        upload.submit(record_id)
+    upload.close()
+
+    assert time.monotonic() - started < 5
+    assert upload.uploaded == 0
@@ -0,0 +1,35 @@
+# ========================================================
+# = tests/test_reconcile.py - File reconciliation
+# ========================================================
+import os
+import json
+import time
+import pytest
+from models import DownloadRecord
+from reconcile import reconcile
+
+
+@pytest.fixture
+def named_accounts(tmp_path, monkeypatch):
+    accounts_file = tmp_path / 'accounts.json'
+    accounts_file.write_text(json.dumps([{'name': 'alice'}, {'name': 'bob'}]))
+    monkeypatch.setenv('ACCOUNTS_FILE', str(accounts_file))
+
+
+def test_adopted_orphans_belong_to_the_first_account(named_accounts, app):
+    assert list(app.config['ACCOUNTS']) == ['alice', 'bob']
+    path = os.path.join(app.config['ACTIVITIES_DIR'], '2024', '01', '2024-01-05_123.gpx')
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write('<gpx/>')
+    old = time.time() - 3600 # past the grace period for downloads still being committed
+    os.utime(path, (old, old))
+
+    with app.app_context():
+        report = reconcile(repair=True)
+        record = DownloadRecord.query.one()
+
+    assert report['repaired']['adopted'] == 1
+    assert record.account == 'alice'
+    assert record.relpath == '2024/01/2024-01-05_123.gpx'
+    assert not record.dawarich
@@ -0,0 +1,135 @@
+# ========================================================
+# = tests/test_recovery.py - Rebuild of download records after a database loss
+# ========================================================
+import json
+import threading
+import datetime
+import pytest
+import recovery
+import utils
+from accounts import account_slot
+from models import db, DownloadRecord
+
+
+@pytest.fixture
+def dawarich_accounts(tmp_path, monkeypatch):
+    """One account with Dawarich credentials."""
+    path = tmp_path / 'accounts.json'
+    path.write_text(json.dumps([{
+        'name': 'alice', 'dawarich_host': 'http://dawarich', 'dawarich_email': 'a@example.com', 'dawarich_password': 'x',
+    }]))
+    monkeypatch.setenv('ACCOUNTS_FILE', str(path))
+
+
+@pytest.fixture
+def imports(monkeypatch):
+    """Stand-in for the Dawarich import listing; set error to make it fail."""
+    listing = type('Listing', (), {'names': set(), 'error': None, 'calls': 0})()
+
+    def list_names(account):
+        listing.calls += 1
+        if listing.error:
+            raise listing.error
+        return set(listing.names)
+    monkeypatch.setattr(recovery, 'dawarich_import_names', list_names)
+    monkeypatch.setattr(recovery, 'REBUILD_RETRY_SECONDS', 0)
+    return listing
+
+
+class FakePages:
+    """A requests session serving the pages of the /imports list."""
+    def __init__(self, pages):
+        self.pages = pages
+
+    def get(self, url, params=None, timeout=None):
+        page = self.pages[min(params['page'], len(self.pages)) - 1]
+        links = ''.join(f'<a href="/imports/{import_id}">{name}</a>' for import_id, name in page)
+        return type('Response', (), {'text': f'<table>{links}</table>', 'raise_for_status': lambda self: None})()
+
+
+def test_listing_continues_past_a_page_of_known_names(monkeypatch):
+    pages = [
+        [(1, '2024-01-01_1.gpx'), (2, '2024-01-02_2.gpx')],
+        [(3, '2024-01-01_1.gpx'), (4, '2024-01-02_2.gpx')], # re-uploads of the same files
+        [(5, '2024-01-03_3.gpx')],
+    ]
+    monkeypatch.setattr(utils, 'dawarich_login', lambda account, log_prefix=None: FakePages(pages))
+
+    # Past the last page Dawarich shows that page again
+    names = recovery.dawarich_import_names({'name': 'alice', 'dawarich_host': 'http://dawarich'})
+
+    assert names == {'2024-01-01_1.gpx', '2024-01-02_2.gpx', '2024-01-03_3.gpx'}
+
+
+def test_listing_stops_at_an_empty_page(monkeypatch):
+    pages = [[(1, '2024-01-01_1.gpx')], []]
+    monkeypatch.setattr(utils, 'dawarich_login', lambda account, log_prefix=None: FakePages(pages))
+
+    assert recovery.dawarich_import_names({'name': 'alice', 'dawarich_host': 'http://dawarich'}) == {'2024-01-01_1.gpx'}
+
+
+def test_fresh_install_writes_nothing(dawarich_accounts, app, imports):
+    report = recovery.run_rebuild(app)
+
+    assert imports.calls == 1
+    assert report['status'] == 'skipped'
+    with app.app_context():
+        assert recovery.needs_rebuild()
+        recovery.check_records_rebuilt(app)
+
+
+def test_rebuild_without_files_uses_dawarich(dawarich_accounts, app, imports):
+    # e.g. delete_old_gpx removed every file after upload
+    imports.names = {'2024-01-05_123.gpx', '2024-01-06_124.gpx'}
+
+    report = recovery.run_rebuild(app)
+
+    assert report['status'] == 'success'
+    with app.app_context():
+        assert DownloadRecord.query.filter_by(dawarich=True, account='alice').count() == 2
+
+
+def test_rebuild_runs_in_background_holding_the_slots(dawarich_accounts, app, monkeypatch):
+    release = threading.Event()
+
+    def blocked_listing(account):
+        release.wait(5)
+        return set()
+    monkeypatch.setattr(recovery, 'dawarich_import_names', blocked_listing)
+
+    thread = recovery.start_rebuild(app)
+
+    # Startup goes on while the rebuild runs; syncs cannot take an account slot
+    assert thread is not None and thread.is_alive()
+    slot = account_slot(app, app.config['ACCOUNTS']['alice'])
+    assert not slot.acquire(blocking=False)
+
+    release.set()
+    thread.join(5)
+    assert slot.acquire(blocking=False)
+    slot.release()
+    assert app.config['_REBUILD_REPORT']['status'] == 'skipped'
+
+
+def test_failed_rebuild_blocks_syncs_until_a_retry_succeeds(dawarich_accounts, app, imports):
+    imports.error = ConnectionError('Dawarich unreachable')
+
+    assert recovery.run_rebuild(app, attempts=2)['status'] == 'error'
+    assert imports.calls == 2
+
+    account = app.config['ACCOUNTS']['alice']
+    day = datetime.datetime(2024, 1, 5)
+    with app.app_context():
+        with pytest.raises(recovery.RebuildPendingError):
+            utils.sync_account(account, day, day, 'Test')
+        assert utils.download_all_accounts(app, day, day)[1]['alice'].__class__ is recovery.RebuildPendingError
+    assert recovery.retry_failed_rebuild(app) is False
+
+    # The next scheduler tick retries once, and syncs run again after it succeeded
+    imports.error = None
+    imports.names = {'2024-01-05_123.gpx'}
+    assert recovery.retry_failed_rebuild(app) is True
+    assert imports.calls == 4
+    with app.app_context():
+        assert db.session.query(DownloadRecord).count() == 1
+        recovery.check_records_rebuilt(app)
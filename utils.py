@@ -1,20 +1,16 @@
 # ========================================================
 # = utils.py - Utility functions and context processors
 # ========================================================
-from flask import current_app, flash
+from flask import current_app, flash, has_request_context
 import os
 import datetime
 import mimetypes
-import requests
-from bs4 import BeautifulSoup
-from garminconnect import (
-    Garmin,
-    GarminConnectAuthenticationError,
-    GarminConnectConnectionError,
-    GarminConnectTooManyRequestsError,
-)
-from garth.exc import GarthHTTPError
-from models import db, DownloadRecord, UserSettings
+# requests, bs4, garminconnect and garth are imported inside the functions
+# that use them, so importing this module (and starting the app) stays fast.
+from models import db, DownloadRecord
+from settings_cache import get_settings, update_settings
+from exports import queue_exports, notify_export_worker
+from accounts import get_account, account_tokenstore, run_for_accounts
 import hashlib, base64
 import time # Added for sleep functionality
 import shutil
@@ -22,23 +18,39 @@ import shutil
 def run_custom_check(app, stop_event):
     """
     Runs a custom check for activities in a date range, day by day, with a delay.
+    Every account gets an upload pipeline, so files are uploaded while the
+    following days are still being downloaded.
     This function is designed to be run in a background thread.
     """
-    with app.app_context():
+    from pipeline import UploadPipeline
+    from profiling import profiled
+    from recovery import check_records_rebuilt, RebuildPendingError
+
+    with app.app_context(), profiled(app, 'custom_check', 'run_custom_check'):
         task_info = app.config['CUSTOM_CHECK_TASK']
         task_info['status_message'] = "Starting custom check..."
         app.logger.info("Background custom check thread started.")
-        settings = UserSettings.query.first()
-        
+        settings = get_settings()
+
         if not all([settings, settings.manual_check_start_date, settings.manual_check_end_date, settings.manual_check_delay_seconds is not None]):
             app.logger.error("Custom check thread exiting: Invalid settings.")
             task_info['status_message'] = "Custom check failed: Invalid settings."
             return
+        try:
+            check_records_rebuilt(app)
+        except RebuildPendingError as e:
+            app.logger.error(f"Custom check thread exiting: {e}")
+            task_info['status_message'] = f"Custom check failed: {e}"
+            return
 
         current_date = settings.manual_check_start_date
         end_date = settings.manual_check_end_date
         delay = settings.manual_check_delay_seconds
 
+        pipelines = {
+            name: UploadPipeline(app, account, f"Custom check[{name}]", take_slot=True).start()
+            for name, account in app.config['ACCOUNTS'].items()
+        }
         while current_date <= end_date:
             if stop_event.is_set():
                 app.logger.info(f"Custom check stop signal received. Stopping before processing {current_date.isoformat()}.")
@@ -53,12 +65,13 @@ def run_custom_check(app, stop_event):
             end_of_day = datetime.datetime.combine(current_date, datetime.time.max)
 
             try:
-                count = download_activities(start_of_day, end_of_day)
+                count, errors = download_all_accounts(app, start_of_day, end_of_day, pipelines, use_cache=True)
+                if errors:
+                    raise RuntimeError("; ".join(f"{name}: {e}" for name, e in errors.items()))
                 app.logger.info(f"Custom check: Downloaded {count} activities for {current_date.isoformat()}.")
-                
+
                 # Update start date for the next run
-                settings.manual_check_start_date = current_date + datetime.timedelta(days=1)
-                db.session.commit()
+                settings = update_settings(manual_check_start_date=current_date + datetime.timedelta(days=1))
                 app.logger.info(f"Custom check: Updated start date to {settings.manual_check_start_date.isoformat()}.")
 
             except Exception as e:
@@ -78,38 +91,237 @@ def run_custom_check(app, stop_event):
                 app.logger.info(f"Custom check: {wait_msg}")
                 time.sleep(delay)
 
+        task_info['status_message'] = "Finishing uploads..."
+        uploaded = failed = 0
+        for pipeline in pipelines.values():
+            pipeline.close()
+            uploaded += pipeline.uploaded
+            failed += pipeline.failed
+        app.logger.info(f"Custom check: Uploaded {uploaded} file(s), failed/skipped: {failed}.")
+
         if not stop_event.is_set():
-            task_info['status_message'] = "Custom check finished successfully."
+            task_info['status_message'] = f"Custom check finished successfully. Uploaded {uploaded} file(s)."
         app.logger.info("Background custom check thread finished.")
         # Clean up the task info in the app config
         app.config['CUSTOM_CHECK_TASK']['thread'] = None
         app.config['CUSTOM_CHECK_TASK']['stop_event'] = None
 
 
-def check_dawarich_connection(force_check=False):
+def run_quick_check(app, task_info):
+    """
+    Downloads yesterday's and today's activities of every account and uploads
+    them as they arrive. Started from /check in a background thread.
+    """
+    with app.app_context():
+        today = datetime.datetime.now().date()
+        start = datetime.datetime.combine(today - datetime.timedelta(days=1), datetime.time())
+        end   = datetime.datetime.now()
+
+        task_info['status_message'] = "Quick check: downloading and uploading new activities..."
+        totals, errors = sync_all_accounts(app, start, end, "/check")
+        count = totals['downloaded']
+        app.logger.info(f"/check downloaded {count} GPX files, uploaded {totals['uploaded']}")
+
+        message = f"Quick check finished. Downloaded {count} GPX file{'s' if count != 1 else ''}, uploaded {totals['uploaded']}"
+        if totals['failed']:
+            message += f", failed/skipped {totals['failed']}"
+        for name, e in errors.items():
+            app.logger.error(f"/check failed for account {name}: {e}")
+            message += f". Error syncing account {name}: {e}"
+        task_info['status_message'] = message + "."
+
+
+def run_uploads(app, task_info, record_id=None):
+    """
+    Uploads one record, or every record not yet in Dawarich in UPLOAD_ORDER,
+    with CONSOLIDATE_DAILY one import per account and day.
+    Started from /upload in a background thread.
+    """
+    from consolidate import bundle_size, group_by_day, upload_group
+    from profiling import profiled
+
+    with app.app_context(), profiled(app, 'uploads', 'run_uploads'):
+        if record_id:
+            records_to_upload = DownloadRecord.query.filter_by(id=record_id).all()
+        else:
+            records_to_upload = pending_uploads_query().all()
+
+        if not records_to_upload:
+            task_info['status_message'] = "No new files to upload to Dawarich."
+            return
+
+        app.logger.info(f"/upload: Found {len(records_to_upload)} file(s) to attempt uploading.")
+
+        groups = group_by_day(records_to_upload, bundle_size(app.config))
+        uploaded_count = 0
+        failed_count = 0
+        done = 0
+        for i, group in enumerate(groups):
+            done += len(group)
+            names = group[0].filename if len(group) == 1 else f"{len(group)} activities of {group[0].filename[:10]}"
+            task_info['status_message'] = f"Uploading {done} of {len(records_to_upload)}: {names}"
+            uploaded = upload_group(group, "/upload")
+            uploaded_count += uploaded
+            failed_count += len(group) - uploaded
+
+            # Delay before processing the next file, if it's not the last one
+            if i < len(groups) - 1:
+                app.logger.info("/upload: Waiting 2 seconds before next upload...")
+                time.sleep(2)
+
+        if failed_count == 0:
+            task_info['status_message'] = f"Successfully uploaded {uploaded_count} file(s)."
+        elif uploaded_count > 0:
+            task_info['status_message'] = f"Upload process completed. Successfully uploaded: {uploaded_count}, Failed/Skipped: {failed_count}. Check logs for details."
+        else:
+            task_info['status_message'] = f"Upload process failed for all {failed_count} file(s). Check logs for details."
+
+
+RECORD_STATS_TTL = 60 # seconds; bounds staleness when another process changes records
+
+
+def get_record_stats():
+    """
+    Returns the counts the index page shows: {'total': int, 'pending': bool,
+    'skipped': {skip_reason: count}, 'last_run': dict of the latest scheduled
+    SyncRun's columns or None}.
+    The result is cached in app.config and refreshed after RECORD_STATS_TTL
+    seconds, or sooner when invalidate_record_stats() is called after a write.
+    """
+    from activities import skip_reason_counts
+    from models import SyncRun
+
+    stats_cache = current_app.config.setdefault('_RECORD_STATS', {
+        'total': 0, 'pending': False, 'skipped': {}, 'last_run': None, 'timestamp': None,
+    })
+    if stats_cache['timestamp'] and (time.time() - stats_cache['timestamp']) < RECORD_STATS_TTL:
+        return stats_cache
+
+    total = db.session.query(db.func.count(DownloadRecord.id)).scalar()
+    pending = db.session.query(DownloadRecord.query.filter(
+        (DownloadRecord.dawarich == False) | (DownloadRecord.dawarich == None)
+    ).exists()).scalar()
+    last_run = SyncRun.query.filter_by(kind='scheduled').order_by(SyncRun.id.desc()).first()
+    stats_cache.update({
+        'total': total,
+        'pending': pending,
+        'skipped': skip_reason_counts(),
+        # Plain values, so the cache never holds an instance bound to a finished session
+        'last_run': {column.name: getattr(last_run, column.name) for column in SyncRun.__table__.columns} if last_run else None,
+        'timestamp': time.time(),
+    })
+    return stats_cache
+
+
+def invalidate_record_stats():
+    """Drops the cached record stats, skip counts and last run so the next read recounts."""
+    stats_cache = current_app.config.get('_RECORD_STATS')
+    if stats_cache:
+        stats_cache['timestamp'] = None
+
+
+def get_records_page(query=None, before=None, after=None, per_page=20):
+    """
+    Keyset (id cursor) pagination over download records, newest first.
+    'before' returns the page of records older than that id, 'after' the page
+    of records newer than that id. Each page costs one indexed range scan
+    regardless of how deep it is, unlike OFFSET-based pagination.
+    Returns a dict with the records and the cursors for the neighbouring pages.
+    """
+    if query is None:
+        query = DownloadRecord.query
+
+    if after is not None:
+        rows = query.filter(DownloadRecord.id > after) \
+            .order_by(DownloadRecord.id.asc()) \
+            .limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        records = list(reversed(rows[:per_page]))
+        has_next = bool(records) and db.session.query(
+            query.filter(DownloadRecord.id < records[-1].id).exists()
+        ).scalar()
+    else:
+        if before is not None:
+            query_page = query.filter(DownloadRecord.id < before)
+        else:
+            query_page = query
+        rows = query_page.order_by(DownloadRecord.id.desc()).limit(per_page + 1).all()
+        has_next = len(rows) > per_page
+        records = rows[:per_page]
+        has_prev = bool(records) and before is not None and db.session.query(
+            query.filter(DownloadRecord.id > records[0].id).exists()
+        ).scalar()
+
+    return {
+        'items': records,
+        'has_prev': has_prev,
+        'has_next': has_next,
+        'prev_cursor': records[0].id if records else None,
+        'next_cursor': records[-1].id if records else None,
+    }
+
+
+def backfill_file_exists(gpx_base_path):
+    """
+    Fills DownloadRecord.file_exists from a single directory listing.
+    Used once when the column is added to an existing database.
+    """
+    try:
+        on_disk = set(os.listdir(gpx_base_path))
+    except FileNotFoundError:
+        on_disk = set()
+
+    missing_ids = [
+        rec_id for rec_id, filename in db.session.query(DownloadRecord.id, DownloadRecord.filename)
+        if filename not in on_disk
+    ]
+    for i in range(0, len(missing_ids), 500):
+        DownloadRecord.query.filter(DownloadRecord.id.in_(missing_ids[i:i + 500])) \
+            .update({DownloadRecord.file_exists: False}, synchronize_session=False)
+    db.session.commit()
+    return len(missing_ids)
+
+
+def _flash_error(msg):
+    """Flashes an error when called from a request; background jobs only log."""
+    if has_request_context():
+        flash(msg, 'error')
+
+
+def check_dawarich_connection(force_check=False, account=None):
     """
-    Checks connection and login to Dawarich. Caches the result for 2 minutes.
+    Checks connection and login to Dawarich for an account (the first
+    account by default). Caches the result per account for 2 minutes.
     Flashes an error message on failure.
     """
-    status_cache = current_app.config['_DAWARICH_CONNECTION_STATUS']
+    if account is None:
+        account = get_account()
+    status_cache = current_app.config['_DAWARICH_CONNECTION_STATUS'].setdefault(
+        account['name'], {'status': None, 'timestamp': None, 'message': '', 'version': None}
+    )
     # Use cached status if available and not forced, and younger than 2 minutes
     if not force_check and status_cache.get('timestamp'):
         if (time.time() - status_cache['timestamp']) < 120: # 2 minutes
             if not status_cache['status']:
-                flash(status_cache['message'], 'error')
+                _flash_error(status_cache['message'])
             return status_cache['status']
 
-    host = current_app.config.get('DAWARICH_HOST')
-    user = current_app.config.get('DAWARICH_EMAIL')
-    pwd = current_app.config.get('DAWARICH_PASSWORD')
+    host = account.get('dawarich_host')
+    user = account.get('dawarich_email')
+    pwd = account.get('dawarich_password')
+    # Name the account in messages once there is more than one
+    label = f"[{account['name']}] " if len(current_app.config['ACCOUNTS']) > 1 else ''
 
     if not all([host, user, pwd]):
-        msg = "Dawarich connection failed: Host, email, or password not configured."
+        msg = f"{label}Dawarich connection failed: Host, email, or password not configured."
         current_app.logger.error(msg)
-        flash(msg, 'error')
+        _flash_error(msg)
         status_cache.update({'status': False, 'timestamp': time.time(), 'message': msg, 'version': None})
         return False
 
+    import requests
+    from bs4 import BeautifulSoup
+
     login_url = f'{host}/users/sign_in'
     sess = requests.Session()
 
@@ -142,136 +354,283 @@ def check_dawarich_connection(force_check=False):
             if version_span:
                 dawarich_version = version_span.text.strip().rstrip(' !').strip()
 
-        settings = UserSettings.query.first()
+        settings = get_settings()
         if settings and settings.ignore_safe_dawarich_versions:
             current_app.logger.warning("Dawarich safe version check is being ignored by user setting.")
         else:
             safe_versions = current_app.config.get('SAFE_VERSIONS', [])
             if not dawarich_version:
-                msg = "Could not determine Dawarich version. Aborting as a precaution."
+                msg = f"{label}Could not determine Dawarich version. Aborting as a precaution."
                 current_app.logger.error(msg)
-                flash(msg, 'error')
+                _flash_error(msg)
                 status_cache.update({'status': False, 'timestamp': time.time(), 'message': msg, 'version': None})
                 return False
 
             if dawarich_version not in safe_versions:
-                msg = f"Dawarich version {dawarich_version} is not in the list of safe versions: {safe_versions}"
+                msg = f"{label}Dawarich version {dawarich_version} is not in the list of safe versions: {safe_versions}"
                 current_app.logger.error(msg)
-                flash(msg, 'error')
+                _flash_error(msg)
                 status_cache.update({'status': False, 'timestamp': time.time(), 'message': msg, 'version': dawarich_version})
                 return False
 
-        current_app.logger.info(f"Dawarich connection check successful. Version: {dawarich_version}")
+        current_app.logger.info(f"{label}Dawarich connection check successful. Version: {dawarich_version}")
         status_cache.update({'status': True, 'timestamp': time.time(), 'message': '', 'version': dawarich_version})
         return True
 
     except requests.exceptions.RequestException as e:
-        msg = f"Dawarich connection failed: Network error - {e}"
+        msg = f"{label}Dawarich connection failed: Network error - {e}"
         current_app.logger.error(msg)
-        flash(msg, 'error')
+        _flash_error(msg)
         status_cache.update({'status': False, 'timestamp': time.time(), 'message': msg, 'version': None})
         return False
     except ValueError as e:
-        msg = f"Dawarich connection failed: {e}"
+        msg = f"{label}Dawarich connection failed: {e}"
         current_app.logger.error(msg)
-        flash(msg, 'error')
+        _flash_error(msg)
         status_cache.update({'status': False, 'timestamp': time.time(), 'message': msg, 'version': None})
         return False
     except Exception as e:
-        msg = f"Dawarich connection failed: An unexpected error occurred - {e}"
+        msg = f"{label}Dawarich connection failed: An unexpected error occurred - {e}"
         current_app.logger.error(msg, exc_info=True)
-        flash(msg, 'error')
+        _flash_error(msg)
         status_cache.update({'status': False, 'timestamp': time.time(), 'message': msg, 'version': None})
         return False
 
+UPLOAD_ORDERS = ('oldest', 'newest', 'smallest')
+
+
+def pending_uploads_query(account_name=None):
+    """
+    Records not yet uploaded to Dawarich, in UPLOAD_ORDER: 'oldest' or
+    'newest' activity date first (from the '{date}_{id}.gpx' filename), or
+    'smallest' file first, with files of unknown size last.
+    """
+    query = DownloadRecord.query.filter((DownloadRecord.dawarich == False) | (DownloadRecord.dawarich == None))
+    if account_name:
+        query = query.filter(DownloadRecord.account == account_name)
+
+    order = current_app.config.get('UPLOAD_ORDER', 'oldest')
+    if order == 'newest':
+        return query.order_by(DownloadRecord.filename.desc(), DownloadRecord.id.desc())
+    if order == 'smallest':
+        return query.order_by(DownloadRecord.file_size.is_(None), DownloadRecord.file_size.asc(), DownloadRecord.id.asc())
+    return query.order_by(DownloadRecord.filename.asc(), DownloadRecord.id.asc())
+
+
 def scheduled_download_job(app_instance):
-    """Job to be run by the scheduler. Downloads activities from yesterday and then uploads them."""
+    """
+    Job to be run by the scheduler. Syncs every account in parallel within
+    one shared budget of SCHEDULE_MAX_SECONDS and SCHEDULE_MAX_ITEMS uploads;
+    whatever is left stays pending for the next run. Every run is summarized
+    in a SyncRun row.
+    """
+    from models import SyncRun
+    from pipeline import RunBudget
+    from profiling import profiled
+    from recovery import retry_failed_rebuild
+
+    if not retry_failed_rebuild(app_instance):
+        app_instance.logger.error("Scheduler: Download records are not rebuilt yet, skipping the scheduled run.")
+        return
+
+    config = app_instance.config
+    budget = RunBudget(config.get('SCHEDULE_MAX_SECONDS', 0), config.get('SCHEDULE_MAX_ITEMS', 0))
     with app_instance.app_context():
-        # --- Download Phase ---
+        run = SyncRun(kind='scheduled', upload_order=config.get('UPLOAD_ORDER', 'oldest'))
+        db.session.add(run)
+        db.session.commit()
+        invalidate_record_stats()
+        run_id = run.id
+
+    app_instance.logger.info("Scheduler: Starting scheduled download job.")
+    started = time.monotonic()
+    with profiled(app_instance, 'scheduled', 'scheduled_download_job'):
+        results = run_for_accounts(app_instance, scheduled_sync_account, budget)
+    elapsed = time.monotonic() - started
+
+    totals = {'downloaded': 0, 'uploaded': 0, 'failed': 0}
+    for result in results.values():
+        if not isinstance(result, Exception):
+            for key in totals:
+                totals[key] += result[key]
+
+    with app_instance.app_context():
+        run = db.session.get(SyncRun, run_id)
+        run.finished_at = datetime.datetime.utcnow()
+        run.downloaded = totals['downloaded']
+        run.uploaded = totals['uploaded']
+        run.failed = totals['failed']
+        run.remaining = pending_uploads_query().count()
+        run.stop_reason = budget.stop_reason or 'completed'
+        db.session.commit()
+        invalidate_record_stats()
+        remaining, stop_reason = run.remaining, run.stop_reason
+
+    per_minute = totals['uploaded'] / (elapsed / 60) if elapsed else 0
+    app_instance.logger.info(
+        f"Scheduler: Scheduled job finished for all accounts ({stop_reason}) in {elapsed:.0f}s. "
+        f"Downloaded: {totals['downloaded']}, uploaded: {totals['uploaded']} ({per_minute:.1f}/min), "
+        f"failed/skipped: {totals['failed']}, still pending: {remaining}."
+    )
+
+
+def scheduled_sync_account(account, budget=None):
+    """
+    Downloads activities from yesterday for one account and uploads them as
+    they arrive, then uploads any files still pending from earlier runs,
+    within the run's budget.
+    """
+    log_prefix = f"Scheduler[{account['name']}]"
+    today     = datetime.datetime.now().date()
+    yesterday = today - datetime.timedelta(days=1)
+    start     = datetime.datetime.combine(yesterday, datetime.time())
+    end       = datetime.datetime.combine(yesterday, datetime.time.max)
+
+    current_app.logger.info(f"{log_prefix}: Starting scheduled sync.")
+    result = sync_account(account, start, end, log_prefix, budget)
+    current_app.logger.info(
+        f"{log_prefix}: Sync finished. Downloaded: {result['downloaded']}, "
+        f"uploaded: {result['uploaded']}, failed/skipped: {result['failed']}, "
+        f"still pending: {result['remaining']}."
+    )
+    return result
+
+
+def sync_account(account, startdate, enddate, log_prefix, budget=None):
+    """
+    Downloads an account's activities in a date range and uploads each file
+    as soon as it is saved, through an UploadPipeline. Files left pending by
+    earlier runs are queued after the new downloads, in UPLOAD_ORDER, until
+    the optional RunBudget is exhausted.
+    Returns a dict with the downloaded, uploaded and failed counts, and the
+    uploads still pending afterwards. Raises RebuildPendingError while the
+    download records could not be rebuilt after a database loss.
+    """
+    from pipeline import UploadPipeline
+    from recovery import check_records_rebuilt
+
+    check_records_rebuilt(current_app)
+    downloaded = 0
+    with UploadPipeline(current_app._get_current_object(), account, log_prefix, budget) as pipeline:
         try:
-            app_instance.logger.info("Scheduler: Starting scheduled download job.")
-            today     = datetime.datetime.now().date()
-            yesterday = today - datetime.timedelta(days=1)
-            start     = datetime.datetime.combine(yesterday, datetime.time())
-            end       = datetime.datetime.combine(yesterday, datetime.time.max)
-
-            download_count = download_activities(start, end) # download_activities is already in this file
-            app_instance.logger.info(f"Scheduler: Downloaded {download_count} GPX files.")
+            downloaded = download_activities(startdate, enddate, account, on_saved=pipeline.submit)
+            current_app.logger.info(f"{log_prefix}: Downloaded {downloaded} GPX files.")
         except Exception as e:
-            app_instance.logger.error(f"Scheduler: Error during scheduled download phase: {e}", exc_info=True)
-            # Optionally, decide if you want to proceed to upload phase if download fails
-            # For now, we'll let it proceed to attempt uploading any previously downloaded files.
+            # Still upload any previously downloaded files
+            current_app.logger.error(f"{log_prefix}: Error during download phase: {e}", exc_info=True)
 
-        # --- Upload Phase ---
-        app_instance.logger.info("Scheduler: Starting scheduled upload job.")
-        uploaded_count = 0
-        failed_count = 0
-        
-        # Retrieve GPX_FILES_DIR from config, defaulting if not set
-        gpx_base_path = '/garmin/activities/'
+        backlog = pending_uploads_query(account['name']).with_entities(DownloadRecord.id).all()
+        for (record_id,) in backlog:
+            if budget is not None and budget.exhausted:
+                current_app.logger.info(f"{log_prefix}: Run budget exhausted ({budget.stop_reason}), leaving the rest of the backlog for the next run.")
+                break
+            pipeline.submit(record_id)
 
-        # Find all records that haven't been uploaded to Dawarich
-        records_to_upload = DownloadRecord.query.filter(
-            (DownloadRecord.dawarich == False) | (DownloadRecord.dawarich == None)
-        ).order_by(DownloadRecord.id.asc()).all()
+    return {'downloaded': downloaded, 'uploaded': pipeline.uploaded, 'failed': pipeline.failed,
+            'remaining': pending_uploads_query(account['name']).count()}
 
-        if not records_to_upload:
-            app_instance.logger.info("Scheduler: No new files to upload to Dawarich.")
-            return
 
-        app_instance.logger.info(f"Scheduler: Found {len(records_to_upload)} file(s) to attempt uploading.")
+def _sync_account_range(account, startdate, enddate, log_label):
+    return sync_account(account, startdate, enddate, f"{log_label}[{account['name']}]")
 
-        for record in records_to_upload:
-            filename = record.filename
-            gpx_file_path = os.path.join(gpx_base_path, filename)
 
-            app_instance.logger.info(f"Scheduler: Attempting to upload {filename} (path: {gpx_file_path})")
+def sync_all_accounts(app, startdate, enddate, log_label):
+    """
+    Runs sync_account() for every account in parallel.
+    Returns (totals dict with downloaded/uploaded/failed, {account name: exception}).
+    """
+    results = run_for_accounts(app, _sync_account_range, startdate, enddate, log_label)
+    totals = {'downloaded': 0, 'uploaded': 0, 'failed': 0}
+    errors = {}
+    for name, result in results.items():
+        if isinstance(result, Exception):
+            errors[name] = result
+            continue
+        for key in totals:
+            totals[key] += result[key]
+    return totals, errors
 
-            if not os.path.exists(gpx_file_path):
-                app_instance.logger.error(f"Scheduler: File {gpx_file_path} not found for record ID {record.id}. Skipping.")
-                # Optionally, mark as failed or handle differently in the DB
-                failed_count +=1
-                continue
 
-            try:
-                success = submit_location_data(gpx_file_path)
-                
-                if success:
-                    record.dawarich = True
-                    db.session.commit()
-                    app_instance.logger.info(f"Scheduler: Successfully uploaded {filename} and updated database record ID {record.id}.")
-                    uploaded_count += 1
-                else:
-                    # This case might be hit if submit_location_data returns False for non-critical issues.
-                    app_instance.logger.warning(f"Scheduler: Upload of {filename} reported non-success by submit_location_data.")
-                    failed_count += 1
-            
-            except Exception as e:
-                db.session.rollback() 
-                app_instance.logger.error(f"Scheduler: Failed to upload {filename}: {e}", exc_info=True)
-                failed_count += 1
-            
-            finally:
-                # Delay before processing the next file, if there are more files
-                if record != records_to_upload[-1]: # Check if it's not the last record
-                    app_instance.logger.info(f"Scheduler: Waiting 5 seconds before next upload...")
-                    time.sleep(5)
-        
-        app_instance.logger.info(f"Scheduler: Upload job finished. Successfully uploaded: {uploaded_count}, Failed/Skipped: {failed_count}.")
+def upload_record(record, log_prefix, account=None):
+    """
+    Uploads one record's GPX file to the Dawarich instance of its account and
+    updates the record. Returns True when the upload was verified.
+    """
+    from storage import record_path
+
+    filename = record.filename
+    gpx_file_path = record_path(record)
+    if record.relpath is None and not os.path.exists(gpx_file_path):
+        # The layout migration may have just moved the file
+        db.session.refresh(record)
+        gpx_file_path = record_path(record)
+
+    current_app.logger.info(f"{log_prefix}: Attempting to upload {filename} (path: {gpx_file_path})")
+
+    if not os.path.exists(gpx_file_path):
+        current_app.logger.error(f"{log_prefix}: File {gpx_file_path} not found for record ID {record.id}. Skipping.")
+        record.file_exists = False
+        db.session.commit()
+        return False
+
+    try:
+        success = submit_location_data(gpx_file_path, account=account or get_account(record.account))
+
+        if success:
+            record.dawarich = True
+            delete_uploaded_file(record, log_prefix)
+            record.file_exists = os.path.exists(gpx_file_path)
+            db.session.commit()
+            invalidate_record_stats()
+            current_app.logger.info(f"{log_prefix}: Successfully uploaded {filename} and updated database record ID {record.id}.")
+            return True
+
+        # This case might be hit if submit_location_data returns False for non-critical issues.
+        current_app.logger.warning(f"{log_prefix}: Upload of {filename} reported non-success by submit_location_data.")
+        return False
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"{log_prefix}: Failed to upload {filename}: {e}", exc_info=True)
+        return False
 
 
-GARMIN_TOKENSTORE = '/garmin/.garminconnect'
-GARMIN_TOKENSTORE_B64 = '/garmin/.garminconnect_base64'
+def delete_uploaded_file(record, log_prefix):
+    """
+    Applies the delete_old_gpx setting to a record uploaded to Dawarich:
+    removes its GPX file, unless exports of the file are still pending. The
+    export worker then removes it once they are done. Callers update
+    record.file_exists.
+    """
+    from exports import has_pending_exports
+    from storage import record_path
+
+    settings = get_settings()
+    if not (settings and settings.delete_old_gpx):
+        return
+    gpx_path = record_path(record)
+    if has_pending_exports(record.id):
+        current_app.logger.info(f"{log_prefix}: Keeping uploaded file {gpx_path} until its exports are done.")
+        return
+    try:
+        os.remove(gpx_path)
+        current_app.logger.info(f"{log_prefix}: Deleted successfully uploaded file as per user setting: {gpx_path}")
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        current_app.logger.error(f"{log_prefix}: Failed to delete file {gpx_path}: {e}", exc_info=True)
 
 
-def get_garmin_login_status():
-    """Check whether valid Garmin tokens exist.
+def get_garmin_login_status(account=None):
+    """Check whether valid Garmin tokens exist for an account.
 
     Returns a dict with:
         logged_in (bool): True if tokens exist and can be loaded
         display_name (str|None): The Garmin display name if available
     """
-    tokenstore = GARMIN_TOKENSTORE
+    from garminconnect import Garmin
+
+    tokenstore, _ = account_tokenstore(account or get_account())
     try:
         gc = Garmin()
         gc.login(tokenstore)
@@ -281,23 +640,28 @@ def get_garmin_login_status():
         return {"logged_in": False, "display_name": None}
 
 
-def garmin_interactive_login(email, password):
+def garmin_interactive_login(email, password, account=None):
     """Begin an interactive Garmin login from the web UI.
 
     Returns a dict with:
         status: "success" | "needs_mfa" | "error"
         message: Human-readable message
-    On "needs_mfa", the MFA client state is stored in app.config
+    On "needs_mfa", the MFA client state is stored in app.config (per account)
     so that garmin_complete_mfa() can finish the flow.
     """
-    tokenstore = GARMIN_TOKENSTORE
+    from garminconnect import (
+        Garmin, GarminConnectAuthenticationError, GarminConnectTooManyRequestsError,
+    )
+
+    account = account or get_account()
+    tokenstore, tokenstore_b64 = account_tokenstore(account)
     try:
         gc = Garmin(email=email, password=password, return_on_mfa=True)
         result = gc.login()
 
         if isinstance(result, tuple) and result[0] == "needs_mfa":
             # Stash the Garmin client + MFA state for the next step
-            current_app.config['_GARMIN_MFA_STATE'] = {
+            current_app.config['_GARMIN_MFA_STATE'][account['name']] = {
                 'gc': gc,
                 'client_state': result[1],
             }
@@ -308,7 +672,7 @@ def garmin_interactive_login(email, password):
 
         # No MFA needed — save tokens
         gc.garth.dump(tokenstore)
-        with open(GARMIN_TOKENSTORE_B64, "w") as f:
+        with open(tokenstore_b64, "w") as f:
             f.write(gc.garth.dumps())
         current_app.logger.info("Garmin interactive login successful (no MFA).")
         return {
@@ -328,15 +692,19 @@ def garmin_interactive_login(email, password):
         return {"status": "error", "message": f"Login failed: {e}"}
 
 
-def garmin_complete_mfa(mfa_code):
+def garmin_complete_mfa(mfa_code, account=None):
     """Complete an MFA challenge started by garmin_interactive_login().
 
     Returns a dict with:
         status: "success" | "error"
         message: Human-readable message
     """
-    tokenstore = GARMIN_TOKENSTORE
-    mfa_state = current_app.config.get('_GARMIN_MFA_STATE')
+    from garth.exc import GarthHTTPError
+
+    account = account or get_account()
+    tokenstore, tokenstore_b64 = account_tokenstore(account)
+    pending_mfa = current_app.config['_GARMIN_MFA_STATE']
+    mfa_state = pending_mfa.get(account['name'])
 
     if not mfa_state:
         return {"status": "error", "message": "No pending MFA session. Please start the login again."}
@@ -349,11 +717,11 @@ def garmin_complete_mfa(mfa_code):
 
         # Save tokens
         gc.garth.dump(tokenstore)
-        with open(GARMIN_TOKENSTORE_B64, "w") as f:
+        with open(tokenstore_b64, "w") as f:
             f.write(gc.garth.dumps())
 
         # Clear MFA state
-        current_app.config.pop('_GARMIN_MFA_STATE', None)
+        pending_mfa.pop(account['name'], None)
 
         current_app.logger.info("Garmin MFA login completed successfully.")
         return {
@@ -365,24 +733,24 @@ def garmin_complete_mfa(mfa_code):
     except GarthHTTPError as e:
         error_str = str(e)
         if "429" in error_str:
-            current_app.config.pop('_GARMIN_MFA_STATE', None)
+            pending_mfa.pop(account['name'], None)
             return {"status": "error", "message": "Too many attempts. Please wait and start login again."}
         elif "401" in error_str or "403" in error_str:
             return {"status": "error", "message": "Invalid MFA code. Please try again."}
         else:
-            current_app.config.pop('_GARMIN_MFA_STATE', None)
+            pending_mfa.pop(account['name'], None)
             current_app.logger.error(f"Garmin MFA failed: {e}", exc_info=True)
             return {"status": "error", "message": f"MFA verification failed: {e}"}
     except Exception as e:
-        current_app.config.pop('_GARMIN_MFA_STATE', None)
+        pending_mfa.pop(account['name'], None)
         current_app.logger.error(f"Garmin MFA failed: {e}", exc_info=True)
         return {"status": "error", "message": f"MFA verification failed: {e}"}
 
 
-def garmin_logout():
-    """Remove stored Garmin tokens."""
-    tokenstore = GARMIN_TOKENSTORE
-    b64_file = GARMIN_TOKENSTORE_B64
+def garmin_logout(account=None):
+    """Remove stored Garmin tokens of an account."""
+    account = account or get_account()
+    tokenstore, b64_file = account_tokenstore(account)
     removed = False
 
     if os.path.isdir(tokenstore):
@@ -393,7 +761,7 @@ def garmin_logout():
         removed = True
 
     # Clear any pending MFA state
-    current_app.config.pop('_GARMIN_MFA_STATE', None)
+    current_app.config['_GARMIN_MFA_STATE'].pop(account['name'], None)
 
     if removed:
         current_app.logger.info("Garmin tokens removed (logged out).")
@@ -402,17 +770,21 @@ def garmin_logout():
         return {"status": "success", "message": "Already logged out (no tokens found)."}
 
 
-def init_garmin():
-    """Initialise and return an authenticated Garmin client.
+def init_garmin(account=None):
+    """Initialise and return an authenticated Garmin client for an account.
 
-    Attempts token-based login first, then falls back to env-var
-    credentials.  If MFA is required the user is directed to use the
-    interactive login in the web UI.
+    Attempts token-based login first, then falls back to the account's
+    configured credentials.  If MFA is required the user is directed to use
+    the interactive login in the web UI.
     """
-    tokenstore = GARMIN_TOKENSTORE
+    from garminconnect import Garmin, GarminConnectAuthenticationError
+    from garth.exc import GarthHTTPError
+
+    account = account or get_account()
+    tokenstore, tokenstore_b64 = account_tokenstore(account)
 
-    email = current_app.config.get('GARMIN_EMAIL')
-    pwd   = current_app.config.get('GARMIN_PASSWORD')
+    email = account.get('garmin_email')
+    pwd   = account.get('garmin_password')
 
     # 1. Try cached tokens
     try:
@@ -438,7 +810,7 @@ def init_garmin():
                 "Please log in via the Settings page in the web UI."
             )
         gc.garth.dump(tokenstore)
-        with open(GARMIN_TOKENSTORE_B64, "w") as f:
+        with open(tokenstore_b64, "w") as f:
             f.write(gc.garth.dumps())
         gc.login(tokenstore)
     except (RuntimeError, ValueError):
@@ -449,113 +821,257 @@ def init_garmin():
     return gc
 
 def download_activities(startdate: datetime.datetime,
-                        enddate:   datetime.datetime) -> int:
-    save_to = "/garmin/activities"
-    os.makedirs(save_to, exist_ok=True)
-    gc = init_garmin()
-    activities = gc.get_activities_by_date(
-        startdate.strftime("%Y-%m-%d"), enddate.strftime("%Y-%m-%d")
-    )
-    
-    exclusions = current_app.config.get('EXCLUDE', [])
+                        enddate:   datetime.datetime,
+                        account:   dict = None,
+                        on_saved = None,
+                        use_cache: bool = False) -> int:
+    """
+    Downloads an account's activities with location data in a date range.
+    on_saved, if given, is called with the id of each new DownloadRecord
+    right after it is committed, e.g. to hand the file to an upload stage.
+    With use_cache, days whose listing is already stored in the activities
+    table are not listed on Garmin again.
+    Returns the number of files saved.
+    """
+    from activities import list_activity_rows, skip_reasons, set_skip_reason, SKIP_NO_GPS, SKIP_EXCLUDED
+    from filters import ActivityFilter, record_filter_stats
+
+    from storage import new_activity_path
+
+    account = account or get_account()
+
+    gc = None
+    def garmin():
+        nonlocal gc
+        if gc is None:
+            gc = init_garmin(account)
+        return gc
+
+    activities = list_activity_rows(garmin, account['name'], startdate, enddate, use_cache)
+
+    # Filter rules and name exclusions are evaluated on the summaries, before any download
+    activity_filter = ActivityFilter.for_account(current_app.config, account)
     saved = 0
+    skips_changed = False
+
+    # Diff the listing against the existing records in one query
+    filenames = {
+        act['activity_id']: f"{act['start_time'].strftime('%Y-%m-%d')}_{act['activity_id']}.gpx"
+        for act in activities
+    }
+    downloaded = {
+        filename for (filename,) in db.session.query(DownloadRecord.filename).filter(
+            DownloadRecord.account == account['name'],
+            DownloadRecord.filename.in_(filenames.values()),
+        )
+    } if filenames else set()
+
+    # Outcomes of earlier runs, so known non-GPS activities are never downloaded again
+    skipped = skip_reasons(filenames)
 
     for act in activities:
-        name = act.get("activityName", "")
-        if name in exclusions:
-            current_app.logger.info(f"Skipping excluded activity: {name}")
+        name     = act['name']
+        act_id   = act['activity_id']
+        filename = filenames[act_id]
+
+        rule = activity_filter.match(act)
+        if rule:
+            current_app.logger.info(f"Skipping activity {act_id} ('{name}'), excluded by filter '{rule}'.")
+            if skipped.get(act_id) != SKIP_EXCLUDED:
+                set_skip_reason(act_id, SKIP_EXCLUDED)
+                db.session.commit()
+                skips_changed = True
             continue
+        if skipped.get(act_id) == SKIP_EXCLUDED:
+            # No longer matched by any filter
+            set_skip_reason(act_id, None)
+            db.session.commit()
+            skips_changed = True
 
-        act_id   = act["activityId"]
-        act_date = datetime.datetime.strptime(
-            act["startTimeLocal"], "%Y-%m-%d %H:%M:%S"
-        ).strftime("%Y-%m-%d")
-        filename = f"{act_date}_{act_id}.gpx"
-
-        if DownloadRecord.query.filter_by(filename=filename).first():
+        if filename in downloaded:
             current_app.logger.info(f"Already downloaded, skipping: {filename}")
             continue
 
-        data = gc.download_activity(
-            act_id,
-            dl_fmt=gc.ActivityDownloadFormat.GPX
-        )
+        if skipped.get(act_id) == SKIP_NO_GPS:
+            current_app.logger.info(f"Skipping activity {act_id} ('{name}'), known to contain no location data.")
+            continue
 
-        # Parse the GPX data and check for trackpoints
-        # The 'xml' parser requires a library like 'lxml' to be installed.
-        soup = BeautifulSoup(data, 'lxml-xml')
-        if not soup.find('trkpt'):
+        # Written atomically before the record is committed, so a crash never leaves a partial file behind
+        relpath, path = new_activity_path(filename)
+        points = _save_activity(garmin(), act, path)
+        if points is None:
+            continue
+        if not points:
             current_app.logger.info(f"Skipping activity {act_id} ('{name}') as it contains no location data.")
+            set_skip_reason(act_id, SKIP_NO_GPS)
+            db.session.commit()
+            skips_changed = True
             continue
 
-        path = os.path.join(save_to, filename)
-        with open(path, "wb") as fb:
-            fb.write(data)
-
-        # Copy GPX to GeoPulse path if enabled and configured
-        geopulse_enable = current_app.config.get('GEOPULSE_ENABLE', False)
-        geopulse_user = current_app.config.get('GEOPULSE_USER', '')
-        geopulse_path = current_app.config.get('GEOPULSE_PATH', '')
-
-        if geopulse_enable and geopulse_user and geopulse_path:
-            try:
-                dest_dir = os.path.join(geopulse_path, geopulse_user)
-                os.makedirs(dest_dir, exist_ok=True)
-                dest_file = os.path.join(dest_dir, filename)
-                shutil.copy2(path, dest_file)
-                current_app.logger.info(f"Copied GPX to GeoPulse: {dest_file}")
-            except Exception as e:
-                current_app.logger.error(f"Failed to copy GPX to GeoPulse: {e}")
-
-        record = DownloadRecord(filename=filename)
+        stat = os.stat(path)
+        record = DownloadRecord(
+            filename=filename, relpath=relpath, account=account['name'], activity_id=act_id,
+            file_exists=True, file_size=stat.st_size,
+            file_mtime=datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc).replace(tzinfo=None),
+        )
         db.session.add(record)
+        db.session.flush()
+        # Exports (e.g. GeoPulse) are queued here and run by the export worker
+        queue_exports(record)
         db.session.commit()
+        # Exported before the upload stage can delete the file (delete_old_gpx waits for them anyway)
+        notify_export_worker()
+        downloaded.add(filename)
         saved += 1
+        if on_saved:
+            on_saved(record.id)
 
+    record_filter_stats(current_app.config, account['name'], activity_filter)
+    if saved or skips_changed:
+        invalidate_record_stats()
     return saved
 
 
+def _activity_chunks(client, act_id, dl_fmt):
+    """
+    Yields the body of an activity download in chunks. With a garth-based
+    client the response is streamed; otherwise it arrives in one piece.
+    """
+    from storage import DOWNLOAD_CHUNK_SIZE
+
+    garth_client = getattr(client, 'garth', None)
+    if garth_client is None:
+        yield client.download_activity(act_id, dl_fmt=dl_fmt)
+        return
+    if dl_fmt == client.ActivityDownloadFormat.ORIGINAL:
+        base = client.garmin_connect_fit_download
+    else:
+        base = client.garmin_connect_gpx_download
+    response = garth_client.get("connectapi", f"{base}/{act_id}", api=True, stream=True)
+    try:
+        yield from response.iter_content(DOWNLOAD_CHUNK_SIZE)
+    finally:
+        response.close()
+
 
-def submit_location_data(gpx_path: str, source: str = "gpx") -> bool:
+def _save_activity(client, act, path):
     """
-    1) Log in and get CSRF token
-    2) Fetch the import form to get the direct-upload URL and import CSRF token
-    3) Direct-upload the GPX file blob metadata
-    4) Upload the actual GPX file
-    5) Submit the import form with the signed_id of the uploaded blob
-    6) Check if upload was successful
+    Downloads one activity and stores it as GPX at path. The file is written
+    through a temporary file and only renamed into place once it is complete,
+    fsynced and has track points, so every GPX on disk can be uploaded as is.
+    With GARMIN_DOWNLOAD_FORMAT=original the zipped FIT file is downloaded
+    and converted locally, falling back to Garmin's GPX export if it cannot
+    be read.
+    Returns the number of track points (0: nothing written), or None when
+    the download was malformed and should be retried on a later run.
     """
-    if not check_dawarich_connection():
-        current_app.logger.error("submit_location_data: Aborting due to failed Dawarich connection check.")
-        return False
+    from lxml import etree
+    from storage import AtomicFile, TrackpointCounter
 
-    current_app.logger.info(f"submit_location_data: Starting import for {gpx_path}, source={source}")
-    # -- 1) LOGIN ---------------------------------------------------------
-    host  = current_app.config.get('DAWARICH_HOST')
-    login_url =f'{host}/users/sign_in'
+    act_id = act['activity_id']
+    if current_app.config.get('GARMIN_DOWNLOAD_FORMAT') == 'original':
+        from fit_to_gpx import original_to_gpx, FitError
+
+        # The zip index is at the end of the archive, so the small FIT download is read whole
+        original = b''.join(_activity_chunks(client, act_id, client.ActivityDownloadFormat.ORIGINAL))
+        try:
+            with AtomicFile(path) as f:
+                points = original_to_gpx(original, f, act['name'], act['activity_type'])
+                if not points:
+                    f.discard()
+            return points
+        except FitError as e:
+            current_app.logger.warning(f"Could not convert the FIT file of activity {act_id}, downloading GPX instead: {e}")
+
+    counter = TrackpointCounter()
+    received = 0
+    with AtomicFile(path) as f:
+        for chunk in _activity_chunks(client, act_id, client.ActivityDownloadFormat.GPX):
+            f.write(chunk)
+            counter.feed(chunk)
+            received += len(chunk)
+        try:
+            # An empty response means the activity has no track
+            points = counter.close() if received else 0
+        except etree.XMLSyntaxError as e:
+            current_app.logger.error(f"Downloaded GPX of activity {act_id} is malformed or truncated, not saving it: {e}")
+            points = None
+        if not points:
+            f.discard()
+    return points
+
+
+def _download_account(account, startdate, enddate, pipelines=None, use_cache=False):
+    from recovery import check_records_rebuilt
+
+    check_records_rebuilt(current_app)
+    on_saved = pipelines[account['name']].submit if pipelines else None
+    return download_activities(startdate, enddate, account, on_saved=on_saved, use_cache=use_cache)
 
-    user = current_app.config.get('DAWARICH_EMAIL') 
-    pwd  = current_app.config.get('DAWARICH_PASSWORD')
 
+def download_all_accounts(app, startdate, enddate, pipelines=None, use_cache=False):
+    """
+    Downloads activities for every account in parallel. With pipelines
+    (account name -> UploadPipeline) each saved file is queued for upload.
+    use_cache lets settled days be answered from the stored activity listing.
+    Returns (number of files saved, {account name: exception} for failed accounts).
+    """
+    results = run_for_accounts(app, _download_account, startdate, enddate, pipelines, use_cache)
+    errors = {name: result for name, result in results.items() if isinstance(result, Exception)}
+    saved = sum(result for result in results.values() if not isinstance(result, Exception))
+    return saved, errors
+
+
+
+def dawarich_login(account, log_prefix="Dawarich"):
+    """Returns a requests session logged in to the account's Dawarich instance."""
+    import requests
+    from bs4 import BeautifulSoup
+
+    login_url = f"{account.get('dawarich_host')}/users/sign_in"
     sess = requests.Session()
     # first GET login page to retrieve CSRF token
     page = sess.get(login_url)
     page.raise_for_status()
     soup = BeautifulSoup(page.text, 'html.parser')
     token = soup.find('input', {'name': 'authenticity_token'})['value']
-    current_app.logger.debug(f"submit_location_data: Step 1: Fetched login CSRF token={token[:8]}…")
+    current_app.logger.debug(f"{log_prefix}: Fetched login CSRF token={token[:8]}…")
 
     # now POST credentials + token
     data = {
-        'user[email]': user,
-        'user[password]': pwd,
+        'user[email]': account.get('dawarich_email'),
+        'user[password]': account.get('dawarich_password'),
         'authenticity_token': token
     }
-    current_app.logger.debug(f"submit_location_data: Step 1: POSTing login credentials to {login_url}")
+    current_app.logger.debug(f"{log_prefix}: POSTing login credentials to {login_url}")
     resp = sess.post(login_url, data=data)
     resp.raise_for_status()
-    current_app.logger.info(f"submit_location_data: Step 1: Login successful to {login_url}")
-    current_app.logger.debug(f"submit_location_data: Step 1: Session cookies after login: {sess.cookies.get_dict()}")
+    current_app.logger.info(f"{log_prefix}: Login successful to {login_url}")
+    current_app.logger.debug(f"{log_prefix}: Session cookies after login: {sess.cookies.get_dict()}")
+    return sess
+
+
+def submit_location_data(gpx_path: str, source: str = "gpx", account: dict = None) -> bool:
+    """
+    1) Log in and get CSRF token
+    2) Fetch the import form to get the direct-upload URL and import CSRF token
+    3) Direct-upload the GPX file blob metadata
+    4) Upload the actual GPX file
+    5) Submit the import form with the signed_id of the uploaded blob
+    6) Check if upload was successful
+    """
+    import requests
+    from bs4 import BeautifulSoup
+
+    account = account or get_account()
+    if not check_dawarich_connection(account=account):
+        current_app.logger.error("submit_location_data: Aborting due to failed Dawarich connection check.")
+        return False
+
+    current_app.logger.info(f"submit_location_data: Starting import for {gpx_path}, source={source}")
+    # -- 1) LOGIN ---------------------------------------------------------
+    host = account.get('dawarich_host')
+    sess = dawarich_login(account, "submit_location_data: Step 1")
 
     # -- 2) IMPORT FORM ---------------------------------------------------
     form_url = f'{host}/imports/new'
@@ -711,15 +1227,6 @@ def submit_location_data(gpx_path: str, source: str = "gpx") -> bool:
             
     if found:
         current_app.logger.info(f"submit_location_data: Step 6: Verification successful. Found {filename} in imports list.")
-        
-        # Check settings to see if we should delete the file
-        settings = UserSettings.query.first()
-        if settings and settings.delete_old_gpx:
-            try:
-                os.remove(gpx_path)
-                current_app.logger.info(f"submit_location_data: Deleted successfully uploaded file as per user setting: {gpx_path}")
-            except OSError as e:
-                current_app.logger.error(f"submit_location_data: Failed to delete file {gpx_path}: {e}", exc_info=True)
 
         current_app.logger.info(f"submit_location_data: Successfully imported {filename} (blob signed_id: {signed_id[:15]}…).")
         return True
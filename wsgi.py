@@ -0,0 +1,17 @@
+# ========================================================
+# = wsgi.py - WSGI entry point for production servers
+# ========================================================
+# Used by gunicorn (see gunicorn.conf.py):
+#   gunicorn -c gunicorn.conf.py wsgi:app
+# Background services are not started here; gunicorn's post_fork hook starts
+# them in exactly one worker.
+import logging
+from app import create_app
+
+app = create_app(start_services=False)
+
+# Log through gunicorn's error log, at its --log-level
+gunicorn_logger = logging.getLogger('gunicorn.error')
+if gunicorn_logger.handlers:
+    app.logger.handlers = gunicorn_logger.handlers
+    app.logger.setLevel(gunicorn_logger.level)